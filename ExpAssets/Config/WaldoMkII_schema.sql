@@ -66,6 +66,8 @@ CREATE TABLE trials (
 	participant_id integer key not null,
 	block_num integer not null,
 	trial_num integer not null,
+	frames_drawn integer not null,
+	frames_skipped integer not null,
 	bg_image text not null,
   timed_out text not null,
   rt float not null,
@@ -95,5 +97,67 @@ CREATE TABLE trial_locations (
   timed_out text not null,
   rt float not null,
   fixate_trial_time float not null,
-  fixate_el_time float not null
-);
\ No newline at end of file
+  fixate_el_time float not null,
+  onset_error float not null
+);
+/*
+trial_summary is maintained by the experiment as each trial is committed: one row per trial, with the
+SRT (-1 if timed out), timeout flag and X/Y of up to 12 targets in reverse order, ie. srt_1 is the final target's.
+Columns of targets a trial didn't have are -1. See waldo/summary.py.
+*/
+CREATE TABLE trial_summary (
+  trial_id integer primary key not null,
+  participant_id integer not null,
+  block_num integer not null,
+  trial_num integer not null,
+  srt_1 float not null,
+  timed_out_1 integer not null,
+  x_1 integer not null,
+  y_1 integer not null,
+  srt_2 float not null,
+  timed_out_2 integer not null,
+  x_2 integer not null,
+  y_2 integer not null,
+  srt_3 float not null,
+  timed_out_3 integer not null,
+  x_3 integer not null,
+  y_3 integer not null,
+  srt_4 float not null,
+  timed_out_4 integer not null,
+  x_4 integer not null,
+  y_4 integer not null,
+  srt_5 float not null,
+  timed_out_5 integer not null,
+  x_5 integer not null,
+  y_5 integer not null,
+  srt_6 float not null,
+  timed_out_6 integer not null,
+  x_6 integer not null,
+  y_6 integer not null,
+  srt_7 float not null,
+  timed_out_7 integer not null,
+  x_7 integer not null,
+  y_7 integer not null,
+  srt_8 float not null,
+  timed_out_8 integer not null,
+  x_8 integer not null,
+  y_8 integer not null,
+  srt_9 float not null,
+  timed_out_9 integer not null,
+  x_9 integer not null,
+  y_9 integer not null,
+  srt_10 float not null,
+  timed_out_10 integer not null,
+  x_10 integer not null,
+  y_10 integer not null,
+  srt_11 float not null,
+  timed_out_11 integer not null,
+  x_11 integer not null,
+  y_11 integer not null,
+  srt_12 float not null,
+  timed_out_12 integer not null,
+  x_12 integer not null,
+  y_12 integer not null
+);
+
+CREATE INDEX trial_summary_participant ON trial_summary (participant_id, block_num, trial_num);
@@ -2,15 +2,32 @@ import klibs
 
 __author__ = "Jonathan Mulle"
 
-from klibs import KLEyeLink
 from klibs.KLExceptions import *
 from klibs.KLUtilities import *
 import klibs.KLDraw as kld
-from klibs.KLNumpySurface import NumpySurface as ns
-from random import  choice, randrange
+from random import  choice, randrange, getrandbits, Random
+import itertools
 from klibs.KLEventInterface import EventTicket as ET
 from klibs.KLMixins import BoundaryInspector
-from copy import copy
+import os
+import sys
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, PROJECT_DIR)  # klibs loads this file by path; expose waldo/
+from waldo.timing import StartupProfile
+STARTUP = StartupProfile()  # phases from process start to the first trial's screen; see WaldoMkII.startup_phase()
+from waldo.assets import BackgroundStore
+from waldo.assetpack import AssetPack, PACK_NAME
+from waldo.targets import SequenceGenerator, location_records
+from waldo.compiler import CompiledSession, read_factors, cell_key, FACTORS, DISC_STROKE, generation_geometry
+from waldo.render import RetainedRenderer, SpriteCache, TextureCache
+from waldo.gaze import GazeMonitor, EXIT, FIXATE, SACCADE_END
+from waldo.timing import Scheduler, clock as perf_clock
+from waldo.datawriter import TrialDataWriter
+from waldo.instrument import TimingRecorder, DETECTION, ONSET, ONSET_DELAY
+from waldo.edfcodes import EventCodes
+from waldo.summary import pivot
+STARTUP.mark("imports")  # waldo.store, .stats & .balance are imported where they're first used, after this
 
 LOC = "location"
 AMP = "amplitude"
@@ -45,10 +62,11 @@ class WaldoMkII(klibs.Experiment, BoundaryInspector):
 	eyes_moved_message = None
 
 	# trial vars
-	bg_per_trial = []
 	locations = []
 	trial_type = None
-	backgrounds = {}
+	backgrounds = None  # BackgroundStore
+	next_bg_key = None  # drawn a trial early, so its image can be prefetched during the ITI
+	background_memory_budget = 48  # MB of mapped backgrounds (~9 MB each at 1920x1200); older ones are remapped on use
 	bg = None
 	bg_state = None
 	saccade_count = None
@@ -57,7 +75,38 @@ class WaldoMkII(klibs.Experiment, BoundaryInspector):
 	n_back = None  # populated from config
 	angle = None   # populated from config
 	n_back_index = None
+	final_angles = None  # the config's angle levels; every one must be reachable from the penultimate disc
+	target_generator = None
 	inter_disc_event_label = None  # set after each disc has been saccaded to
+	background_cache_dir = None  # defaults to ExpAssets/Resources/image/.cache
+	compiled_session_dir = None  # defaults to ExpAssets/Compiled; see waldo.compiler
+	compiled = None  # CompiledSession for this participant's random_seed, False if none was compiled
+	balance_cells = True  # choose each trial's cell so valid (non-recycled) trials stay balanced; see waldo.balance
+	stop_when_balanced = True  # end the session once every cell has trials_per_cell valid trials
+	trials_per_cell = None  # valid trials per cell; None is floor(trials_per_block * blocks_per_experiment / cells)
+	balancer = None  # CellBalancer
+	cell = None  # (angle, bg_state, n_back) of the current trial
+	renderer = None
+	sprites = None
+	textures = None  # persistent GL textures; None falls back to klibs' blit()
+	max_background_textures = 3
+	disc_sprite_key = None
+	gaze = None  # GazeMonitor; owns the tracker's link queue during the disc sequence
+	gaze_wait_interval = 0.001  # s, longest the trial loop blocks on gaze events before servicing the display
+	scheduler = None
+	writer = None  # TrialDataWriter; every row from a trial is committed at once, during the ITI
+	timing = None  # TimingRecorder; dumped to ExpAssets/Data/timing/p<participant_id>_timing.bin after each trial
+	display_refresh_rate = 60  # Hz, for counting missed vsyncs
+	location_data = None  # this trial's discs, one row each (waldo.targets.LOCATION); locations are views of it
+	disc_boundary_radius = None
+	event_codes = None  # EventCodes; structured EDF markup from which waldo.edfparse can rebuild the database
+	shown = None  # [background layer, drift correct target] on screen, so only changes are marked in the EDF
+	trial_row = None  # what trial() returned to klibs, forwarded to the central store when run by waldo.runner
+	process_edf = True  # hand the session's EDF to waldo.edfpipe at teardown, ie. transferred & indexed unattended
+	stats = None  # OnlineStats; per-cell summary rewritten to ExpAssets/Data/status/[<station>_]p<id>.json each trial
+	status_port = None  # also serve it on 127.0.0.1:<status_port>, for monitoring stations live; 0 picks a free port
+	startup_profile = True  # print the startup phase profile when the first trial's screen is up
+	startup_log = True  # and append it to ExpAssets/Data/startup.jsonl, to compare time to first screen across versions
 
 	def __init__(self, *args, **kwargs):
 		super(WaldoMkII, self).__init__(*args, **kwargs)
@@ -65,78 +114,122 @@ class WaldoMkII(klibs.Experiment, BoundaryInspector):
 		self.min_amplitude = deg_to_px(self.min_amplitude_deg)
 		self.disc_diameter = deg_to_px(self.disc_diameter_deg)
 		self.disc_boundary_tolerance = deg_to_px(self.disc_boundary_tolerance)
-		self.display_margin = int(self.disc_diameter * 1.5)
-		self.search_disc_proto = kld.Annulus(self.disc_diameter, int(self.disc_diameter * 0.25), (2,WHITE), BLACK)
+		self.display_margin = self.generation_geometry()["margin"]
+		self.final_angles = sorted(int(a) for a in read_factors()["angle"])
+		self.search_disc_proto = kld.Annulus(self.disc_diameter, int(self.disc_diameter * 0.25), (DISC_STROKE, WHITE),
+											 BLACK)
+		self.search_disc_proto.fill = self.search_disc_color
+		self.disc_boundary_radius = int(self.search_disc_proto.surface_width + self.disc_boundary_tolerance)
+		DiscLocation.exp = self
+		self.disc_sprite_key = ("annulus", self.disc_diameter, int(self.disc_diameter * 0.25), DISC_STROKE, tuple(WHITE),
+								tuple(self.search_disc_color))
+		self.renderer = RetainedRenderer()
+		self.sprites = SpriteCache()
+		self.scheduler = Scheduler()
+		self.timing = TimingRecorder(refresh_rate=self.display_refresh_rate)
+		self.event_codes = EventCodes()
+		self.shown = [False, None]
 		if Params.inter_disc_interval and Params.persist_to_exit_saccade:
 			raise RuntimeError("Params.inter_disc_interval and Params.persist_to_exit_saccade cannot both be set.")
+		# backgrounds load from here on, through demographics & setup(); block() only waits if they're still going
+		self.load_backgrounds()
+		self.startup_phase("__init__")
 
 	def setup(self):
+		try:
+			self.textures = TextureCache(self.max_background_textures)
+		except ImportError:
+			self.textures = None
 		r = kld.drift_correct_target().width * self.fixation_boundary_tolerance
 		self.eyelink.add_gaze_boundary("trial_fixation", [Params.screen_c, r], CIRCLE_BOUNDARY)
 		self.fill(Params.default_fill_color)
 		self.text_manager.add_style("msg", 64)
 		self.text_manager.add_style("err", 64, WHITE)
 		self.text_manager.add_style("tny", 12)
-		self.looked_away_msg = self.message("Looked away too soon.", "err", blit=False)
-		self.message("Loading, please hold...", "msg", flip=True)
+		from waldo.store import StoreClient
+		self.writer = TrialDataWriter(Params.database_path, remote=StoreClient.from_env())  # see waldo.runner
+		self.startup_phase("setup")
 
-		scale_images = False
+	def load_backgrounds(self):
 		image_list = range(1, 10) if not self.debug_mode else [1]
-		for i in image_list:
-			self.ui_request()
-			image_key = "wally_0{0}".format(i)
-			#  there are 3 sizes of image included by default; if none match the screen res, choose 1080p then scale
-			image_f = os.path.join(Params.image_dir, image_key,"{0}x{1}.jpg".format(*Params.screen_x_y))
-			with open(os.path.join(Params.image_dir, image_key, "average_color.txt")) as color_f:
-				avg_color = eval(color_f.read())
-			if not os.path.isfile(image_f):
-				#image_f = os.path.join(Params.image_dir, image_key, "1920x1080.jpg")
-				image_f = os.path.join(Params.image_dir, image_key, "1920x1200.jpg")
-				scale_images = True
-			img_ns = ns(image_f)
-
-			self.backgrounds[image_key] = ([image_key, img_ns, avg_color])
-			if scale_images:
-				self.backgrounds[image_key][1].scale(Params.screen_x_y)
-			self.backgrounds[image_key][1] = self.backgrounds[image_key][1].render()
-		while len(self.bg_per_trial) < (Params.trials_per_block * Params.blocks_per_experiment) + 1:
-			self.bg_per_trial.append(choice(self.backgrounds.keys()))
+		image_keys = ["wally_0{0}".format(i) for i in image_list]
+		#  decoding & scaling happen in worker processes (or not at all, on a warm cache); see waldo.assets
+		#  images are only mapped when a trial uses them, but any decoding has to finish before trials start
+		#  a current asset pack (python -m waldo.assetpack) replaces the jpgs & their decode entirely
+		pack = AssetPack.open(os.path.join(Params.image_dir, PACK_NAME))
+		self.backgrounds = BackgroundStore(Params.image_dir, Params.screen_x_y, image_keys,
+										   self.background_memory_budget, self.background_cache_dir, pack)
+		self.backgrounds.start()
+
+	def startup_phase(self, phase, last=False):
+		if STARTUP.reported:
+			return
+		STARTUP.mark(phase)
+		if last:
+			STARTUP.reported = True
+			if self.startup_profile:
+				print(STARTUP.format())
+			if self.startup_log:
+				from waldo.store import ENV_STATION
+				STARTUP.log(os.path.join(PROJECT_DIR, "ExpAssets", "Data", "startup.jsonl"),
+							participant_id=Params.participant_id, station=os.environ.get(ENV_STATION))
 
 	def block(self):
-		pass
+		if not self.backgrounds.ready():
+			self.message("Loading, please hold...", "msg", flip=True)
+		self.backgrounds.wait()  # returns at once after the first block
+		self.startup_phase("backgrounds")
+		if self.compiled is None:
+			compiled_dir = self.compiled_session_dir
+			if not compiled_dir:
+				compiled_dir = os.path.join(PROJECT_DIR, "ExpAssets", "Compiled")
+			self.compiled = CompiledSession.open(compiled_dir, Params.random_seed) or False
+			if self.compiled:
+				mismatches = self.compiled.check_geometry(self.generation_geometry())
+				if mismatches:  # demographics are in by now, so don't lose the session over it
+					print("Warning: {0} doesn't match this display ({1}); generating sequences live.".format(
+						self.compiled.path, ", ".join(mismatches)))
+					self.compiled = False
 
 	def setup_response_collector(self):
 		pass
 
 	def trial_prep(self):
+		self.writer.wait()  # the last trial's commit must be done before anything gaze-contingent starts
+		if self.balancer and self.balancer.done and self.stop_when_balanced:
+			# checked here rather than in trial_clean_up(), so klibs has logged the last trial's row before quit()
+			self.quit()
+		if self.balance_cells:
+			# klibs' own draw is overridden, so a recycled trial's cell doesn't get ahead of the others
+			if not self.balancer:
+				self.balancer = self.cell_balancer()
+			self.angle, self.bg_state, self.n_back = self.balancer.next() or (self.angle, self.bg_state, self.n_back)
 		self.angle = int(self.angle)
 		self.n_back = int(self.n_back)
-		self.saccade_count = randrange(self.min_saccades, self.max_saccades)
-		self.fill()
-		m = self.message("Generating targets...", blit=False)
-		self.blit(m)
-		self.flip()
-		errors = 0
-		while len(self.locations) != self.saccade_count:
-			self.fill()
-			self.blit(m, location=(25,25))
-			try:
-				self.generate_locations()
-			except (TrialException, ValueError):
-				errors += 1
-				self.message("Failed attempts: {0}".format(errors), location=(25,50))
-				self.locations = []
-			self.flip()
-
-		self.bg = self.background[choice(self.backgrounds.keys())]
+		self.cell = (self.angle, self.bg_state, self.n_back)
+		compiled = self.compiled.next(self.angle, self.bg_state, self.n_back) if self.compiled else None
+		if compiled:
+			sequence, bg_key = compiled
+			self.saccade_count = len(sequence)
+			self.generate_locations(sequence)
+		else:  # nothing compiled for this participant, or the cell's entries were used up by recycled trials
+			self.saccade_count = randrange(self.min_saccades, self.max_saccades)
+			self.generate_locations()
+			bg_key = self.next_bg_key if self.next_bg_key else choice(self.backgrounds.keys())
+		self.bg = self.backgrounds.get(bg_key)
 		Params.clock.register_event(ET("initial fixation end", Params.fixation_interval))
 		self.eyelink.drift_correct(boundary="trial_fixation")
+		self.renderer.reset()  # drift correct drew its own screen
+		self.scheduler.reset()
 		self.display_refresh(True)
+		self.startup_phase("first trial", last=True)
 
 	def trial(self):
 		if Params.development_mode:
 			return {"trial_num": Params.trial_number,
 					"block_num": Params.block_number,
+					"frames_drawn": -1,
+					"frames_skipped": -1,
 					"bg_image": "hi",
 					"timed_out": "FALSE",
 					"rt": -1.0,
@@ -149,7 +242,17 @@ class WaldoMkII(klibs.Experiment, BoundaryInspector):
 					"saccades": 1}
 
 		self.eyelink.start(Params.trial_number)
+		self.mark("trial_start", Params.participant_id, Params.trial_number, Params.block_number, self.bg[0],
+				  self.bg_state, self.n_back, self.angle, self.saccade_count)
+		for l in self.locations:
+			self.mark("location", l.index, l.x_y_pos[0], l.x_y_pos[1], l.amplitude, l.angle, l.rotation, l.n_back,
+					  l.penultimate, l.final)
+		self.shown = [False, None]
+		self.renderer.invalidate()  # so the screen drift correct left up is marked within the trial
 		self.initial_fixation()
+		if not self.gaze:
+			self.gaze = GazeMonitor(self.eyelink)
+		self.gaze.resume(self.eyelink.now())
 		show_dc_target = True
 		for l in self.locations:
 			# assert a previous location if there is one for reference later in the loop
@@ -159,24 +262,32 @@ class WaldoMkII(klibs.Experiment, BoundaryInspector):
 			else:
 				l_prev = None # ie. first location
 
+			self.gaze.arm(l.boundary, l.x_y_pos, l.boundary_radius)
+			l.onset_due = perf_clock()
 			self.display_refresh(show_dc_target, [l, l_prev]) # get this done right away for initial blit
-			while self.evi.before(l.event_timeout_label, True): # l.timed_out is True by default, must be written to False
+			timeout_label = l.event_timeout_label  # labels are built on demand; don't rebuild it every pass
+			while self.evi.before(timeout_label, True): # l.timed_out is True by default, must be written to False
 				if l.index == 0:
 					show_dc_target = not l.initial_blit
-				# show previous disc if it's not yet been left and Params.persist_to_exit_saccade == True
-				l.boundary_check()
-				if l_prev:
-					l_prev.check_persistence()  # if check sets state=False, display_refresh() will set off_timestamp
+				# blocks until the gaze thread reports something, or gaze_wait_interval passes
+				for event in self.gaze.drain(self.gaze_wait_interval):
+					l.boundary_check(event)
+					# show previous disc if it's not yet been left and Params.persist_to_exit_saccade == True
+					if l_prev:
+						l_prev.check_persistence(event)  # if check sets state=False, display_refresh() sets off_timestamp
 				if l.rt > 0:  # -1 by default
 					break
 				self.display_refresh(show_dc_target, [l, l_prev])
 				self.ui_request()
 			if l.timed_out is None:  # ie. should be False by now
 				l.timed_out = True
+				self.mark("timeout", l.index)
 
-		self.eyelink.stop()
-		return {"trial_num": Params.trial_number,
+		self.gaze.pause()
+		summary = {"trial_num": Params.trial_number,
 				"block_num": Params.block_number,
+				"frames_drawn": self.renderer.drawn,
+				"frames_skipped": self.renderer.skipped,
 				"bg_image": self.bg[0],
 				"timed_out": self.locations[-1].timed_out,
 				"rt": self.locations[-1].rt,
@@ -187,6 +298,11 @@ class WaldoMkII(klibs.Experiment, BoundaryInspector):
 				"real_angle": int(self.locations[-1].angle + self.locations[-1].rotation) % 360	,
 				"deviation": self.angle if self.angle <= 180 else self.angle - 180,
 				"saccades": self.saccade_count}
+		self.mark("trial_end", summary["timed_out"], summary["rt"], summary["target_type"], summary["amplitude"],
+				  summary["real_angle"], summary["deviation"], summary["frames_drawn"], summary["frames_skipped"])
+		self.eyelink.stop()
+		self.trial_row = summary
+		return summary
 
 	def trial_clean_up(self):
 #		if Params.development_mode:
@@ -211,31 +327,90 @@ class WaldoMkII(klibs.Experiment, BoundaryInspector):
 #				}, 'trial_locations', False)
 #
 		if Params.trial_id:  # ie. if this isn't a recycled trial
-			for l in self.locations:
-				self.database.insert( {
-				'participant_id': Params.participant_id,
-				'trial_id': Params.trial_id,
-				'trial_num': Params.trial_number,
-				'block_num': Params.block_number,
-				'location_num': l.index,
-				'x': l.x_y_pos[0],
-				'y': l.x_y_pos[1],
-				'amplitude': l.amplitude,
-				'angle': l.angle,
-				'n_back': l.n_back,
-				'penultimate': l.penultimate,
-				'final': l.final,
-				'timed_out': l.timed_out,
-				'rt': -1 if not l.rt else l.rt,
-				'fixate_trial_time': l.fixation[0],
-				'fixate_el_time': l.fixation[1],
-				},'trial_locations', False)
+			rows = location_records(self.location_data)
+			for row in rows:
+				row.update({'participant_id': Params.participant_id,
+							'trial_id': Params.trial_id,
+							'trial_num': Params.trial_number,
+							'block_num': Params.block_number})
+				self.writer.add('trial_locations', row)
+			# the wide, reverse-ordered row goes in the same transaction, so trial_summary never lags trial_locations
+			summary = pivot(rows)
+			summary.update({'participant_id': Params.participant_id,
+							'block_num': Params.block_number,
+							'trial_num': Params.trial_number})
+			self.writer.add('trial_summary', summary)
+			if self.writer.remote and self.trial_row:  # klibs writes trials rows itself, locally
+				self.writer.add('trials', dict(self.trial_row, participant_id=Params.participant_id), local=False)
+			self.writer.flush(trial_id=Params.trial_id)  # stamps the buffered events rows too
+			self.update_stats()
+			if self.balancer:
+				self.balancer.complete(self.cell)
+		else:
+			self.writer.discard()
+		timing_dir = os.path.join(PROJECT_DIR, "ExpAssets", "Data", "timing")
+		if not os.path.isdir(timing_dir):
+			os.makedirs(timing_dir)
+		timing_f = os.path.join(timing_dir, "p{0}_timing.bin".format(Params.participant_id))
+		self.timing.dump(timing_f, Params.trial_id if Params.trial_id else 0, Params.trial_number)  # 0: recycled
 		self.locations = []
+		self.location_data = None
 		self.eyelink.clear_boundaries(["trial_fixation"])
 		self.bg = None
+		self.trial_row = None
+		# compiled trials bring their own background, so there's nothing to predict; they're remapped on demand
+		self.next_bg_key = None if self.compiled else choice(self.backgrounds.keys())
+		if self.next_bg_key:
+			self.backgrounds.prefetch(self.next_bg_key)
+
+	def cell_balancer(self):
+		# seeded from klibs' (participant-seeded) random module, as the target generator is
+		factors = read_factors()
+		cells = [cell_key(*c) for c in itertools.product(*[factors[f] for f in FACTORS])]
+		from waldo.balance import CellBalancer
+		target = self.trials_per_cell
+		if target is None:
+			target = Params.trials_per_block * Params.blocks_per_experiment // len(cells)
+		return CellBalancer(cells, target, Random(getrandbits(32)))
+
+	def update_stats(self):
+		if not self.stats:
+			from waldo.stats import OnlineStats  # its http server imports are the slowest of waldo's
+			from waldo.store import ENV_STATION
+			station = os.environ.get(ENV_STATION)  # set by waldo.runner
+			name = "p{0}".format(Params.participant_id)  # one file per session; a station's earlier ones are kept
+			name = "{0}_{1}".format(station, name) if station else name
+			self.stats = OnlineStats(os.path.join(PROJECT_DIR, "ExpAssets", "Data", "status", name + ".json"), station)
+			if self.status_port is not None:
+				address = self.stats.serve(self.status_port)
+				print("Session status at http://{0}:{1}/".format(*address))
+		data = self.location_data
+		self.stats.participant_id = Params.participant_id
+		self.stats.add(self.cell, data["timed_out"][-1] == 1, float(data["rt"][-1]),
+					   len(data) - 1, int((data["timed_out"][:-1] == 1).sum()))
+		self.stats.write()
 
 	def clean_up(self):
-		pass
+		if self.gaze:
+			self.gaze.stop()
+		if self.stats:
+			self.stats.close()
+		if self.writer:
+			self.writer.close()
+		if self.backgrounds:
+			self.backgrounds.close()
+		if self.process_edf:
+			self.submit_edf()
+
+	def submit_edf(self):
+		# clean_up() runs before klibs closes its tracker connection & receives the EDF into edf_dir, so the pipeline
+		# waits for this process to exit and takes that copy; it never opens a tracker connection of its own
+		edf_name = getattr(Params, "edf_filename", None)
+		if not edf_name:
+			return
+		from waldo import edfpipe  # only needed at teardown
+		local_f = os.path.join(getattr(Params, "edf_dir", ""), edf_name)
+		edfpipe.launch("file:" + local_f, wait_pid=os.getpid())
 
 	def initial_fixation(self):
 		self.display_refresh(True)
@@ -243,31 +418,46 @@ class WaldoMkII(klibs.Experiment, BoundaryInspector):
 			if self.eyelink.saccade_from_boundary("trial_fixation"):
 				fif_e = ET("failed initial fixation", Params.clock.trial_time + 1.0, None, False, TK_S)
 				Params.clock.register_event(fif_e)
+				if not self.looked_away_msg:  # rendered on first use, rather than at startup
+					self.looked_away_msg = self.message("Looked away too soon.", "err", blit=False)
 				while self.evi.before("failed initial fixation", True):
 					self.fill(RED)
 					self.blit(self.looked_away_msg, BL_CENTER, Params.screen_c)
 					self.flip()
+				self.renderer.invalidate()
+				self.mark("fixation_failed")
 				raise TrialException("Gaze out of bounds.")
 		self.display_refresh(True)
 
 	def display_refresh(self, drift_correct=False, discs=[]):
-		#  handle the removal of background image on absent condition trials
 		self.ui_request()
+		#  handle the removal of background image on absent condition trials
 		if self.bg_state != BG_ABSENT:
 			try:
 				final = discs[0].final
 			except IndexError:
 				final = False
-			if final and self.bg_state == BG_INTERMITTENT:
-				self.fill(self.bg[2])
-			else:
-				self.blit(self.bg[1])
+			bg_layer = BG_ABSENT if final and self.bg_state == BG_INTERMITTENT else BG_PRESENT
+		else:
+			bg_layer = None
+
+		#  nothing changed since the last flip, so don't redraw it
+		visible = tuple(d.index for d in discs if d is not None and d.visible)
+		if not self.renderer.needs_redraw(bg_layer, drift_correct, visible):
+			return
+
+		blit_start = perf_clock()
+		if bg_layer == BG_PRESENT:
+			self.blit_sprite(self.bg[0], self.bg[1], background=True)
+		elif bg_layer == BG_ABSENT:
+			self.fill(self.bg[2])
 		else:
 			self.fill(GREY)
 
 		#  show the drift correct target if need be
 		if drift_correct:
-			self.blit(kld.drift_correct_target(), position=Params.screen_c, registration=5)
+			dc_target = self.sprites.get("drift_correct_target", lambda: kld.drift_correct_target().render())
+			self.blit_sprite("drift_correct_target", dc_target, 5, Params.screen_c)
 
 		#  blit passed discs if they're allow_blit attribute is set
 		for d in discs:
@@ -275,240 +465,355 @@ class WaldoMkII(klibs.Experiment, BoundaryInspector):
 				d.blit()  # disc manages whether this function executes or not based on it's state attribute
 
 		self.flip()
+		el_time = self.el_now()
+		self.timing.frame(blit_start, perf_clock(), el_time)
+		if self.shown[0] != bg_layer:
+			self.mark("background", bg_layer)
+		if self.shown[1] != drift_correct:
+			self.mark("dc_target", drift_correct)
+		self.shown = [bg_layer, drift_correct]
 
 		#  log timestamps for discs turning on or off
 		for d in discs:
 			if d is not None:
-				timestamp = [Params.clock.trial_time, self.eyelink.now()]
+				timestamp = [Params.clock.trial_time, el_time]
 				if d.allow_blit:
 					if not d.on_timestamp:
 						d.record_start(timestamp)
 				elif not d.off_timestamp and d.initial_blit:
 					d.off_timestamp = timestamp
+					self.mark("disc_off", d.index, timestamp[0])
 
-	def generate_locations(self):
-		self.n_back_index = self.saccade_count - (2 + self.n_back)  # 1 for index, 1 b/c  n_back counts from penultimate saccade
-		failed_generations = 0
-
-		# generate locations until there are enough for the trial
-		while len(self.locations) < self.saccade_count:
+	def mark(self, code, *args):
+		# one line of EDF markup per state change; see ExpAssets/Config/WaldoMkII_messaging.csv
+		message = self.event_codes.format(code, *args)
+		if self.gaze and self.gaze.running.is_set():
+			self.gaze.send(message)  # the gaze thread owns the link until pause()
+		else:
+			self.eyelink.sendMessage(message)
+
+	def log_event(self, label, timestamp, code, *args):
+		# EDF markup goes out immediately; the events row waits for the trial's single commit in trial_clean_up()
+		self.mark(code, *args)
+		self.writer.add("events", {"user_id": Params.participant_id,
+								   "trial_id": -1,  # stamped on flush(), once klibs has inserted the trial
+								   "trial_num": Params.trial_number,
+								   "label": label,
+								   "trial_clock": timestamp[0],
+								   "eyelink_clock": timestamp[1]})
+
+	def service_delay(self, discs):
+		# keeps the ui & gaze events moving while the scheduler sleeps through an inter-disc interval
+		self.ui_request()
+		for event in self.gaze.drain(0):
+			for d in discs:
+				d.check_persistence(event)
+
+	def el_now(self):
+		# while the gaze thread owns the link, take tracker time from its samples rather than calling in concurrently
+		if self.gaze and self.gaze.running.is_set():
+			return self.gaze.now()  # never None; resume() is given a starting tracker time
+		return self.eyelink.now()
+
+	def event_trial_time(self, event):
+		# the trial clock at the moment the gaze thread detected event, not when the trial loop got to it
+		return Params.clock.trial_time - (perf_clock() - event.detected_at)
+
+	def blit_sprite(self, key, content, registration=7, location=(0,0), background=False):
+		# content is uploaded to the GPU once per key, rather than on every blit
+		if self.textures:
+			self.textures.blit(key, content, registration, location, background)
+		else:
+			self.blit(content, registration, location)
+
+	def generation_geometry(self):
+		return generation_geometry(Params.screen_x_y, self.disc_diameter, self.min_amplitude, self.max_amplitude)
+
+	def generate_locations(self, sequence=None):
+		if sequence is None:
+			if not self.target_generator:
+				# seeded from klibs' (participant-seeded) random module so sequences are reproducible per participant
+				g = self.generation_geometry()
+				self.target_generator = SequenceGenerator(Params.screen_x_y, g["margin"], g["min_amplitude"],
+														  g["max_amplitude"], g["min_separation"], self.final_angles,
+														  seed=getrandbits(32))
+			sequence = self.target_generator.generate(self.saccade_count, self.n_back, self.angle)
+		self.n_back_index = sequence.n_back_index
+		self.location_data = sequence.to_array()
+		self.locations = [DiscLocation(i) for i in range(len(sequence))]
+		for l in self.locations:
 			self.ui_request()
-			try:
-				self.locations.append(DiscLocation(self))
-			except TrialException:
-				failed_generations += 1
-				if failed_generations > 10:
-					raise
-				self.generate_locations()
+			l.add_boundary()
 
 
 class DiscLocation(object):
+	"""A view of one row of WaldoMkII.location_data (see waldo.targets.LOCATION), which holds all of a disc's state.
 
-	def __init__(self, exp):
-		self.errors = 0
-		self.exp = exp
-		try:
-			self.origin = self.exp.locations[-1].x_y_pos
-		except IndexError:
-			self.origin = Params.screen_c
-		self.initial_blit = False
-		self.amplitude = None
-		self.angle = None
-		self.rotation = 0
-		self.index = len(self.exp.locations)
-		self.boundary = "saccade_{0}".format(self.index)
-		self.boundary_img = None
-		self.x_y_pos = (None, None)
-		self.x_range = range(self.exp.display_margin, Params.screen_x - self.exp.display_margin)
-		self.y_range = range(self.exp.display_margin, Params.screen_y - self.exp.display_margin)
-		self.viable = True
-		self.exp.search_disc_proto.fill = self.exp.search_disc_color
-		self.persists = Params.persist_to_exit_saccade
-		self.timeout_interval = Params.disc_timeout_interval
-		self.penultimate = self.index == self.exp.saccade_count - 2
-		self.n_back = self.index == self.exp.n_back_index
-
-		# next attributes are for use during trial
-		self.__exit_time = None
-		self.on_timestamp = None
-		self.off_timestamp = None
-		self.timeout_at = None  # records the onset time of the timeout event, to be updated after first blit
-		self.__timed_out = None  # only set to false once fixated
-		self.previous_disc = None  # only set in trials when Params.inter_disc_interval is not False
-		self.fixation = [-1.0, -1.0]  # will be Params.clock.trial_time & eyelink.now() if fixated before timeout
-		self.rt = -1.0  # only the final location will populate this value
-		self.final = self.index == self.exp.saccade_count - 1
-		self.allow_blit = True
-		self.idi = Params.inter_disc_interval  # shorthand for coding
-		if self.idi and self.index == 0:
-			self.idi = 0  # no onset delay for first disc
-			self.allow_blit = True
+	Labels & timestamps are built when asked for and the disc surface comes from the shared sprite cache, so a trial's
+	discs cost one small structured array rather than a dozen heavyweight objects.
+	"""
+	__slots__ = ["index", "row"]
+	exp = None  # set once, by WaldoMkII.__init__()
 
-		if self.final:
-			self.timeout_interval = Params.final_disc_timeout_interval
-
-		while self.angle is None:
-			self.exp.ui_request()
-			try:
-				self.__generate_location__()
-			except TrialException:
-				self.errors += 1
-				if self.errors > 10:
-					raise
-		self.disc = self.exp.search_disc_proto.render()
-		self.name = "L_{0}_{1}x{2}".format(self.index, self.x_y_pos[0], self.x_y_pos[1])
-		self.event_start_label = self.name + "_start"
-		self.event_timeout_label = self.name + "_timeout"
-		self.event_fixate_label = self.name + "_fixate"
-		self.event_exit_label = self.name + "_exit"
-		self.onset_delay_label = self.name + "_onset_delay_disc"
+	def __init__(self, index):
+		self.index = index
+		self.row = self.exp.location_data[index]  # a numpy.void, ie. assignments write through to the array
 
 	def __str__(self):
 		f = "F" if self.final else "-"
 		p = "P"if self.penultimate else "-"
 		n = "N"if self.n_back else "-"
-		str_vars = list(self.x_y_pos) + list(self.origin)
+		origin = self.exp.locations[self.index - 1].x_y_pos if self.index else Params.screen_c
+		str_vars = list(self.x_y_pos) + list(origin)
 		str_vars.extend([self.amplitude, self.angle, hex(id(self)), self.index, f, p, n])
 		return "<DiscLocation {7}{8}{9}{10} ({0},{1}) from ({2},{3}) ({4}px along {5} deg) at {6}>".format(*str_vars)
 
-	def __generate_location__(self):
-		if self.final:
-			n_back = self.exp.locations[self.exp.n_back_index]
-			penultimate = self.exp.locations[-1]
-			angle = self.exp.angle
-			amplitude = int(line_segment_len(n_back.x_y_pos, penultimate.x_y_pos))
-			self.rotation = angle_between(penultimate.x_y_pos, n_back.x_y_pos)
-		else:
-			amplitude = randrange(self.exp.min_amplitude, self.exp.max_amplitude)
-			angle = randrange(0, 360)
-		self.x_y_pos = point_pos(self.origin, amplitude, angle, self.rotation)
-		# ensure disc is inside drawable bounds; if penultimate saccade, ensure all final saccade angles are possible
-		self.__margin_check()
-		self.__penultimate_viability_check__()
-
-		# assign generation output
-		self.angle = angle
-		self.amplitude = amplitude
-		self.__add_eyelink_boundary__()
-
-	def __margin_check(self, p=None, penultimate=False):
-		if not p: p = self.x_y_pos
-		m = self.exp.display_margin
-		if not (m < p[0] < Params.screen_x - m and m < p[1] < Params.screen_y - m):
-			raise TrialException("{0}ocation inviable.".format("(P)l" if penultimate else "L"))
-
-	def __penultimate_viability_check__(self):
-		if not self.penultimate:
-			return
-		d_xy = line_segment_len(self.x_y_pos, self.exp.locations[self.exp.n_back_index].x_y_pos)
-		disc_diam = self.exp.search_disc_proto.surface_width
-		if d_xy - disc_diam < disc_diam:
-			raise ValueError("Penultimate target too close to n-back target.")
-		theta = angle_between(self.x_y_pos, self.exp.locations[self.exp.n_back_index].x_y_pos)
-		for a in range(0, 360, 60):
-			self.__margin_check(point_pos(self.x_y_pos, d_xy, a + theta))
-		self.exp.search_disc_proto.fill = BLACK
-		self.penultimate = True
-
-	def __add_eyelink_boundary__(self):
-		d = int(self.exp.search_disc_proto.surface_width + self.exp.disc_boundary_tolerance)
-		self.boundary_img = kld.Circle(d, [1, (255,0,0,125)]).render()
+	def add_boundary(self):
+		# klibs' CIRCLE_BOUNDARY takes [center, radius]
 		try:
-			self.exp.eyelink.add_boundary("saccade_{0}".format(self.index), [self.x_y_pos, d], CIRCLE_BOUNDARY)
+			self.exp.eyelink.add_boundary(self.boundary, [self.x_y_pos, self.boundary_radius], CIRCLE_BOUNDARY)
 		except AttributeError:
-			self.exp.add_boundary("saccade_{0}".format(self.index), [self.x_y_pos, d], CIRCLE_BOUNDARY)
+			self.exp.add_boundary(self.boundary, [self.x_y_pos, self.boundary_radius], CIRCLE_BOUNDARY)
 
 	def blit(self):
 		# for all possible conditions, timed-out discs are removed
-		if self.timed_out:
-			return
-		if self.allow_blit:
-			self.exp.blit(self.disc, 5, self.x_y_pos)
+		if self.visible:
+			disc = self.exp.sprites.get(self.exp.disc_sprite_key, self.exp.search_disc_proto.render)
+			self.exp.blit_sprite(self.exp.disc_sprite_key, disc, 5, self.x_y_pos)
 			self.initial_blit = True
 
-	def boundary_check(self):
-		if not self.initial_blit:
+	@property
+	def visible(self):
+		return self.allow_blit and not self.timed_out
+
+	def boundary_check(self, event):
+		if not self.initial_blit or event.boundary != self.boundary:
+			return
+		# final disc: saccade landing in boundary; otherwise, a fixation ending in it
+		if event.kind != (SACCADE_END if self.final else FIXATE):
+			return
+		if event.el_time < self.row["on_el_time"]:  # ie. gaze was already there before the disc was shown
 			return
+		self.timed_out = False
+		timestamp = [self.exp.event_trial_time(event), event.el_time]
+		now = perf_clock()
+		self.exp.timing.record(DETECTION, self.index, now, event.el_time, self.exp.gaze.el_elapsed(event.el_time, now),
+							   self.exp.gaze.el_elapsed(event.el_time, event.detected_at))
 		if self.final:
-			check_time = self.exp.eyelink.saccade_to_boundary(self.boundary, EL_SACCADE_END)
-			if check_time:
-				self.exp.fill()
-				self.exp.flip()
-		else:
-			check_time = self.exp.eyelink.fixated_boundary(self.boundary, EL_FIXATION_END)
-			#print "check_time: " + str(check_time) + " [" + str(self.exp.eyelink.now()) + "]"
-		if check_time:
-			self.timed_out = False
-			timestamp = [Params.clock.trial_time, check_time]
-			if self.final:
-				self.rt = timestamp[0] - self.on_timestamp[0]
-				return
-			self.record_fixation(timestamp)
-			self.exp.eyelink.clear_queue()
-			return True
-
-	def check_persistence(self):
+			self.exp.fill()
+			self.exp.flip()
+			self.exp.renderer.invalidate()
+			self.rt = timestamp[0] - self.row["on_trial_time"]
+			self.exp.mark("final_saccade", self.index, timestamp[0], timestamp[1], self.rt)
+			return
+		self.record_fixation(timestamp)
+		return True
+
+	def check_persistence(self, event):
 		# not applicable on immediate-behavior targets
 		if self.persists is False or self.timed_out is True:
 			return
 		#  only called when disc is assigned to l_prev in trial()
-		if self.exit_time is None:
-			self.record_exit()
+		if self.exit_time is None and event.kind == EXIT and event.boundary == self.boundary:
+			self.record_exit(event)
 
 
 	def onset_delay(self, previous_disc):
 		# not applicable on persistent-behavior targets
 		if self.persists:
 			return
-		self.previous_disc = previous_disc
-		if self.previous_disc.timed_out:
+		if previous_disc.timed_out:
 			return
-		try:
-			Params.clock.register_event(ET(self.onset_delay_label, self.idi, relative=True))
-		except TypeError:  # ie. inter_disc_interval was False
-			pass
-		while self.exp.evi.before(self.onset_delay_label, True):
-			pass
-		self.previous_disc.allow_blit = False
+		if self.idi:  # ie. inter_disc_interval wasn't False
+			service = lambda: self.exp.service_delay([previous_disc])
+			self.onset_error = self.exp.scheduler.wait(self.onset_delay_label, self.idi, service)
+			self.exp.timing.record(ONSET_DELAY, self.index, perf_clock(), -1, self.onset_error)
+			self.exp.mark("onset_delay", self.index, self.onset_error)
+		previous_disc.allow_blit = False
 
 	def record_fixation(self, timestamp):
-		self.exp.evi.write(self.event_fixate_label + " (trial_time={0})".format(timestamp[0]))
 		self.fixation = timestamp
-		self.rt = timestamp[0] - self.on_timestamp[0]  # use eye_link time for for RT
+		self.rt = timestamp[0] - self.row["on_trial_time"]  # use eye_link time for for RT
+		self.exp.log_event(self.event_fixate_label, timestamp, "fixate", self.index, timestamp[0], timestamp[1], self.rt)
 
-	def record_exit(self):
-		if self.exp.eyelink.within_boundary(self.boundary, EL_GAZE_POS):
-			return False
-		else:
-			self.exit_time = [Params.clock.trial_time, self.exp.eyelink.now()]
-			# off_timestamp recorded separately (and externally in display_refresh()) on next call flip()
-			self.exp.evi.write(self.event_exit_label + "(trial_time={0})".format(self.exit_time[0]))
-			return True
+	def record_exit(self, event):
+		self.exit_time = [self.exp.event_trial_time(event), event.el_time]
+		# off_timestamp recorded separately (and externally in display_refresh()) on next call flip()
+		self.exp.log_event(self.event_exit_label, self.exit_time, "exit", self.index, *self.exit_time)
+		return True
 
 	def record_start(self, timestamp):
 		# eye-link time unnecessary as the eyelink will supply this in the EDF when written
-		self.exp.evi.write(self.event_start_label + " (trial_time={0})".format(timestamp[0]))
+		self.exp.log_event(self.event_start_label, timestamp, "disc_on", self.index, timestamp[0])
 		self.on_timestamp = timestamp
+		now = perf_clock()
+		self.exp.timing.record(ONSET, self.index, now, timestamp[1], (now - self.onset_due) * 1000.0)
 		Params.clock.register_event(ET(self.event_timeout_label, self.timeout_interval, relative=True))
 
+	def __pair(self, prefix):
+		# [trial_time, el_time] or None, as the trial loop has always expected timestamps
+		t = self.row[prefix + "_trial_time"]
+		return None if t < 0 else [float(t), float(self.row[prefix + "_el_time"])]
+
+	def __set_pair(self, prefix, timestamp):
+		self.row[prefix + "_trial_time"], self.row[prefix + "_el_time"] = timestamp if timestamp else (-1, -1)
+
+	# geometry, fixed when the sequence was generated
+	@property
+	def x_y_pos(self):
+		return int(self.row["x"]), int(self.row["y"])
+
+	@property
+	def amplitude(self):
+		return int(self.row["amplitude"])
+
+	@property
+	def angle(self):
+		return int(self.row["angle"])
+
+	@property
+	def rotation(self):
+		return float(self.row["rotation"])
+
+	@property
+	def final(self):
+		return bool(self.row["final"])
+
+	@property
+	def penultimate(self):
+		return bool(self.row["penultimate"])
+
+	@property
+	def n_back(self):
+		return bool(self.row["n_back"])
+
+	@property
+	def boundary_radius(self):
+		return self.exp.disc_boundary_radius
+
+	@property
+	def persists(self):
+		return Params.persist_to_exit_saccade
+
+	@property
+	def idi(self):
+		return Params.inter_disc_interval if self.index else 0  # no onset delay for first disc
+
+	@property
+	def timeout_interval(self):
+		return Params.final_disc_timeout_interval if self.final else Params.disc_timeout_interval
+
+	# labels
+	@property
+	def boundary(self):
+		return "saccade_{0}".format(self.index)
+
+	@property
+	def name(self):
+		return "L_{0}_{1}x{2}".format(self.index, *self.x_y_pos)
+
+	@property
+	def event_start_label(self):
+		return self.name + "_start"
+
+	@property
+	def event_timeout_label(self):
+		return self.name + "_timeout"
+
+	@property
+	def event_fixate_label(self):
+		return self.name + "_fixate"
+
+	@property
+	def event_exit_label(self):
+		return self.name + "_exit"
+
+	@property
+	def onset_delay_label(self):
+		return self.name + "_onset_delay_disc"
+
+	# trial state
+	@property
+	def allow_blit(self):
+		return bool(self.row["allow_blit"])
+
+	@allow_blit.setter
+	def allow_blit(self, state):
+		self.row["allow_blit"] = state
+
+	@property
+	def initial_blit(self):
+		return bool(self.row["initial_blit"])
+
+	@initial_blit.setter
+	def initial_blit(self, state):
+		self.row["initial_blit"] = state
+
+	@property
+	def rt(self):
+		return float(self.row["rt"])  # only the final location's is its SRT
+
+	@rt.setter
+	def rt(self, rt):
+		self.row["rt"] = rt
+
+	@property
+	def onset_due(self):
+		return float(self.row["onset_due"])  # perf_clock() time the disc became due to be shown
+
+	@onset_due.setter
+	def onset_due(self, t):
+		self.row["onset_due"] = t
+
+	@property
+	def onset_error(self):
+		return float(self.row["onset_error"])  # ms the onset delay overran inter_disc_interval by
+
+	@onset_error.setter
+	def onset_error(self, error):
+		self.row["onset_error"] = error
+
+	@property
+	def on_timestamp(self):
+		return self.__pair("on")
+
+	@on_timestamp.setter
+	def on_timestamp(self, timestamp):
+		self.__set_pair("on", timestamp)
+
+	@property
+	def off_timestamp(self):
+		return self.__pair("off")
+
+	@off_timestamp.setter
+	def off_timestamp(self, timestamp):
+		self.__set_pair("off", timestamp)
+
+	@property
+	def fixation(self):
+		return [float(self.row["fixate_trial_time"]), float(self.row["fixate_el_time"])]
+
+	@fixation.setter
+	def fixation(self, timestamp):
+		self.__set_pair("fixate", timestamp)
+
 	@property
 	def exit_time(self):
-		return self.__exit_time
+		return self.__pair("exit")
 
 	@exit_time.setter
 	def exit_time(self, t):
 		if t:
 			self.allow_blit = False
-			self.__exit_time = t
-		else:
-			self.__exit_time = None
+		self.__set_pair("exit", t)
 
 	@property
 	def timed_out(self):
-		return self.__timed_out
+		t = self.row["timed_out"]
+		return None if t < 0 else bool(t)  # only set to false once fixated
 
 	@timed_out.setter
 	def timed_out(self, state):
-		self.__timed_out = state
+		self.row["timed_out"] = -1 if state is None else int(state)
 		if state:
-			self.allow_blit = False
\ No newline at end of file
+			self.allow_blit = False
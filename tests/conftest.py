@@ -0,0 +1,21 @@
+import os
+import sqlite3
+import sys
+
+import pytest
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)  # waldo/ lives beside experiment.py rather than being installed
+
+SCHEMA_F = os.path.join(PROJECT_DIR, "ExpAssets", "Config", "WaldoMkII_schema.sql")
+
+
+@pytest.fixture
+def schema_db(tmp_path):
+	"""An empty database built from the project's schema, as klibs builds it."""
+	db_path = str(tmp_path / "waldo.db")
+	c = sqlite3.connect(db_path)
+	with open(SCHEMA_F) as f:
+		c.executescript(f.read())
+	c.close()
+	return db_path
@@ -0,0 +1,54 @@
+import os
+
+import numpy as np
+from PIL import Image
+
+from waldo.assetpack import AssetPack, build_pack
+
+KEYS = ["wally_a", "wally_b"]
+
+
+def images(tmp_path):
+	image_dir = tmp_path / "image"
+	for i, key in enumerate(KEYS):
+		os.makedirs(str(image_dir / key))
+		pixels = np.zeros((4, 8, 3), dtype=np.uint8)
+		pixels[:, :4] = (200, 40 * i, 10)
+		Image.fromarray(pixels).save(str(image_dir / key / "8x4.jpg"), quality=95)
+		(image_dir / key / "average_color.txt").write_text(u"(100, {0}, 5)\n".format(20 * i))
+	return str(image_dir)
+
+
+def test_pack_round_trip(tmp_path):
+	image_dir = images(tmp_path)
+	pack_f = str(tmp_path / "backgrounds.pack")
+	build_pack(image_dir, pack_f, ["8x4"], KEYS, processes=1)
+	pack = AssetPack.open(pack_f)
+	assert pack.has((8, 4)) and not pack.has((16, 8))
+	for i, key in enumerate(KEYS):
+		expected = np.asarray(Image.open(os.path.join(image_dir, key, "8x4.jpg")).convert("RGBA"))
+		assert np.array_equal(pack.image(key, (8, 4)), expected)
+		assert pack.color(key) == (100, 20 * i, 5)
+	assert pack.verify() == []
+	assert pack.stale(image_dir) == []
+	pack.close()
+
+
+def test_corruption_and_stale_sources_are_caught(tmp_path):
+	image_dir = images(tmp_path)
+	pack_f = str(tmp_path / "backgrounds.pack")
+	build_pack(image_dir, pack_f, ["8x4"], KEYS, processes=1)
+	pack = AssetPack(pack_f)
+	flipped = pack.data_start + pack.index["images"]["wally_b"]["blocks"]["8x4"]["offset"] + 5
+	pack.close()
+	data = np.memmap(pack_f, dtype=np.uint8, mode="r+")
+	data[flipped] ^= 0xFF
+	data.flush()
+	del data
+	source_f = os.path.join(image_dir, "wally_a", "8x4.jpg")
+	mtime = os.path.getmtime(source_f)
+	os.utime(source_f, (mtime + 10, mtime + 10))
+	pack = AssetPack.open(pack_f)
+	assert pack.verify() == [("wally_b", "8x4")]
+	assert pack.stale(image_dir) == ["wally_a"]
+	pack.close()
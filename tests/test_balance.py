@@ -0,0 +1,40 @@
+import random
+
+from waldo.balance import CellBalancer
+
+CELLS = [(angle, bg, n_back) for angle in (60, 180, 300) for bg in ("absent", "present") for n_back in (1, 2)]
+
+
+def test_valid_trials_balance_despite_recycling():
+	rng = random.Random(3)
+	balancer = CellBalancer(CELLS, 6, random.Random(4))
+	drawn = 0
+	while not balancer.done:
+		cell = balancer.next()
+		drawn += 1
+		counts = [balancer.counts[c] for c in CELLS]
+		assert balancer.counts[cell] == min(counts)  # always one of the cells furthest behind
+		assert max(counts) - min(counts) <= 1
+		if rng.random() < 0.3:
+			continue  # recycled: klibs redraws it, and it isn't counted
+		balancer.complete(cell)
+	assert drawn > len(CELLS) * 6
+	assert balancer.completed == len(CELLS) * 6
+	assert all(balancer.counts[c] == 6 for c in CELLS)
+	assert balancer.remaining == 0
+	assert balancer.next() is None
+
+
+def test_completions_beyond_target_are_not_counted():
+	balancer = CellBalancer(CELLS[:2], 1)
+	balancer.complete(CELLS[0])
+	balancer.complete(CELLS[0])
+	assert balancer.counts[CELLS[0]] == 2
+	assert balancer.remaining == 1
+	assert balancer.next() == CELLS[1]
+	balancer.complete(CELLS[1])
+	assert balancer.done
+
+
+def test_zero_target_is_done():
+	assert CellBalancer(CELLS, 0).done
@@ -0,0 +1,54 @@
+import numpy as np
+
+from waldo.compiler import (CompiledSession, compile_session, disc_surface, generation_geometry, geometry_from_ppd,
+							session_file)
+
+FACTORS = {"angle": ["60", "180"], "bg_state": ["absent", "present"], "n_back": ["1", "2"]}
+GEOMETRY = geometry_from_ppd((1920, 1200), 43)
+TRIALS = 16  # two per cell
+
+
+def compiled(tmp_path, random_seed="p1-seed", spare=1):
+	data = compile_session(random_seed, GEOMETRY, FACTORS, TRIALS, 5, 12, spare=spare)
+	path = session_file(str(tmp_path), random_seed)
+	np.savez_compressed(path, **data)
+	return data, CompiledSession.open(str(tmp_path), random_seed)
+
+
+def test_compilation_is_deterministic_per_seed():
+	a = compile_session("p1-seed", GEOMETRY, FACTORS, TRIALS, 5, 12)
+	b = compile_session("p1-seed", GEOMETRY, FACTORS, TRIALS, 5, 12)
+	c = compile_session("p2-seed", GEOMETRY, FACTORS, TRIALS, 5, 12)
+	assert sorted(a) == sorted(b)
+	for k in a:
+		assert np.array_equal(a[k], b[k]), k
+	assert not np.array_equal(a["positions"], c["positions"])
+
+
+def test_cells_are_served_until_exhausted(tmp_path):
+	data, session = compiled(tmp_path)
+	assert CompiledSession.open(str(tmp_path), "no such seed") is None
+	for i in range(3):  # two trials per cell plus one spare
+		seq, bg_key = session.next(180, " present", "2")  # as klibs' config values may arrive
+		assert len(seq) == len(seq.positions) >= 5
+		assert seq.n_back_index == len(seq) - 4
+		assert seq.angles[-1] == 180
+		assert bg_key.startswith("wally_0")
+	assert session.next(180, "present", 2) is None
+	assert session.next(60, "present", 2) is not None  # other cells have their own cursors
+
+
+def test_geometry_mismatches_are_reported(tmp_path):
+	data, session = compiled(tmp_path)
+	assert session.check_geometry(GEOMETRY) == []
+	live = dict(GEOMETRY, screen_x=2560, min_separation=GEOMETRY["min_separation"] + 2)
+	mismatches = session.check_geometry(live)
+	assert len(mismatches) == 2
+	assert "screen_x=1920 (expected 2560)" in mismatches
+
+
+def test_geometry_from_ppd_is_generation_geometry():
+	disc = int(1 * 43)
+	assert GEOMETRY == generation_geometry((1920, 1200), disc, int(3 * 43), int(6 * 43))
+	assert GEOMETRY["min_separation"] == 2 * disc_surface(disc)
+	assert GEOMETRY["margin"] == int(disc * 1.5)
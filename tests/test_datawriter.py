@@ -0,0 +1,40 @@
+import sqlite3
+
+import pytest
+
+from waldo.datawriter import TrialDataWriter
+
+
+def event(label):
+	return {"user_id": 1, "trial_id": -1, "trial_num": 4, "label": label, "trial_clock": 0.5, "eyelink_clock": 1000}
+
+
+def test_background_commit_stamps_trial_id(schema_db):
+	writer = TrialDataWriter(schema_db)
+	writer.add("events", event("L_0_start"))
+	writer.add("events", event("L_0_fixate"))
+	writer.flush(trial_id=17)
+	writer.add("events", event("recycled"))
+	writer.discard()
+	writer.flush(trial_id=18)  # nothing left to write
+	writer.wait()
+	assert (writer.batches, writer.rows_written) == (1, 2)
+	writer.close()
+	c = sqlite3.connect(schema_db)
+	assert c.execute("SELECT trial_id, label FROM events ORDER BY rowid").fetchall() == [(17, "L_0_start"),
+																						  (17, "L_0_fixate")]
+	assert c.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+	c.close()
+
+
+def test_failed_batch_is_rolled_back_and_raised_by_wait(schema_db):
+	writer = TrialDataWriter(schema_db)
+	writer.add("events", event("kept out"))
+	writer.add("no_such_table", {"x": 1})
+	writer.flush(trial_id=1)
+	with pytest.raises(sqlite3.OperationalError):
+		writer.wait()
+	writer.close()
+	c = sqlite3.connect(schema_db)
+	assert c.execute("SELECT COUNT(*) FROM events").fetchone() == (0,)
+	c.close()
@@ -0,0 +1,39 @@
+import re
+
+import pytest
+
+from waldo.edfcodes import EventCodes, compact
+
+
+def test_every_message_round_trips():
+	codes = EventCodes()
+	for label, (argc, prepend, code, message) in codes.codes.items():
+		args = [1.25 + i for i in range(argc)]
+		formatted = codes.format(label, *args)
+		assert formatted.startswith("TA_{0}: ".format(code))
+		parsed_label, fields = codes.parse("MSG 1000 " + formatted)
+		assert parsed_label == label
+		keys = re.findall(r"(\w+)={(\d+)}", message)
+		assert len(fields) == len(keys)
+		for key, i in keys:
+			assert fields[key] == compact(args[int(i)])
+
+
+def test_values_stay_exact_and_unspaced():
+	codes = EventCodes()
+	label, fields = codes.parse(codes.format("fixate", 3, 1234.000500, 5678901, 0.1))
+	assert label == "fixate"
+	assert fields == {"i": "3", "tt": "1234.0005", "el": "5678901", "rt": "0.1"}
+	label, fields = codes.parse(codes.format("trial_start", 1, 2, 1, "wally 01", "present", 2, 60, 8))
+	assert fields["bg"] == "wally_01"
+
+
+def test_other_messages_are_ignored():
+	codes = EventCodes()
+	assert codes.parse("TRIALID 3") is None
+	assert codes.parse("TA_254: not ours") is None
+
+
+def test_argument_count_is_enforced():
+	with pytest.raises(ValueError):
+		EventCodes().format("fixate", 1, 2)
@@ -0,0 +1,71 @@
+import sqlite3
+
+from waldo.edfcodes import EventCodes
+from waldo.edfparse import file_trials, main, write
+
+CODES = EventCodes()
+
+
+def session_asc(path, pid=1):
+	# as WaldoMkII marks it: a completed trial, a recycled one, then one cut off by the end of the recording
+	lines = ["** CONVERTED FROM p1.EDF", "START\t1000 \tLEFT\tSAMPLES\tEVENTS"]
+	t = [1000]
+
+	def msg(label, *args):
+		t[0] += 10
+		lines.append("MSG\t{0} {1}".format(t[0], CODES.format(label, *args)))
+		lines.append("{0}\t  960.0\t  600.0\t 1000.0\t...".format(t[0] + 1))
+
+	msg("trial_start", pid, 1, 1, "wally_01", "present", 1, 60, 3)
+	for i, (x, y, final) in enumerate([(960, 600, False), (1100, 600, False), (1100, 750, True)]):
+		msg("location", i, x, y, 150, 0, 0.0, i == 0, i == 1, final)
+	msg("fixate", 0, 1.5, 1025, 0.31)
+	msg("onset_delay", 1, 0.25)
+	msg("timeout", 1)
+	msg("final_saccade", 2, 3.25, 1090, 0.28)
+	msg("trial_end", False, 0.28, "NOVEL", 3.5, 60, 0.5, 120, 1)
+	msg("trial_start", pid, 2, 1, "wally_02", "absent", 1, 60, 3)
+	msg("fixation_failed")
+	msg("trial_start", pid, 2, 1, "wally_03", "absent", 1, 120, 3)
+	msg("location", 0, 960, 600, 150, 0, 0.0, True, False, False)
+	lines.append("END\t{0} \tSAMPLES\tEVENTS".format(t[0] + 5))
+	with open(path, "w") as f:
+		f.write("\n".join(lines) + "\n")
+	return path
+
+
+def test_completed_trials_only(tmp_path):
+	rows = list(file_trials(session_asc(str(tmp_path / "p1.asc"))))
+	assert len(rows) == 1
+	trial, locations = rows[0]
+	assert trial["trial_num"] == 1
+	assert trial["bg_image"] == "wally_01"
+	assert trial["timed_out"] is False
+	assert trial["frames_drawn"] == 120
+	assert [l["timed_out"] for l in locations] == [False, True, False]
+	assert [l["rt"] for l in locations] == [0.31, -1, 0.28]
+	assert locations[0]["fixate_el_time"] == 1025
+	assert locations[2]["fixate_el_time"] == -1.0  # the final disc is a saccade, not a fixation
+	assert [l["onset_error"] for l in locations] == [-1.0, 0.25, -1.0]
+	assert [l["penultimate"] for l in locations] == [False, True, False]
+
+
+def test_rebuilt_tables(schema_db, tmp_path):
+	connection = sqlite3.connect(schema_db, isolation_level=None)
+	assert write(connection, file_trials(session_asc(str(tmp_path / "p1.asc")))) == (1, 3)
+	trial_id, trial_num = connection.execute("SELECT id, trial_num FROM trials").fetchone()
+	assert trial_num == 1
+	assert connection.execute("SELECT COUNT(*) FROM trial_locations WHERE trial_id = ?", [trial_id]).fetchone() == (3,)
+	srt_1, srt_2, timed_out_2, x_3 = connection.execute(
+		"SELECT srt_1, srt_2, timed_out_2, x_3 FROM trial_summary WHERE trial_id = ?", [trial_id]).fetchone()
+	assert (srt_1, srt_2, timed_out_2, x_3) == (0.28, -1.0, 1, 960)  # reverse order: the final disc first
+	connection.close()
+
+
+def test_main_with_a_pool(schema_db, tmp_path):
+	files = [session_asc(str(tmp_path / "p{0}.asc".format(pid)), pid) for pid in (1, 2, 3)]
+	main(["--db", schema_db, "--processes", "2"] + files)
+	connection = sqlite3.connect(schema_db)
+	assert sorted(r[0] for r in connection.execute("SELECT participant_id FROM trials")) == [1, 2, 3]
+	assert connection.execute("SELECT COUNT(*) FROM trial_summary").fetchone() == (3,)
+	connection.close()
@@ -0,0 +1,54 @@
+import json
+import os
+
+from waldo.edfcodes import EventCodes
+from waldo.edfpipe import Pipeline, pack_asc, read_trial
+
+CODES = EventCodes()
+
+
+def session_asc(path, trials=2, samples=6):
+	# recorded at 2 kHz, ie. every other sample is on a half ms
+	lines = ["** CONVERTED FROM p1.EDF", "START\t1000 \tLEFT\tSAMPLES\tEVENTS"]
+	t = 1000.0
+	for trial in range(1, trials + 1):
+		lines.append("MSG\t{0:g} {1}".format(t, CODES.format("trial_start", 1, trial, 1, "wally_01", "present", 1, 60, 3)))
+		for i in range(samples):
+			t += 0.5
+			lines.append("{0:.1f}\t  960.0\t  600.0\t 1000.0\t...".format(t))
+		lines.append("MSG\t{0:g} {1}".format(t, CODES.format("trial_end", False, 0.28, "NOVEL", 3.5, 60, 0.5, 120, 1)))
+		t += 10
+		lines.append("{0:.1f}\t  960.0\t  600.0\t 1000.0\t...".format(t))  # between trials
+	lines.append("END\t{0:g} \tSAMPLES\tEVENTS".format(t + 5))
+	with open(path, "w") as f:
+		f.write("\n".join(lines) + "\n")
+	return path
+
+
+def test_pack_round_trip(tmp_path):
+	asc_f = session_asc(str(tmp_path / "p1.asc"))
+	gz_f = str(tmp_path / "p1.asc.gz")
+	index = pack_asc(asc_f, gz_f)
+	trials = [m for m in index if m["trial_num"] >= 0]
+	assert [m["trial_num"] for m in trials] == [1, 2]
+	assert [(m["start"], m["end"], m["samples"]) for m in trials] == [(1000.5, 1003.0, 6), (1013.5, 1016.0, 6)]
+	with open(asc_f, "rb") as f:
+		lines = f.read().splitlines()
+	for m in trials:
+		got = read_trial(gz_f, m)
+		assert got[0].startswith(b"MSG") and got[-1].startswith(b"MSG")
+		assert got == lines[lines.index(got[0]):lines.index(got[-1]) + 1]
+	assert sum(len(read_trial(gz_f, m)) for m in index) == len(lines)
+
+
+def test_interrupted_pack_is_not_repeated(tmp_path):
+	edf_dir = str(tmp_path)
+	session_asc(os.path.join(edf_dir, "p1.asc"))
+	pipeline = Pipeline(edf_dir)
+	job = {"name": "p1"}
+	size_in, size_out = pipeline.pack(job)
+	assert not os.path.isfile(os.path.join(edf_dir, "p1.asc"))
+	# killed before the stage was recorded: the rerun finds the ASC gone and keeps what it wrote
+	assert pipeline.pack(job) == (size_out, size_out)
+	with open(os.path.join(edf_dir, "p1.idx.json")) as f:
+		assert [m["trial_num"] for m in json.load(f)["trials"]] == [-1, 1, -1, 2, -1]
@@ -0,0 +1,59 @@
+import sqlite3
+
+import numpy as np
+
+from waldo.datawriter import TrialDataWriter
+from waldo.export import Exporter, load_table
+from waldo.summary import pivot
+
+TRIAL = {"participant_id": 1, "block_num": 1, "frames_drawn": 10, "frames_skipped": 0, "bg_image": "wally_01",
+		 "timed_out": "FALSE", "rt": 0.25, "target_type": "NOVEL", "bg_state": "present", "n_back": 1, "amplitude": 4.5,
+		 "deviation": 60, "real_angle": 60, "saccades": 3}
+
+
+def add_trial(db_path, writer, trial_num):
+	# klibs inserts the trials row itself; the experiment's writer then commits everything else in one batch
+	c = sqlite3.connect(db_path)
+	columns = sorted(TRIAL) + ["trial_num"]
+	cur = c.execute("INSERT INTO trials ({0}) VALUES ({1})".format(", ".join(columns), ", ".join("?" * len(columns))),
+					[TRIAL[k] for k in sorted(TRIAL)] + [trial_num])
+	c.commit()
+	trial_id = cur.lastrowid
+	c.close()
+	rows = [{"location_num": i, "x": 100 * i, "y": 50 * i, "amplitude": 150, "angle": 30, "n_back": False,
+			 "penultimate": i == 1, "final": i == 2, "timed_out": i == 1, "rt": 0.2 + i, "fixate_trial_time": 1.0,
+			 "fixate_el_time": 1000.0, "onset_error": 0.1} for i in range(3)]
+	for row in rows:
+		row.update({"participant_id": 1, "trial_num": trial_num, "block_num": 1})
+		writer.add("trial_locations", row)
+	summary = pivot(rows)
+	summary.update({"participant_id": 1, "block_num": 1, "trial_num": trial_num})
+	writer.add("trial_summary", summary)
+	writer.add("events", {"user_id": 1, "trial_id": -1, "trial_num": trial_num, "label": "L_0_start",
+						  "trial_clock": 0.5, "eyelink_clock": 1000})
+	writer.flush(trial_id=trial_id)
+	return trial_id
+
+
+def test_export_schema_database(schema_db, tmp_path):
+	writer = TrialDataWriter(schema_db, background=False)
+	ids = [add_trial(schema_db, writer, n) for n in range(1, 4)]
+	writer.close()
+	out_dir = str(tmp_path / "export")
+	rows = Exporter(schema_db, out_dir, chunk_size=2).run()
+	assert rows["trials"] == 3
+	assert rows["trial_locations"] == 9
+	assert rows["trial_summary"] == 3
+	assert rows["trial_wide"] == 3
+
+	summary = load_table(out_dir, "trial_summary")
+	assert summary["trial_id"].tolist() == ids
+	assert summary["srt_1"].tolist() == [2.2] * 3  # final disc first
+	assert summary["srt_2"].tolist() == [-1.0] * 3  # timed out
+	assert summary["x_4"].tolist() == [-1] * 3  # no fourth target
+	wide = load_table(out_dir, "trial_wide")
+	for k in ("srt_1", "srt_2", "timed_out_2", "x_3"):
+		assert np.array_equal(wide[k], summary[k])
+	locations = load_table(out_dir, "trial_locations")
+	assert locations["timed_out"].dtype == np.int8
+	assert locations["timed_out"].tolist() == [0, 1, 0] * 3
@@ -0,0 +1,60 @@
+import math
+import threading
+import time
+
+from waldo.fakelink import FakeEyeLink
+from waldo.gaze import GazeMonitor
+
+
+class ExclusiveLink(FakeEyeLink):
+	# counts any call made while another thread is inside the link
+
+	def __init__(self, *args, **kwargs):
+		super(ExclusiveLink, self).__init__(*args, **kwargs)
+		self.busy = threading.Lock()
+		self.overlaps = 0
+
+	def exclusive(f):
+		def call(self, *args):
+			if not self.busy.acquire(False):
+				self.overlaps += 1
+				return f(self, *args)
+			try:
+				time.sleep(0.00005)
+				return f(self, *args)
+			finally:
+				self.busy.release()
+		return call
+
+	getNextData = exclusive(FakeEyeLink.getNextData)
+	sendMessage = exclusive(FakeEyeLink.sendMessage)
+
+
+def test_link_used_by_one_thread_at_a_time():
+	tracker = ExclusiveLink(start_pos=(500, 500))
+	monitor = GazeMonitor(tracker)
+	try:
+		for trial in range(10):
+			tracker.start()
+			monitor.resume(tracker.now())
+			assert monitor.now() is not None  # before any sample has arrived
+			for i in range(10):
+				monitor.send("TA_22: disc_on i={0}".format(i))
+				time.sleep(0.001)
+			monitor.pause()
+			tracker.sendMessage("paused")  # the caller owns the link again
+			tracker.stop()
+	finally:
+		monitor.stop()
+	assert tracker.overlaps == 0
+	assert len(tracker.messages) == 10 * 11  # every queued message was sent before pause() returned
+
+
+def test_el_elapsed_is_nan_before_any_tracker_time():
+	monitor = GazeMonitor(FakeEyeLink(start_pos=(500, 500)))
+	assert math.isnan(monitor.el_elapsed(1000.0, time.time()))
+	monitor.resume(1000.0)
+	el_time, received = monitor.last_sample
+	assert monitor.el_elapsed(el_time - 10, received) == 10.0
+	monitor.pause()
+	monitor.stop()
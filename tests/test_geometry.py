@@ -0,0 +1,47 @@
+import numpy as np
+
+from waldo.geometry import PenultimateRegion
+
+BOUNDS = (64, 64, 1856, 1136)
+FINAL_ANGLES = np.radians([60, 120, 180, 240, 300])
+
+
+def brute_force(region):
+	# every integer (degree, amplitude) step from the previous disc, tested against each constraint directly
+	amplitudes = np.arange(region.min_amplitude, region.max_amplitude)
+	points = region.previous + amplitudes[None, :, None] * region.directions[:, None, :]  # (degree, amplitude, xy)
+	inside = (points.dot(region.a.T) <= region.b).all(axis=2)
+	separated = np.hypot(*np.moveaxis(points - region.n_back, 2, 0)) >= region.min_separation
+	return (inside & separated).sum(axis=1)
+
+
+def regions(count, seed=1):
+	rng = np.random.RandomState(seed)
+	x0, y0, x1, y1 = BOUNDS
+	for i in range(count):
+		previous = (rng.uniform(x0, x1), rng.uniform(y0, y1))
+		n_back = (rng.uniform(x0, x1), rng.uniform(y0, y1))
+		yield PenultimateRegion(BOUNDS, previous, n_back, FINAL_ANGLES, 129, 258, 43)
+
+
+def test_counts_match_brute_force():
+	checked = 0
+	for region in regions(50):
+		counts = region.counts()[:, 4].astype(np.int64)
+		assert np.array_equal(counts, brute_force(region))
+		checked += counts.sum() > 0
+	assert checked  # some of the regions weren't empty
+
+
+def test_samples_are_feasible():
+	rng = np.random.RandomState(2)
+	for region in regions(25, seed=3):
+		if region.empty:
+			assert region.sample(rng) is None
+			continue
+		for i in range(20):
+			degree, amplitude = region.sample(rng)
+			assert region.min_amplitude <= amplitude < region.max_amplitude
+			p = region.previous + amplitude * region.directions[degree]
+			assert (region.a.dot(p) <= region.b + 1e-9).all()
+			assert np.hypot(*(p - region.n_back)) >= region.min_separation - 1e-9
@@ -0,0 +1,42 @@
+import numpy as np
+
+from waldo.instrument import FRAME, MISSED_VSYNC, ONSET, RECORD, TimingRecorder
+
+
+def test_ring_buffer_keeps_the_newest_records():
+	recorder = TimingRecorder(capacity=8)
+	for i in range(11):
+		recorder.record(ONSET, i, float(i))
+	records = recorder.records()
+	assert len(records) == 8
+	assert list(records["disc"]) == list(range(3, 11))  # oldest first
+	assert recorder.counts()["onset"] == 8
+
+
+def test_missed_vsync_is_flagged():
+	recorder = TimingRecorder(refresh_rate=100)  # 10 ms frames
+	recorder.frame(1.000, 1.012, 500.0)
+	recorder.frame(1.020, 1.036, 524.0)  # 16 ms from blit to flip: beyond 1.5 frames
+	records = recorder.records()
+	assert list(records["kind"]) == [FRAME, FRAME, MISSED_VSYNC]
+	assert records["b"][0] == -1  # no previous flip
+	assert np.allclose(records["a"], [12, 16, 16])
+	assert np.allclose(records["b"][1:], 24)
+	assert recorder.counts() == {"frame": 2, "missed_vsync": 1, "detection": 0, "onset": 0, "onset_delay": 0}
+
+
+def test_dumps_append_and_load(tmp_path):
+	path = str(tmp_path / "timing.bin")
+	recorder = TimingRecorder(capacity=4)
+	for trial in (1, 2):
+		for i in range(3 * trial):
+			recorder.record(ONSET, i, float(i), 1000 + i, a=0.5)
+		assert recorder.dump(path, trial_id=10 + trial, trial_num=trial) == min(3 * trial, 4)
+	assert recorder.dropped == 2
+	assert recorder.head == 0
+	records = TimingRecorder.load(path)
+	assert records.dtype == RECORD
+	assert list(records["trial_id"]) == [11] * 3 + [12] * 4
+	assert list(records["disc"]) == [0, 1, 2, 2, 3, 4, 5]
+	assert np.allclose(records["el_time"][-1], 1005)
+	assert np.allclose(records["a"], 0.5)
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+import waldo.samples
+from waldo.edfcodes import EventCodes
+from waldo.samples import SampleStore, build
+
+CODES = EventCodes()
+
+
+def session_asc(path, order=(2, 1, 3), samples=10):
+	# 2 kHz; trial 2 comes first, as a recycled trial's number can. Each trial's disc 0 is on from its 3rd sample
+	# until its 8th, when it's fixated
+	lines = ["START\t1000 \tLEFT\tSAMPLES\tEVENTS"]
+	t = 1000.0
+	for trial in order:
+		lines.append("MSG\t{0:g} {1}".format(t, CODES.format("trial_start", 1, trial, 1, "wally_01", "present", 1, 60, 3)))
+		for i in range(samples):
+			t += 0.5
+			lines.append("{0:.1f}\t {1:.1f}\t  600.0\t {2}\t...".format(t, 900 + i, "." if i == 5 else "1000.0"))
+			if i == 2:
+				lines.append("MSG\t{0:g} {1}".format(t, CODES.format("disc_on", 0, 0.1)))
+			elif i == 7:
+				lines.append("MSG\t{0:g} {1}".format(t, CODES.format("fixate", 0, 0.2, int(t), 0.1)))
+		lines.append("MSG\t{0:g} {1}".format(t, CODES.format("trial_end", False, 0.28, "NOVEL", 3.5, 60, 0.5, 120, 1)))
+		t += 10
+	with open(path, "w") as f:
+		f.write("\n".join(lines) + "\n")
+	return path
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+	monkeypatch.setattr(waldo.samples, "SAMPLE_CHUNK", 4)  # so every trial spans chunks
+	asc_f = session_asc(str(tmp_path / "p1.asc"))
+	assert build(asc_f, str(tmp_path / "p1.samples")) == 30
+	return SampleStore(str(tmp_path / "p1.samples"))
+
+
+def test_rows_across_chunks(store):
+	assert len(store.offsets) == 9  # 7 full chunks & one of 2
+	rows = store.rows(3, 13)
+	assert np.array_equal(rows["x"], [903, 904, 905, 906, 907, 908, 909, 900, 901, 902])
+	assert np.isnan(rows["pupil"][2])
+	within = store.rows(4, 8, ["time"])
+	assert list(within) == ["time"] and len(within["time"]) == 4
+	assert len(store.rows(8, 8)["time"]) == 0
+
+
+def test_window_between_events(store):
+	for trial, start in [(2, 1000.0), (1, 1015.0), (3, 1030.0)]:
+		assert store.event_time(trial, "disc_on", 0) == start + 1.5
+		window = store.window(trial, ("disc_on", 0), ("fixate", 0))
+		assert np.allclose(window["time"], start + np.arange(1.5, 4.5, 0.5))
+		assert np.array_equal(window["x"], np.arange(902, 908))
+		assert len(store.window(trial)["time"]) == 10
+	assert [len(store.trial_events(t)) for t in (1, 2, 3, 4)] == [2, 2, 2, 0]
+	with pytest.raises(KeyError):
+		store.window(1, ("fixate", 1))
@@ -0,0 +1,61 @@
+import json
+
+import numpy as np
+
+from waldo.stats import CellStats, OnlineStats, P2Quantile, RunningStats
+
+
+def test_running_stats_match_numpy():
+	values = np.random.RandomState(1).normal(250, 40, 5000) + 1e6  # a large offset: no catastrophic cancellation
+	stats = RunningStats()
+	for v in values:
+		stats.add(v)
+	assert stats.n == len(values)
+	assert np.isclose(stats.mean, values.mean())
+	assert np.isclose(stats.variance, values.var(ddof=1))
+	assert (stats.min, stats.max) == (values.min(), values.max())
+
+
+def test_p2_quantiles_track_numpy():
+	rng = np.random.RandomState(2)
+	for values in [rng.normal(250, 40, 20000), rng.lognormal(5.5, 0.4, 20000), rng.uniform(100, 900, 20000)]:
+		iqr = np.percentile(values, 75) - np.percentile(values, 25)
+		for p in (0.1, 0.5, 0.9):
+			q = P2Quantile(p)
+			for v in values:
+				q.add(v)
+			assert abs(q.value - np.percentile(values, p * 100)) < 0.05 * iqr
+
+
+def test_p2_quantile_exact_until_five():
+	q = P2Quantile(0.5)
+	assert q.value is None
+	for v in [5.0, 1.0, 3.0]:
+		q.add(v)
+	assert q.value == 3.0
+
+
+def test_cell_stats_rates():
+	cell = CellStats()
+	cell.add(False, 200.0, discs=4, disc_timeouts=1)
+	cell.add(True, -1.0, discs=4, disc_timeouts=3)
+	d = cell.as_dict()
+	assert d["trials"] == 2
+	assert d["final_timeout_rate"] == 0.5
+	assert d["disc_timeout_rate"] == 0.5
+	assert d["srt"]["n"] == 1  # a timed-out final disc has no srt
+	assert d["srt"]["p50"] == 200.0
+
+
+def test_status_file_is_replaced(tmp_path):
+	status_f = str(tmp_path / "status" / "lab-1_p3.json")
+	stats = OnlineStats(status_f, "lab-1", 3)
+	for i in range(3):
+		stats.add((60, "present", 1), False, 200.0 + i)
+		stats.write()
+	with open(status_f) as f:
+		status = json.load(f)
+	assert status["participant_id"] == 3
+	assert status["cells"]["60|present|1"]["trials"] == 3
+	assert status["total"]["srt"]["max"] == 202.0
+	assert not (tmp_path / "status" / "lab-1_p3.json.tmp").exists()
@@ -0,0 +1,48 @@
+import sqlite3
+
+from waldo.store import SCHEMA_F, CentralStore, StoreClient
+
+
+def columns(table):
+	c = sqlite3.connect(":memory:")
+	with open(SCHEMA_F) as f:
+		c.executescript(f.read())
+	info = c.execute("PRAGMA table_info({0})".format(table)).fetchall()
+	c.close()
+	return [(name, kind) for _, name, kind, _, _, _ in info if name != "id"]
+
+
+def batch(station_num, trial_id=1):
+	# one trial as TrialDataWriter.flush() forwards it: klibs' trials row (with the station's own id) and its children
+	tables = []
+	for table in ["trials", "trial_locations", "events"]:
+		row = dict((name, "x" if kind == "text" else station_num) for name, kind in columns(table))
+		row["trial_id"] = trial_id
+		names = sorted(row)
+		tables.append((table, names, [[row[n] for n in names]]))
+	return tables
+
+
+def test_stations_trial_ids_are_remapped(tmp_path):
+	db_path = str(tmp_path / "central.db")
+	store = CentralStore(db_path)
+	store.start()
+	clients = [StoreClient(store.address, b"waldo", "lab-{0}".format(i)) for i in (1, 2)]
+	for i, client in enumerate(clients):
+		client.send(batch(i + 1))
+		client.wait()
+	for client in clients:
+		client.close()
+	store.stop()
+	assert store.batches == 2
+
+	c = sqlite3.connect(db_path)
+	mapping = c.execute("SELECT station, local_trial_id, trial_id FROM station_trials ORDER BY station").fetchall()
+	assert [m[:2] for m in mapping] == [("lab-1", 1), ("lab-2", 1)]
+	assert mapping[0][2] != mapping[1][2]
+	assert c.execute("SELECT id, station FROM trials ORDER BY station").fetchall() == [(m[2], m[0]) for m in mapping]
+	for table in ["trial_locations", "events"]:
+		q = ("SELECT t.station, t.trial_num, x.trial_num FROM {0} x JOIN trials t ON t.id = x.trial_id "
+			 "AND t.station = x.station ORDER BY t.station").format(table)
+		assert c.execute(q).fetchall() == [("lab-1", 1, 1), ("lab-2", 2, 2)]
+	c.close()
@@ -0,0 +1,20 @@
+from waldo.summary import WIDE_TARGETS, pivot, wide_columns
+
+
+def location(i, timed_out, rt=0.25):
+	return {"location_num": i, "x": 10 * i, "y": 20 * i, "rt": rt + i, "timed_out": timed_out}
+
+
+def test_reverse_order_and_padding():
+	row = pivot([location(0, False), location(1, "TRUE"), location(2, "FALSE")])  # klibs' strings, as read back
+	assert sorted(row) == sorted(wide_columns())
+	assert (row["srt_1"], row["x_1"], row["y_1"], row["timed_out_1"]) == (2.25, 20, 40, 0)  # the final disc
+	assert (row["srt_2"], row["timed_out_2"]) == (-1.0, 1)
+	assert (row["srt_3"], row["x_3"]) == (0.25, 0)
+	assert all(row["{0}_4".format(f)] == -1 for f in ("srt", "timed_out", "x", "y"))
+
+
+def test_long_trials_keep_the_last_targets():
+	row = pivot([location(i, 0) for i in range(WIDE_TARGETS + 2)])
+	assert row["x_1"] == 10 * (WIDE_TARGETS + 1)
+	assert row["x_{0}".format(WIDE_TARGETS)] == 20
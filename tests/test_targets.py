@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+from waldo.targets import SequenceGenerator, GenerationError, location_records
+
+SCREEN = (1920, 1200)
+MARGIN = 64
+MIN_AMPLITUDE, MAX_AMPLITUDE, MIN_SEPARATION = 129, 258, 43
+FINAL_ANGLES = [60, 120, 180, 240, 300]
+
+
+def generator(seed=1):
+	return SequenceGenerator(SCREEN, MARGIN, MIN_AMPLITUDE, MAX_AMPLITUDE, MIN_SEPARATION, FINAL_ANGLES, seed=seed)
+
+
+def on_screen(x, y):
+	return MARGIN < x < SCREEN[0] - MARGIN and MARGIN < y < SCREEN[1] - MARGIN
+
+
+@pytest.mark.parametrize("count, n_back, angle", [(5, 1, 60), (8, 2, 180), (11, 3, 300), (12, 1, 240)])
+def test_sequence_invariants(count, n_back, angle):
+	gen = generator()
+	for i in range(20):
+		seq = gen.generate(count, n_back, angle)
+		assert len(seq) == count
+		assert seq.n_back_index == count - (2 + n_back)
+		assert all(on_screen(x, y) for x, y in seq.positions)
+		assert ((seq.amplitudes[:-1] >= MIN_AMPLITUDE) & (seq.amplitudes[:-1] < MAX_AMPLITUDE)).all()
+		assert seq.angles[-1] == angle
+		assert not seq.rotations[:-1].any()
+
+		penultimate, n_back_pos, final = seq.positions[-2], seq.positions[seq.n_back_index], seq.positions[-1]
+		dist = np.hypot(*(n_back_pos - penultimate))
+		assert dist >= MIN_SEPARATION
+		assert seq.amplitudes[-1] == int(dist)
+		# the final disc is the n-back disc's distance from the penultimate, rotated by the trial's angle
+		theta = np.radians(seq.rotations[-1])
+		assert np.allclose(theta, np.arctan2(*(n_back_pos - penultimate)[::-1]))
+		expected = penultimate + int(dist) * np.array([np.cos(theta + np.radians(angle)),
+													   np.sin(theta + np.radians(angle))])
+		assert np.all(np.abs(final - expected) < 1)
+		# and it would have been on-screen for any of the other final angles too
+		for a in np.radians(FINAL_ANGLES):
+			x, y = np.trunc(penultimate + dist * np.array([np.cos(theta + a), np.sin(theta + a)]))
+			assert on_screen(x, y)
+
+
+def test_generation_is_seeded():
+	a, b = generator(seed=7), generator(seed=7)
+	for i in range(5):
+		assert np.array_equal(a.generate(8, 2, 120).positions, b.generate(8, 2, 120).positions)
+
+
+def test_too_few_saccades():
+	with pytest.raises(GenerationError):
+		generator().generate(3, 2, 60)
+
+
+def test_location_records():
+	seq = generator().generate(6, 1, 60)
+	data = seq.to_array()
+	data["timed_out"][:2] = 1
+	rows = location_records(data)
+	assert [r["location_num"] for r in rows] == list(range(6))
+	assert [r["timed_out"] for r in rows] == [True, True, False, False, False, False]
+	assert [r["final"] for r in rows] == [False] * 5 + [True]
+	assert [r["penultimate"] for r in rows] == [False] * 4 + [True, False]
+	assert rows[seq.n_back_index]["n_back"]
+	assert [(r["x"], r["y"]) for r in rows] == [tuple(p) for p in seq.positions.tolist()]
@@ -0,0 +1,37 @@
+import sys
+import threading
+
+import numpy as np
+
+from waldo.timing import Scheduler
+
+
+def test_waits_are_logged_and_serviced():
+	scheduler = Scheduler()
+	calls = []
+	errors = [scheduler.wait("L_{0}".format(i), 10, lambda: calls.append(1)) for i in range(3)]
+	assert [label for label, _ in scheduler.log] == ["L_0", "L_1", "L_2"]
+	assert all(error >= 0 for error in errors)  # never early
+	assert len(calls) >= 3 * 5  # serviced every ms or so while sleeping
+
+
+def test_onsets_hold_with_a_busy_thread():
+	stop = threading.Event()
+
+	def busy():  # a pure-python loop that never lets go of the GIL voluntarily, as the gaze monitor may not
+		x = 0
+		while not stop.is_set():
+			x += 1
+
+	thread = threading.Thread(target=busy)
+	thread.daemon = True
+	thread.start()
+	interval = sys.getswitchinterval()
+	scheduler = Scheduler()
+	try:
+		errors = np.array([scheduler.wait("disc", 7) for i in range(60)])
+	finally:
+		stop.set()
+		thread.join()
+	assert sys.getswitchinterval() == interval
+	assert np.percentile(errors, 95) < 1.0
@@ -0,0 +1,4 @@
+__author__ = "Jonathan Mulle"
+
+# Support modules for WaldoMkII. Nothing in this package imports klibs, so the offline tools (asset building,
+# compilation, export, analysis) can be run without a display or an eye tracker.
@@ -0,0 +1,186 @@
+"""Builds and reads the background asset pack: every image, pre-decoded and pre-scaled for each resolution, in one file.
+
+Usage:
+	python -m waldo.assetpack [--out ExpAssets/Resources/image/backgrounds.pack] [--res 1920x1200 --res 2560x1440 ...]
+
+Layout: 8 byte magic, a little-endian uint32 index length, the json index, then page-aligned RGBA blocks. The index
+holds each image's average colour, its source jpgs' mtimes, and each block's offset (from the first block), shape and
+sha1. Reading maps the file once; every image is then a zero-copy slice of that mapping.
+"""
+from __future__ import print_function
+
+__author__ = "Jonathan Mulle"
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import struct
+import tempfile
+from multiprocessing import Pool
+
+import numpy as np
+
+from waldo.assets import source_image, decode_image, color_index, RGBA, PAGE
+from waldo.files import replace
+
+MAGIC = b"WALDOPK1"
+HEADER = struct.Struct("<8sI")
+PACK_NAME = "backgrounds.pack"
+STOCK_RESOLUTIONS = ["1024x768", "1280x720", "1920x1080", "1920x1200"]
+IMAGE_KEYS = ["wally_0{0}".format(i) for i in range(1, 10)]
+
+
+def resolution_key(resolution):
+	return "{0}x{1}".format(*resolution)
+
+
+def aligned(n):
+	return (n + PAGE - 1) // PAGE * PAGE
+
+
+def sha1_file(path, chunk_size=2 ** 20):
+	h = hashlib.sha1()
+	with open(path, "rb") as f:
+		for chunk in iter(lambda: f.read(chunk_size), b""):
+			h.update(chunk)
+	return h.hexdigest()
+
+
+def build_pack(image_dir, out_f, resolutions=STOCK_RESOLUTIONS, image_keys=IMAGE_KEYS, processes=None):
+	"""Decodes every image at every resolution in a process pool, then writes the pack atomically; returns its index."""
+	resolutions = [tuple(int(i) for i in r.lower().split("x")) for r in resolutions]
+	colors = color_index(image_dir, image_keys)
+	tmp_dir = tempfile.mkdtemp(prefix="waldo_pack_")
+	try:
+		jobs = []
+		index = {"version": 1, "resolutions": [resolution_key(r) for r in resolutions], "images": {}}
+		offset = 0
+		for image_key in image_keys:
+			entry = {"color": list(colors[image_key]), "sources": {}, "blocks": {}}
+			for res in resolutions:
+				source_f, scale = source_image(image_dir, image_key, res)
+				entry["sources"][os.path.basename(source_f)] = int(os.path.getmtime(source_f))
+				block_f = os.path.join(tmp_dir, "{0}_{1}.rgba".format(image_key, resolution_key(res)))
+				jobs.append((source_f, res, block_f))
+				size = res[0] * res[1] * RGBA
+				entry["blocks"][resolution_key(res)] = {"offset": offset, "shape": [res[1], res[0], RGBA],
+														"scaled": scale, "file": block_f}
+				offset += aligned(size)
+			index["images"][image_key] = entry
+		pool = Pool(processes)
+		try:
+			pool.map(decode_image, jobs)
+		finally:
+			pool.close()
+			pool.join()
+		for entry in index["images"].values():
+			for block in entry["blocks"].values():
+				block["sha1"] = sha1_file(block["file"])
+		blocks = sorted((b for e in index["images"].values() for b in e["blocks"].values()), key=lambda b: b["offset"])
+		files = [b.pop("file") for b in blocks]
+		index_bytes = json.dumps(index, sort_keys=True).encode("utf-8")
+		data_start = aligned(HEADER.size + len(index_bytes))
+		tmp_f = "{0}.{1}.tmp".format(out_f, os.getpid())
+		with open(tmp_f, "wb") as out:
+			out.write(HEADER.pack(MAGIC, len(index_bytes)))
+			out.write(index_bytes)
+			for block, block_f in zip(blocks, files):
+				out.seek(data_start + block["offset"])
+				with open(block_f, "rb") as f:
+					shutil.copyfileobj(f, out, 2 ** 20)
+			out.truncate(data_start + offset)
+		replace(tmp_f, out_f)
+		return index
+	finally:
+		shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+class AssetPack(object):
+	"""A built pack, mapped read-only. image() returns views into the mapping, so nothing is read until it's used."""
+
+	def __init__(self, path):
+		self.path = path
+		with open(path, "rb") as f:
+			magic, length = HEADER.unpack(f.read(HEADER.size))
+			if magic != MAGIC:
+				raise IOError("{0} isn't a WaldoMkII asset pack.".format(path))
+			self.index = json.loads(f.read(length).decode("utf-8"))
+		self.data_start = aligned(HEADER.size + length)
+		self.data = np.memmap(path, dtype=np.uint8, mode="r")
+		self.resolutions = self.index["resolutions"]
+
+	@classmethod
+	def open(cls, path):
+		# None when there's no pack, ie. it hasn't been built on this machine; callers fall back to the jpgs
+		return cls(path) if os.path.isfile(path) else None
+
+	def image_keys(self):
+		return sorted(self.index["images"])
+
+	def has(self, resolution, image_keys=None):
+		res = resolution_key(resolution)
+		keys = image_keys if image_keys is not None else self.image_keys()
+		return res in self.resolutions and all(k in self.index["images"] for k in keys)
+
+	def color(self, image_key):
+		return tuple(self.index["images"][image_key]["color"])
+
+	def image(self, image_key, resolution):
+		block = self.index["images"][image_key]["blocks"][resolution_key(resolution)]
+		start = self.data_start + block["offset"]
+		shape = block["shape"]
+		# np.asarray() drops the memmap subclass (klibs only blits true ndarrays) but keeps the mapping, ie. no copy
+		return np.asarray(self.data[start:start + shape[0] * shape[1] * shape[2]]).reshape(shape)
+
+	def stale(self, image_dir):
+		"""Image keys whose source jpgs have changed since the pack was built."""
+		stale = []
+		for image_key, entry in self.index["images"].items():
+			for name, mtime in entry["sources"].items():
+				source_f = os.path.join(image_dir, image_key, name)
+				if not os.path.isfile(source_f) or int(os.path.getmtime(source_f)) != mtime:
+					stale.append(image_key)
+					break
+		return sorted(stale)
+
+	def verify(self):
+		"""Returns the (image_key, resolution) blocks whose pixels don't match their checksum."""
+		bad = []
+		for image_key, entry in self.index["images"].items():
+			for res, block in entry["blocks"].items():
+				pixels = self.image(image_key, [int(i) for i in res.split("x")])
+				if hashlib.sha1(pixels.tobytes()).hexdigest() != block["sha1"]:
+					bad.append((image_key, res))
+		return sorted(bad)
+
+	def close(self):
+		del self.data
+
+
+def main(argv=None):
+	project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+	image_dir = os.path.join(project_dir, "ExpAssets", "Resources", "image")
+	parser = argparse.ArgumentParser(description="Build WaldoMkII's background asset pack.")
+	parser.add_argument("--images", default=image_dir)
+	parser.add_argument("--out", default=os.path.join(image_dir, PACK_NAME))
+	parser.add_argument("--res", action="append", help="WxH; repeatable. Defaults to the stock jpg sizes")
+	parser.add_argument("--processes", type=int, default=None)
+	parser.add_argument("--verify", action="store_true", help="check an existing pack's checksums and exit")
+	args = parser.parse_args(argv)
+
+	if args.verify:
+		pack = AssetPack(args.out)
+		bad = pack.verify()
+		stale = pack.stale(args.images)
+		print("{0} corrupt blocks: {1}".format(len(bad), bad))
+		print("{0} stale images: {1}".format(len(stale), stale))
+		return
+	index = build_pack(args.images, args.out, args.res or STOCK_RESOLUTIONS, processes=args.processes)
+	print("{0}: {1} images at {2}, {3:.1f} MB".format(args.out, len(index["images"]), ", ".join(index["resolutions"]),
+													   os.path.getsize(args.out) / 2.0 ** 20))
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,227 @@
+__author__ = "Jonathan Mulle"
+
+import ast
+import json
+import os
+from collections import OrderedDict
+from multiprocessing import Pool, cpu_count
+
+import numpy as np
+
+from waldo.files import replace
+
+STOCK_RESOLUTION = (1920, 1200)  # the image scaled when no stock size matches the screen
+CACHE_DIR_NAME = ".cache"
+COLOR_INDEX_NAME = "average_colors.json"
+RGBA = 4
+PAGE = 4096
+
+
+def source_image(image_dir, image_key, resolution):
+	"""Returns the path of the jpg to decode for resolution, and whether it must be scaled to fit."""
+	image_f = os.path.join(image_dir, image_key, "{0}x{1}.jpg".format(*resolution))
+	if os.path.isfile(image_f):
+		return image_f, False
+	return os.path.join(image_dir, image_key, "{0}x{1}.jpg".format(*STOCK_RESOLUTION)), True
+
+
+def cache_file(cache_dir, image_key, source_f, resolution):
+	# the source's mtime is part of the key, so replacing an image invalidates its cached buffers automatically
+	mtime = int(os.path.getmtime(source_f))
+	source_res = os.path.splitext(os.path.basename(source_f))[0]
+	f_name = "{0}_{1}_{2}x{3}_{4}.rgba".format(image_key, source_res, resolution[0], resolution[1], mtime)
+	return os.path.join(cache_dir, f_name)
+
+
+def worker_pool(processes):
+	"""A process pool whose workers don't inherit this process' state, ie. the experiment's display & tracker link.
+
+	Workers come from a fork server (or are spawned, where there isn't one), so they start from a clean interpreter
+	however late the pool is created; python 2 only forks.
+	"""
+	try:
+		from multiprocessing import get_context, get_all_start_methods
+	except ImportError:
+		return Pool(processes)
+	method = "forkserver" if "forkserver" in get_all_start_methods() else "spawn"
+	return get_context(method).Pool(processes)
+
+
+def decode_image(job):
+	# runs in a worker process; writes the buffer straight to the cache so no pixel data is pickled back
+	source_f, resolution, out_f = job
+	from PIL import Image
+	img = Image.open(source_f).convert("RGBA")
+	if img.size != tuple(resolution):
+		img = img.resize(tuple(resolution), Image.LANCZOS)
+	tmp_f = "{0}.{1}.tmp".format(out_f, os.getpid())
+	np.asarray(img, dtype=np.uint8).tofile(tmp_f)
+	replace(tmp_f, out_f)  # another session may have decoded it meanwhile
+	return out_f
+
+
+def color_index(image_dir, image_keys):
+	"""Returns {image_key: average colour}, from image_dir/average_colors.json.
+
+	The index is rebuilt from each image's average_color.txt (parsed as a literal, never eval()'d) if it's missing
+	or lacks any of image_keys, so adding an image only costs a rebuild the next time it's used.
+	"""
+	index_f = os.path.join(image_dir, COLOR_INDEX_NAME)
+	try:
+		with open(index_f) as f:
+			colors = json.load(f)
+	except (IOError, ValueError):
+		colors = {}
+	missing = [k for k in image_keys if k not in colors]
+	if missing:
+		for image_key in missing:
+			with open(os.path.join(image_dir, image_key, "average_color.txt")) as f:
+				colors[image_key] = list(ast.literal_eval(f.read().strip()))
+		with open(index_f, "w") as f:
+			json.dump(colors, f, sort_keys=True)
+	return dict((k, tuple(colors[k])) for k in image_keys)
+
+
+class BackgroundLoader(object):
+	"""Decodes and scales background images in a process pool, caching raw RGBA buffers on disk.
+
+	Cached buffers are memory-mapped rather than read, so a warm start does no decoding or scaling at all. The
+	pool is a worker_pool(), as the experiment starts it with its display & tracker already open.
+	"""
+
+	def __init__(self, image_dir, resolution, cache_dir=None, processes=None):
+		self.image_dir = image_dir
+		self.resolution = tuple(int(i) for i in resolution)
+		self.cache_dir = cache_dir if cache_dir else os.path.join(image_dir, CACHE_DIR_NAME)
+		self.processes = processes if processes else max(1, cpu_count() - 1)
+		self.pools = []
+		self.pending = {}  # image_key: AsyncResult
+		self.files = {}  # image_key: cache file path
+		self.misses = 0
+		if not os.path.isdir(self.cache_dir):
+			os.makedirs(self.cache_dir)
+
+	def start(self, image_keys):
+		jobs = []
+		for image_key in image_keys:
+			source_f, scale = source_image(self.image_dir, image_key, self.resolution)
+			out_f = cache_file(self.cache_dir, image_key, source_f, self.resolution)
+			self.files[image_key] = out_f
+			if not os.path.isfile(out_f):
+				self.__prune(image_key, out_f)
+				jobs.append([image_key, (source_f, self.resolution, out_f)])
+		self.misses = len(jobs)
+		if not jobs:
+			return
+		pool = worker_pool(min(self.processes, len(jobs)))
+		for image_key, job in jobs:
+			self.pending[image_key] = pool.apply_async(decode_image, (job,))
+		pool.close()
+		self.pools.append(pool)
+
+	def ready(self, image_key):
+		try:
+			return self.pending[image_key].ready()
+		except KeyError:
+			return image_key in self.files
+
+	def get(self, image_key):
+		"""Blocks until image_key has been decoded, then returns a read-only ndarray view of its cached buffer."""
+		if image_key not in self.files:
+			self.start([image_key])
+		try:
+			self.pending.pop(image_key).get()
+		except KeyError:
+			pass
+		w, h = self.resolution
+		# np.asarray() drops the memmap subclass (klibs only blits true ndarrays) but keeps the mapping, ie. no copy
+		return np.asarray(np.memmap(self.files[image_key], dtype=np.uint8, mode="r", shape=(h, w, RGBA)))
+
+	def close(self):
+		for image_key in list(self.pending):
+			self.get(image_key)
+		for pool in self.pools:
+			pool.join()
+		self.pools = []
+
+	def __prune(self, image_key, keep_f):
+		# drop stale buffers for this image & resolution (ie. from a previous mtime)
+		res = "{0}x{1}".format(*self.resolution)
+		for f in os.listdir(self.cache_dir):
+			parts = os.path.splitext(f)[0].split("_")
+			if "_".join(parts[:-3]) != image_key or parts[-2] != res:
+				continue
+			if os.path.join(self.cache_dir, f) == keep_f:
+				continue
+			try:
+				os.remove(os.path.join(self.cache_dir, f))
+			except OSError:
+				pass
+
+
+class BackgroundStore(object):
+	"""Backgrounds by key, mapped from the disk cache on first use and kept within a memory budget.
+
+	get() returns the [image_key, pixels, average colour] triple the experiment blits from. Mapped images beyond
+	budget_mb are dropped least recently used first (the cache file stays, so reloading one is just a remap).
+	prefetch() faults an image's pages in ahead of time, ie. during the ITI, so the next trial's first blit doesn't.
+	Given an AssetPack (waldo.assetpack) that's current and built for resolution, images are sliced out of it and
+	the jpgs & disk cache are never touched. The pack is a single mapping, so dropping a view of it frees nothing:
+	budget_mb applies only without a pack, and with one every image's view is kept.
+	"""
+
+	def __init__(self, image_dir, resolution, image_keys, budget_mb=48, cache_dir=None, pack=None):
+		self.image_keys = list(image_keys)
+		self.resolution = tuple(int(i) for i in resolution)
+		if pack and pack.has(self.resolution, self.image_keys) and not pack.stale(image_dir):
+			self.pack = pack
+			self.loader = None
+			self.colors = dict((k, pack.color(k)) for k in self.image_keys)
+		else:
+			self.pack = None
+			self.loader = BackgroundLoader(image_dir, resolution, cache_dir)
+			self.colors = color_index(image_dir, self.image_keys)
+		self.image_bytes = resolution[0] * resolution[1] * RGBA
+		self.capacity = None if self.pack else max(1, int(budget_mb * 2 ** 20) // self.image_bytes)  # None: unbounded
+		self.resident = OrderedDict()  # image_key: [image_key, ndarray, avg_color], most recently used last
+		self.loads = 0
+		self.evictions = 0
+
+	def keys(self):
+		return list(self.image_keys)
+
+	def start(self):
+		# decodes whatever isn't cached yet, in the background; maps nothing
+		if self.loader:
+			self.loader.start([k for k in self.image_keys if k not in self.loader.files])
+
+	def ready(self):
+		# True once wait() would return immediately
+		return not self.loader or all(self.loader.ready(k) for k in self.image_keys)
+
+	def wait(self):
+		if self.loader:
+			self.loader.close()
+
+	def get(self, image_key):
+		try:
+			bg = self.resident.pop(image_key)
+		except KeyError:
+			pixels = self.pack.image(image_key, self.resolution) if self.pack else self.loader.get(image_key)
+			bg = [image_key, pixels, self.colors[image_key]]
+			self.loads += 1
+		self.resident[image_key] = bg
+		while self.capacity and len(self.resident) > self.capacity:
+			self.resident.popitem(last=False)
+			self.evictions += 1
+		return bg
+
+	def prefetch(self, image_key):
+		pixels = self.get(image_key)[1]
+		# reading a byte per page pulls the whole mapping into the page cache & this process
+		int(pixels.reshape(-1)[::PAGE].sum())
+
+	def close(self):
+		if self.loader:
+			self.loader.close()
+		self.resident.clear()
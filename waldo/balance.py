@@ -0,0 +1,60 @@
+__author__ = "Jonathan Mulle"
+
+import random
+
+
+class CellBalancer(object):
+	"""Chooses each trial's condition cell so valid trials reach target per cell in the fewest trials.
+
+	klibs re-queues a recycled trial (ie. a TrialException) with its cell, so recycling skews the counts of
+	completed trials; here a trial's cell is only counted by complete(), and next() always draws (at random) one of
+	the cells furthest behind, ie. a recycled cell is simply drawn again. Cells are kept in buckets by completed
+	count, each a list with a position index so moving a cell between buckets is a swap-remove: next() and complete()
+	are O(1) (amortized, for advancing the lowest bucket) however many cells the design has.
+	"""
+
+	def __init__(self, cells, target, rng=None):
+		self.cells = list(cells)
+		self.target = int(target)
+		self.rng = rng if rng else random.Random()
+		self.counts = dict((c, 0) for c in self.cells)
+		self.buckets = [list(self.cells)] + [[] for i in range(self.target)]  # completed count: [cells]
+		self.positions = dict((c, i) for i, c in enumerate(self.cells))  # cell: index in its bucket
+		self.lowest = 0 if self.cells and self.target else self.target
+		self.completed = 0
+
+	@property
+	def done(self):
+		return self.lowest >= self.target
+
+	@property
+	def remaining(self):
+		return len(self.cells) * self.target - self.completed
+
+	def next(self):
+		"""A cell with the fewest completed trials, or None once every cell has reached target."""
+		if self.done:
+			return None
+		bucket = self.buckets[self.lowest]
+		return bucket[self.rng.randrange(len(bucket))]
+
+	def complete(self, cell):
+		"""Counts a valid trial of cell; a cell already at target is counted but stays there."""
+		k = self.counts[cell]
+		self.counts[cell] = k + 1
+		if k >= self.target:
+			return
+		self.completed += 1
+		self.__remove(k, cell)
+		self.buckets[k + 1].append(cell)
+		self.positions[cell] = len(self.buckets[k + 1]) - 1
+		while self.lowest < self.target and not self.buckets[self.lowest]:
+			self.lowest += 1
+
+	def __remove(self, k, cell):
+		bucket = self.buckets[k]
+		i = self.positions[cell]
+		last = bucket.pop()
+		if last != cell:
+			bucket[i] = last
+			self.positions[last] = i
@@ -0,0 +1,264 @@
+"""Times WaldoMkII's hot paths headlessly, against a fake tracker and a scratch database.
+
+Usage:
+	python -m waldo.bench [--trials 10] [--screen 1920x1200] [--out baseline.json] [--compare baseline.json]
+
+klibs needs a display and a real EyeLink, so no WaldoMkII method runs here: the harness drives the components those
+methods are built on, in trial order, and each metric is named for the component it times, not for the method:
+
+	experiment_imports_ms     a fresh interpreter importing the waldo modules experiment.py imports at module level
+							  (read from experiment.py, so it follows what's deferred); the startup phases of real
+							  sessions, to the first trial's screen, are logged to ExpAssets/Data/startup.jsonl
+	bg_load_cold_s / _warm_s  BackgroundStore start() & wait() plus a get() of every image (setup's asset work;
+							  without an asset pack), on an empty then a warm decode cache
+	generate_sequence_ms      SequenceGenerator.generate() (the bulk of generate_locations())
+	draw_us                   display_refresh()'s CPU side: RetainedRenderer.needs_redraw() and, for a changed scene,
+							  the SpriteCache lookups and TextureCache blits, issued to a GL that does nothing; the
+							  GPU's work and the flip, ie. frame time, aren't measured (see waldo.instrument)
+	detection_latency_ms      GazeMonitor fed by FakeEyeLink: tracker event due -> detected
+	loop_latency_ms           detected -> seen by the trial loop
+	onset_error_ms            Scheduler onset delays
+	writer_flush_ms           TrialDataWriter.flush() on a background writer, as trial_clean_up() uses it
+	writer_wait_ms            TrialDataWriter.wait() at the next trial's start, as in trial_prep()
+
+--compare exits non-zero if any metric's p95 regressed beyond --tolerance.
+"""
+from __future__ import print_function
+
+__author__ = "Jonathan Mulle"
+
+import argparse
+import json
+import os
+import ast
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+
+from waldo.assets import BackgroundStore
+from waldo.compiler import PROJECT_DIR, IMAGE_KEYS, geometry_from_ppd
+from waldo.datawriter import TrialDataWriter
+from waldo.fakelink import FakeEyeLink, Observer
+from waldo.gaze import GazeMonitor, FIXATE, SACCADE_END, ENDFIX, ENDSACC
+from waldo.render import RetainedRenderer, SpriteCache, TextureCache
+from waldo.targets import SequenceGenerator
+from waldo.timing import Scheduler, clock
+
+IMAGE_DIR = os.path.join(PROJECT_DIR, "ExpAssets", "Resources", "image")
+SCHEMA_F = os.path.join(PROJECT_DIR, "ExpAssets", "Config", "WaldoMkII_schema.sql")
+EXPERIMENT_F = os.path.join(PROJECT_DIR, "experiment.py")
+
+
+def experiment_imports(path=EXPERIMENT_F):
+	# the waldo modules experiment.py imports at module level, ie. before anything is on screen
+	with open(path) as f:
+		tree = ast.parse(f.read())
+	modules = [n.module for n in tree.body if isinstance(n, ast.ImportFrom)]
+	return sorted(set(m for m in modules if m and m.startswith("waldo.")))
+
+
+class NullGL(object):
+	# stands in for OpenGL.GL: constants are 0, calls do nothing and texture ids are 1
+	def __getattr__(self, name):
+		value = 0 if name.startswith("GL_") else (lambda *args: 1)
+		setattr(self, name, value)
+		return value
+
+
+def summarize(values):
+	v = np.asarray(values, dtype=np.float64)
+	if not len(v):
+		return {"n": 0}
+	return {"n": len(v), "mean": float(v.mean()), "p50": float(np.percentile(v, 50)),
+			"p95": float(np.percentile(v, 95)), "p99": float(np.percentile(v, 99)), "max": float(v.max())}
+
+
+class Bench(object):
+
+	def __init__(self, screen, ppd, inter_disc_interval=300, disc_timeout=1000, min_saccades=5, max_saccades=12,
+				 seed=1):
+		self.screen = screen
+		self.geometry = geometry_from_ppd(screen, ppd)
+		self.idi = inter_disc_interval
+		self.disc_timeout = disc_timeout
+		self.min_saccades = min_saccades
+		self.max_saccades = max_saccades
+		self.rng = np.random.RandomState(seed)
+		self.samples = dict((k, []) for k in ["experiment_imports_ms", "bg_load_cold_s", "bg_load_warm_s", "generate_sequence_ms",
+											  "draw_us", "detection_latency_ms", "loop_latency_ms",
+											  "onset_error_ms", "writer_flush_ms", "writer_wait_ms"])
+		self.tmp = tempfile.mkdtemp(prefix="waldo_bench_")
+
+	def run(self, trials):
+		try:
+			self.bench_setup()
+			self.bench_trials(trials)
+		finally:
+			shutil.rmtree(self.tmp, ignore_errors=True)
+		return dict((k, summarize(v)) for k, v in self.samples.items())
+
+	def bench_setup(self, runs=3):
+		script = "import time; t = time.time(); import {0}; print(time.time() - t)"
+		script = script.format(", ".join(experiment_imports()))
+		for i in range(runs):
+			out = subprocess.check_output([sys.executable, "-c", script], cwd=PROJECT_DIR)
+			self.samples["experiment_imports_ms"].append(float(out) * 1000)
+		cache = os.path.join(self.tmp, "cache")
+		for label in ["bg_load_cold_s", "bg_load_warm_s"]:
+			t = clock()
+			store = BackgroundStore(IMAGE_DIR, self.screen, IMAGE_KEYS, cache_dir=cache)
+			store.start()
+			store.wait()
+			for k in IMAGE_KEYS:
+				store.get(k)
+			store.close()
+			self.samples[label].append(clock() - t)
+
+	def bench_trials(self, trials):
+		g = self.geometry
+		generator = SequenceGenerator(self.screen, g["margin"], g["min_amplitude"], g["max_amplitude"],
+									  g["min_separation"], seed=self.rng.randint(2 ** 31))
+		db_path = os.path.join(self.tmp, "bench.db")
+		with open(SCHEMA_F) as f:
+			schema = f.read()
+		c = sqlite3.connect(db_path)
+		c.executescript(schema)
+		c.close()
+		writer = TrialDataWriter(db_path)
+		centre = (self.screen[0] // 2, self.screen[1] // 2)
+		tracker = FakeEyeLink(Observer(seed=self.rng.randint(2 ** 31)), start_pos=centre)
+		monitor = GazeMonitor(tracker)
+		scheduler = Scheduler()
+		radius = g["min_separation"] // 2
+		draw = self.draw_path()
+		try:
+			for trial in range(trials):
+				count = self.rng.randint(self.min_saccades, self.max_saccades)
+				t = clock()
+				seq = generator.generate(count, self.rng.randint(1, 3), int(self.rng.choice(range(0, 360, 60))))
+				self.samples["generate_sequence_ms"].append((clock() - t) * 1000)
+				t = clock()
+				writer.wait()
+				self.samples["writer_wait_ms"].append((clock() - t) * 1000)
+				tracker.start(trial)
+				monitor.resume(tracker.now())
+				self.run_trial(seq, tracker, monitor, draw, scheduler, writer, radius)
+				monitor.pause()
+				tracker.stop()
+				t = clock()
+				writer.flush(trial_id=trial + 1)
+				self.samples["writer_flush_ms"].append((clock() - t) * 1000)
+				self.samples["onset_error_ms"].extend(e for label, e in scheduler.log)
+				scheduler.reset()
+		finally:
+			monitor.stop()
+			writer.close()
+
+	def draw_path(self):
+		# display_refresh() for a present-background trial, from needs_redraw() to the last blit
+		renderer = RetainedRenderer()
+		sprites = SpriteCache()
+		textures = TextureCache(gl=NullGL())
+		bg = np.zeros((self.screen[1], self.screen[0], 4), dtype=np.uint8)
+		disc_d = self.geometry["min_separation"] // 2
+		disc_key = ("annulus", disc_d)
+
+		def draw(positions):
+			if not renderer.needs_redraw("present", False, tuple(positions)):
+				return
+			textures.blit("bg", bg, background=True)
+			for pos in positions.values():
+				disc = sprites.get(disc_key, lambda: np.zeros((disc_d, disc_d, 4), dtype=np.uint8))
+				textures.blit(disc_key, disc, 5, pos)
+		return draw
+
+	def run_trial(self, seq, tracker, monitor, draw, scheduler, writer, radius):
+		for i in range(len(seq)):
+			final = i == len(seq) - 1
+			name = "saccade_{0}".format(i)
+			pos = tuple(int(v) for v in seq.positions[i])
+			if i:
+				scheduler.wait(name + "_onset_delay_disc", self.idi, lambda: monitor.drain(0))
+			monitor.arm(name, pos, radius)
+			visible = {i: pos}
+			onset = tracker.now()
+			tracker.present(pos)
+			deadline = scheduler.deadline(self.disc_timeout)
+			target = SACCADE_END if final else FIXATE
+			done = False
+			while not done and clock() < deadline:
+				t = clock()
+				draw(visible)
+				self.samples["draw_us"].append((clock() - t) * 1e6)
+				for event in monitor.drain(0.001):
+					if event.boundary != name or event.kind != target or event.el_time < onset:
+						continue
+					got = clock()
+					due = tracker.due.get((ENDFIX if target == FIXATE else ENDSACC, event.el_time))
+					if due:
+						self.samples["detection_latency_ms"].append((event.detected_at - due) * 1000)
+					self.samples["loop_latency_ms"].append((got - event.detected_at) * 1000)
+					done = True
+			writer.add("trial_locations", {"participant_id": 1, "trial_id": -1, "trial_num": 0, "block_num": 1,
+										   "location_num": i, "x": pos[0], "y": pos[1], "amplitude": 0, "angle": 0,
+										   "n_back": "FALSE", "penultimate": "FALSE", "final": str(final).upper(),
+										   "timed_out": str(not done).upper(), "rt": -1, "fixate_trial_time": -1,
+										   "fixate_el_time": -1, "onset_error": -1})
+			for label in ["start", "fixate"]:
+				writer.add("events", {"user_id": 1, "trial_id": -1, "trial_num": 0, "label": name + label,
+									  "trial_clock": 0.0, "eyelink_clock": 0})
+			monitor.disarm(name)
+
+
+def compare(current, baseline, tolerance):
+	regressions = []
+	for k, stats in current.items():
+		base = baseline.get("metrics", {}).get(k)
+		if not base or not base.get("n") or not stats.get("n"):
+			continue
+		ratio = stats["p95"] / base["p95"] if base["p95"] else 1.0
+		flag = "REGRESSED" if ratio > 1 + tolerance else ""
+		print("{0:<24} p95 {1:>10.3f} vs {2:>10.3f}  x{3:.2f} {4}".format(k, stats["p95"], base["p95"], ratio, flag))
+		if flag:
+			regressions.append(k)
+	return regressions
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Benchmark WaldoMkII's hot paths against a fake tracker.")
+	parser.add_argument("--trials", type=int, default=10)
+	parser.add_argument("--screen", default="1920x1200")
+	parser.add_argument("--ppd", type=float, default=43)
+	parser.add_argument("--idi", type=int, default=300, help="inter_disc_interval, ms")
+	parser.add_argument("--seed", type=int, default=1)
+	parser.add_argument("--out", help="write the results here as a json baseline")
+	parser.add_argument("--compare", help="baseline json to compare against")
+	parser.add_argument("--tolerance", type=float, default=0.25, help="allowed fractional p95 increase")
+	args = parser.parse_args(argv)
+
+	screen = [int(i) for i in args.screen.lower().split("x")]
+	metrics = Bench(screen, args.ppd, args.idi, seed=args.seed).run(args.trials)
+	result = {"meta": {"screen": screen, "ppd": args.ppd, "trials": args.trials, "idi": args.idi,
+					   "python": sys.version.split()[0], "numpy": np.__version__},
+			  "metrics": metrics}
+	for k in sorted(metrics):
+		m = metrics[k]
+		if m["n"]:
+			print("{0:<24} n={1:<6} mean={2:<10.3f} p95={3:<10.3f} max={4:.3f}".format(k, m["n"], m["mean"], m["p95"],
+																					  m["max"]))
+	print("(draw_us is the CPU side of display_refresh() only; frame time is not measured here)")
+	if args.out:
+		with open(args.out, "w") as f:
+			json.dump(result, f, indent=2, sort_keys=True)
+	if args.compare:
+		with open(args.compare) as f:
+			if compare(metrics, json.load(f), args.tolerance):
+				sys.exit(1)
+
+
+if __name__ == "__main__":
+	main()
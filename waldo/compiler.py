@@ -0,0 +1,206 @@
+"""Precompiles a participant's whole session of disc sequences and background assignments.
+
+Usage:
+	python -m waldo.compiler <random_seed> --screen 1920x1200 --ppd 43 [--out ExpAssets/Compiled]
+
+The output is a single .npz, one entry per trial, grouped by condition cell (angle x bg_state x n_back) so that the
+experiment can index into it regardless of the order klibs' trial factory serves conditions in.
+"""
+from __future__ import print_function
+
+__author__ = "Jonathan Mulle"
+
+import argparse
+import hashlib
+import itertools
+import os
+import re
+
+import numpy as np
+
+from waldo.targets import SequenceGenerator, TargetSequence
+
+FACTORS = ["angle", "bg_state", "n_back"]
+FORMAT_VERSION = 1
+SPARE_PER_CELL = 4  # extra entries per cell to absorb recycled trials
+GEOMETRY_KEYS = ["screen_x", "screen_y", "margin", "min_amplitude", "max_amplitude", "min_separation"]
+DISC_STROKE = 2  # px; the search disc's outline, which its surface includes on either side
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONFIG_F = os.path.join(PROJECT_DIR, "ExpAssets", "Config", "WaldoMkII_config.csv")
+COMPILED_DIR = os.path.join(PROJECT_DIR, "ExpAssets", "Compiled")
+IMAGE_KEYS = ["wally_0{0}".format(i) for i in range(1, 10)]
+
+
+def read_factors(config_f=CONFIG_F):
+	"""Reads the klibs factor columns (ie. 'angle.param') into {factor: [levels]}, stopping at the first blank line."""
+	factors = None
+	with open(config_f) as f:
+		for line in f:
+			line = line.strip()
+			if line.startswith("#"):
+				continue
+			if not line:
+				if factors:
+					break
+				continue
+			cells = [c.strip() for c in line.split(",")]
+			if factors is None:
+				header = [c.replace(".param", "") for c in cells]
+				factors = dict((h, []) for h in header)
+				continue
+			for h, c in zip(header, cells):
+				if c:
+					factors[h].append(c)
+	return dict((k, factors[k]) for k in FACTORS)
+
+
+def seed_int(random_seed):
+	# klibs stores seeds as text; hash so every representation of a seed maps to one 32-bit RandomState seed
+	return int(hashlib.md5(str(random_seed).encode("utf-8")).hexdigest()[:8], 16)
+
+
+def session_file(compiled_dir, random_seed):
+	return os.path.join(compiled_dir, "{0}.npz".format(re.sub(r"[^\w.-]", "_", str(random_seed))))
+
+
+def cell_key(angle, bg_state, n_back):
+	return int(angle), str(bg_state).strip(), int(n_back)
+
+
+def compile_session(random_seed, geometry, factors, trial_count, min_saccades, max_saccades, final_angles=None,
+					image_keys=IMAGE_KEYS, spare=SPARE_PER_CELL):
+	rng = np.random.RandomState(seed_int(random_seed))
+	if final_angles is None:
+		final_angles = sorted(int(a) for a in factors["angle"])
+	generator = SequenceGenerator((geometry["screen_x"], geometry["screen_y"]), geometry["margin"],
+								  geometry["min_amplitude"], geometry["max_amplitude"], geometry["min_separation"],
+								  final_angles, seed=rng.randint(2 ** 31))
+	cells = [cell_key(*c) for c in itertools.product(*[factors[f] for f in FACTORS])]
+	per_cell = -(-trial_count // len(cells)) + spare
+	entries = len(cells) * per_cell
+
+	positions = np.full((entries, max_saccades, 2), -1, dtype=np.int16)
+	amplitudes = np.zeros((entries, max_saccades), dtype=np.int16)
+	angles = np.zeros((entries, max_saccades), dtype=np.int16)
+	rotations = np.zeros(entries, dtype=np.float32)
+	saccades = np.zeros(entries, dtype=np.int8)
+	bg_images = np.zeros(entries, dtype=np.int8)
+	e = 0
+	for angle, bg_state, n_back in cells:
+		for i in range(per_cell):
+			count = rng.randint(min_saccades, max_saccades)  # randrange() semantics, as in trial_prep()
+			seq = generator.generate(count, n_back, angle)
+			positions[e, :count] = seq.positions
+			amplitudes[e, :count] = seq.amplitudes
+			angles[e, :count] = seq.angles
+			rotations[e] = seq.rotations[-1]
+			saccades[e] = count
+			bg_images[e] = rng.randint(len(image_keys))
+			e += 1
+
+	return {"version": np.array(FORMAT_VERSION),
+			"random_seed": np.array(str(random_seed)),
+			"geometry": np.array([geometry[k] for k in GEOMETRY_KEYS], dtype=np.int32),
+			"cells": np.array(["{0}|{1}|{2}".format(*c) for c in cells]),
+			"cell_offsets": np.arange(len(cells) + 1, dtype=np.int32) * per_cell,
+			"image_keys": np.array(image_keys),
+			"positions": positions,
+			"amplitudes": amplitudes,
+			"angles": angles,
+			"rotations": rotations,
+			"saccades": saccades,
+			"bg_images": bg_images}
+
+
+class CompiledSession(object):
+	"""Serves precompiled entries cell by cell; next() returns None once a cell is exhausted."""
+
+	def __init__(self, path):
+		with np.load(path) as f:
+			self.data = dict((k, f[k]) for k in f.files)
+		if int(self.data["version"]) != FORMAT_VERSION:
+			raise RuntimeError("Compiled session '{0}' is from an incompatible version.".format(path))
+		self.path = path
+		self.geometry = dict(zip(GEOMETRY_KEYS, self.data["geometry"].tolist()))
+		self.cells = dict((c, i) for i, c in enumerate(self.data["cells"].tolist()))
+		self.n_backs = [int(c.split("|")[2]) for c in self.data["cells"].tolist()]
+		self.cursors = [0] * len(self.cells)
+
+	@classmethod
+	def open(cls, compiled_dir, random_seed):
+		path = session_file(compiled_dir, random_seed)
+		return cls(path) if os.path.isfile(path) else None
+
+	def check_geometry(self, geometry):
+		"""Returns how this session's geometry differs from geometry's, as "key=compiled (expected live)" strings."""
+		return ["{0}={1} (expected {2})".format(k, self.geometry[k], geometry[k]) for k in GEOMETRY_KEYS
+				if int(geometry[k]) != self.geometry[k]]
+
+	def next(self, angle, bg_state, n_back):
+		c = self.cells["{0}|{1}|{2}".format(*cell_key(angle, bg_state, n_back))]
+		e = self.data["cell_offsets"][c] + self.cursors[c]
+		if e >= self.data["cell_offsets"][c + 1]:
+			return None
+		self.cursors[c] += 1
+		return self.entry(e)
+
+	def entry(self, e):
+		count = int(self.data["saccades"][e])
+		rotations = np.zeros(count)
+		rotations[-1] = self.data["rotations"][e]
+		c = int(np.searchsorted(self.data["cell_offsets"], e, side="right") - 1)
+		seq = TargetSequence(self.data["positions"][e, :count].astype(np.int64), self.data["amplitudes"][e, :count],
+							 self.data["angles"][e, :count], rotations, count - (2 + self.n_backs[c]))
+		return seq, str(self.data["image_keys"][self.data["bg_images"][e]])
+
+
+def disc_surface(disc_diameter):
+	return disc_diameter + 2 * DISC_STROKE
+
+
+def generation_geometry(screen_x_y, disc_diameter, min_amplitude, max_amplitude, min_separation=None):
+	"""The geometry sequences are generated in, from sizes in px; WaldoMkII and the offline tools all derive it here,
+	so a compiled session matches the display it was compiled for."""
+	return {"screen_x": int(screen_x_y[0]),
+			"screen_y": int(screen_x_y[1]),
+			"margin": int(disc_diameter * 1.5),
+			"min_amplitude": int(min_amplitude),
+			"max_amplitude": int(max_amplitude),
+			"min_separation": int(min_separation) if min_separation else 2 * disc_surface(disc_diameter)}
+
+
+def geometry_from_ppd(screen_x_y, ppd, min_amplitude_deg=3, max_amplitude_deg=6, disc_diameter_deg=1,
+					  min_separation=None):
+	# degrees to px as klibs' deg_to_px() converts them for WaldoMkII.__init__()
+	return generation_geometry(screen_x_y, int(disc_diameter_deg * ppd), int(min_amplitude_deg * ppd),
+							   int(max_amplitude_deg * ppd), min_separation)
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Precompile a WaldoMkII session for one participant seed.")
+	parser.add_argument("random_seed")
+	parser.add_argument("--screen", required=True, help="WxH, ie. 1920x1200")
+	parser.add_argument("--ppd", required=True, type=float, help="pixels per degree of visual angle")
+	parser.add_argument("--min-separation", type=int, help="penultimate to n-back minimum distance in px")
+	parser.add_argument("--trials-per-block", type=int, default=72)
+	parser.add_argument("--blocks", type=int, default=3)
+	parser.add_argument("--min-saccades", type=int, default=5)
+	parser.add_argument("--max-saccades", type=int, default=12)
+	parser.add_argument("--config", default=CONFIG_F)
+	parser.add_argument("--out", default=COMPILED_DIR)
+	args = parser.parse_args(argv)
+
+	screen = [int(i) for i in args.screen.lower().split("x")]
+	geometry = geometry_from_ppd(screen, args.ppd, min_separation=args.min_separation)
+	data = compile_session(args.random_seed, geometry, read_factors(args.config), args.trials_per_block * args.blocks,
+						   args.min_saccades, args.max_saccades)
+	if not os.path.isdir(args.out):
+		os.makedirs(args.out)
+	path = session_file(args.out, args.random_seed)
+	np.savez_compressed(path, **data)
+	print("{0}: {1} trials over {2} cells ({3} bytes)".format(path, len(data["saccades"]), len(data["cells"]),
+															  os.path.getsize(path)))
+
+
+if __name__ == "__main__":
+	main()
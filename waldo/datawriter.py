@@ -0,0 +1,143 @@
+__author__ = "Jonathan Mulle"
+
+import sqlite3
+import threading
+
+try:
+	from Queue import Queue
+except ImportError:
+	from queue import Queue
+
+
+class TrialDataWriter(object):
+	"""Buffers a trial's rows in memory and commits them together, optionally from a writer thread.
+
+	Rows are collected with add() during the trial, then flush() writes every table with one executemany() each
+	inside a single transaction. With background=True the transaction runs on a writer thread (sqlite connections
+	are thread-bound, so that thread owns its own), and wait() blocks until everything queued has committed, ie.
+	call it before anything timing-sensitive starts. The database is put in WAL mode so commits don't fsync the
+	main file and never block klibs' own connection from reading.
+
+	Given a waldo.store.StoreClient as remote, each committed batch is also forwarded to the central store (on the
+	writer thread, so the trial loop never waits on the network); rows added with local=False go only there.
+	"""
+
+	def __init__(self, db_path, background=True, remote=None):
+		self.db_path = db_path
+		self.background = background
+		self.remote = remote
+		self.pending = {}  # table: [columns, [rows]]
+		self.remote_pending = {}  # as pending, for rows only the central store gets (ie. klibs' own trials row)
+		self.queue = None
+		self.connection = None
+		self.batches = 0
+		self.rows_written = 0
+		self.error = None
+		if background:
+			self.queue = Queue()
+			self.thread = threading.Thread(target=self.__run)
+			self.thread.daemon = True
+			self.thread.start()
+
+	def add(self, table, row, local=True):
+		pending = self.pending if local else self.remote_pending
+		try:
+			columns, rows = pending[table]
+		except KeyError:
+			columns, rows = pending[table] = [sorted(row), []]
+		rows.append([row[c] for c in columns])
+
+	def discard(self):
+		self.pending = {}
+		self.remote_pending = {}
+
+	def flush(self, **stamp):
+		# stamp fills in values only known once the trial is over (ie. trial_id) on every buffered row
+		batch = self.__stamp(self.pending, stamp)
+		remote_batch = self.__stamp(self.remote_pending, stamp) + batch if self.remote else []
+		self.pending = {}
+		self.remote_pending = {}
+		if not batch and not remote_batch:
+			return
+		if self.background:
+			self.queue.put([batch, remote_batch])
+		else:
+			self.__write(batch, remote_batch)
+
+	def wait(self):
+		if self.background:
+			self.queue.join()
+		if self.error:
+			e, self.error = self.error, None
+			raise e
+
+	def close(self):
+		if self.background:
+			self.wait()
+			self.queue.put(None)
+			self.thread.join()
+		elif self.connection:
+			self.connection.close()
+			self.connection = None
+		if self.remote:
+			self.remote.close()
+
+	def __stamp(self, pending, stamp):
+		batch = []
+		for table, (columns, rows) in pending.items():
+			if stamp:
+				extra = [c for c in stamp if c not in columns]
+				idx = [(columns.index(c), stamp[c]) for c in stamp if c in columns]
+				for row in rows:
+					for i, v in idx:
+						row[i] = v
+					row.extend(stamp[c] for c in extra)
+				columns = columns + extra
+			batch.append([table, columns, rows])
+		return batch
+
+	def __connect(self):
+		# isolation_level=None so that BEGIN/COMMIT below are the only transaction boundaries
+		connection = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+		connection.execute("PRAGMA journal_mode=WAL")
+		connection.execute("PRAGMA synchronous=NORMAL")
+		return connection
+
+	def __write(self, batch, remote_batch):
+		if self.remote and remote_batch:
+			self.remote.send(remote_batch)  # the central store commits while this process commits locally
+		if batch:
+			self.__commit(batch)
+		if self.remote and remote_batch:
+			self.remote.wait()
+
+	def __commit(self, batch):
+		if not self.connection:
+			self.connection = self.__connect()
+		c = self.connection
+		c.execute("BEGIN IMMEDIATE")
+		try:
+			for table, columns, rows in batch:
+				# identical sql strings hit sqlite3's statement cache, ie. each insert is prepared once per session
+				q = "INSERT INTO {0} ({1}) VALUES ({2})".format(table, ", ".join(columns), ", ".join("?" * len(columns)))
+				c.executemany(q, rows)
+				self.rows_written += len(rows)
+			c.execute("COMMIT")
+		except Exception:
+			c.execute("ROLLBACK")
+			raise
+		self.batches += 1
+
+	def __run(self):
+		while True:
+			batch = self.queue.get()
+			try:
+				if batch is None:
+					if self.connection:
+						self.connection.close()
+					return
+				self.__write(*batch)
+			except Exception as e:
+				self.error = e  # re-raised on the experiment's thread by wait()
+			finally:
+				self.queue.task_done()
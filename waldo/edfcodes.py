@@ -0,0 +1,57 @@
+__author__ = "Jonathan Mulle"
+
+import csv
+import os
+import re
+
+MESSAGING_F = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ExpAssets", "Config",
+						   "WaldoMkII_messaging.csv")
+MESSAGE_RE = re.compile(r"TA_(\d+): (.*)$")
+
+
+def compact(v):
+	# keeps EDF messages short (the tracker truncates long ones) without losing timing precision
+	if isinstance(v, float):
+		return "{0:.6f}".format(v).rstrip("0").rstrip(".")
+	return str(v).replace(" ", "_")
+
+
+class EventCodes(object):
+	"""The project's EDF event codes, read from WaldoMkII_messaging.csv.
+
+	Every message is "TA_<code>: <name> key=value ...", so parse() can recover a message's label and arguments
+	from an ASC file without knowing its template.
+	"""
+
+	def __init__(self, messaging_f=MESSAGING_F):
+		self.codes = {}  # label: [arg count, prepend code, code, message]
+		self.labels = {}  # code: label
+		with open(messaging_f) as f:
+			for row in csv.reader((l for l in f if l.strip() and not l.startswith("#")), skipinitialspace=True):
+				label, argc, prepend, code, message = [c.strip() for c in row]
+				argc, code = int(argc or 0), int(code)
+				if not 2 <= code <= 255:
+					raise ValueError("Event code for '{0}' must be between 2 and 255.".format(label))
+				if len(set(re.findall(r"{(\d+)}", message))) != argc:
+					raise ValueError("Message for '{0}' doesn't take {1} arguments.".format(label, argc))
+				self.codes[label] = [argc, prepend.upper() == "TRUE", code, message]
+				self.labels[code] = label
+
+	def format(self, label, *args):
+		argc, prepend, code, message = self.codes[label]
+		if len(args) != argc:
+			raise ValueError("'{0}' takes {1} arguments ({2} given).".format(label, argc, len(args)))
+		message = message.format(*[compact(a) for a in args])
+		return "TA_{0}: {1}".format(code, message) if prepend else message
+
+	def parse(self, message):
+		"""Returns (label, {key: value}) for one of this project's messages, otherwise None. Values stay strings."""
+		m = MESSAGE_RE.search(message)
+		if not m:
+			return None
+		try:
+			label = self.labels[int(m.group(1))]
+		except KeyError:
+			return None
+		fields = m.group(2).split()
+		return label, dict(f.split("=", 1) for f in fields[1:] if "=" in f)
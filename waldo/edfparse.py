@@ -0,0 +1,185 @@
+"""Rebuilds the trials, trial_locations and trial_summary tables from EDF markup, ie. when a session's database is lost.
+
+Usage:
+	python -m waldo.edfparse --db rebuilt.db [--processes N] <file or directory> [...]
+
+Reads ASC files (or EDFs, converted on the fly with SR Research's edf2asc, which must be on the PATH, without
+samples) one line at a time; only messages from WaldoMkII_messaging.csv are used. Several files are parsed in a process
+pool, each worker returning a whole file's trial & location rows (never its samples) for the parent to write; a single
+file (or --processes 1) is parsed in the parent, and each trial is written as it's read, so memory is bounded by one
+trial. Either way there's one transaction per file.
+"""
+from __future__ import print_function
+
+__author__ = "Jonathan Mulle"
+
+import argparse
+import os
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+from multiprocessing import Pool
+
+from waldo.edfcodes import EventCodes, MESSAGING_F
+from waldo.summary import pivot, wide_columns
+
+SCHEMA_F = os.path.join(os.path.dirname(MESSAGING_F), "WaldoMkII_schema.sql")
+TRIAL_COLUMNS = ["participant_id", "block_num", "trial_num", "frames_drawn", "frames_skipped", "bg_image", "timed_out",
+				 "rt", "target_type", "bg_state", "n_back", "amplitude", "deviation", "real_angle", "saccades"]
+LOCATION_COLUMNS = ["participant_id", "trial_id", "trial_num", "block_num", "location_num", "x", "y", "amplitude",
+					"angle", "n_back", "penultimate", "final", "timed_out", "rt", "fixate_trial_time", "fixate_el_time",
+					"onset_error"]
+SUMMARY_COLUMNS = ["trial_id", "participant_id", "block_num", "trial_num"] + wide_columns()
+
+
+def value(s):
+	if s in ("True", "False"):
+		return s == "True"
+	if s == "None":
+		return None
+	for t in (int, float):
+		try:
+			return t(s)
+		except ValueError:
+			pass
+	return s
+
+
+def messages(path, codes):
+	"""Yields (tracker time, label, fields) for each of the project's messages in an ASC file."""
+	with open(path) as f:
+		for line in f:
+			if not line.startswith("MSG"):
+				continue
+			parts = line.split(None, 2)
+			if len(parts) < 3:
+				continue
+			parsed = codes.parse(parts[2].rstrip())
+			if parsed:
+				yield float(parts[1]), parsed[0], dict((k, value(v)) for k, v in parsed[1].items())
+
+
+def trials(path, codes):
+	"""Yields (trial row, [location rows]) per completed trial; recycled & unfinished trials are skipped."""
+	trial = None
+	locations = {}
+	for el_time, label, f in messages(path, codes):
+		if label == "trial_start":
+			trial = {"participant_id": f["pid"], "trial_num": f["trial"], "block_num": f["block"], "bg_image": f["bg"],
+					 "bg_state": f["bg_state"], "n_back": f["n_back"], "saccades": f["saccades"]}
+			locations = {}
+		elif trial is None:
+			continue
+		elif label == "location":
+			locations[f["i"]] = {"participant_id": trial["participant_id"], "trial_num": trial["trial_num"],
+								 "block_num": trial["block_num"], "location_num": f["i"], "x": f["x"], "y": f["y"],
+								 "amplitude": f["amp"], "angle": f["angle"], "n_back": f["nb"], "penultimate": f["pen"],
+								 "final": f["fin"], "timed_out": True, "rt": -1, "fixate_trial_time": -1.0,
+								 "fixate_el_time": -1.0, "onset_error": -1.0}
+		elif label in ("fixate", "final_saccade"):
+			l = locations[f["i"]]
+			l.update({"timed_out": False, "rt": f["rt"]})
+			if label == "fixate":
+				l.update({"fixate_trial_time": f["tt"], "fixate_el_time": f["el"]})
+		elif label == "onset_delay":
+			locations[f["i"]]["onset_error"] = f["err"]
+		elif label == "fixation_failed":
+			trial = None  # recycled by klibs, so it never reached the database
+		elif label == "trial_end":
+			trial.update({"timed_out": f["to"], "rt": f["rt"], "target_type": f["type"], "amplitude": f["amp_deg"],
+						  "real_angle": f["real_angle"], "deviation": f["dev"], "frames_drawn": f["fd"],
+						  "frames_skipped": f["fs"]})
+			yield trial, [locations[i] for i in sorted(locations)]
+			trial = None
+
+
+def file_trials(path):
+	"""As trials(), for an ASC or an EDF; EDFs become a temporary ASC of messages & events only (-ns: no samples)."""
+	codes = EventCodes()
+	tmp_dir = None
+	try:
+		if path.lower().endswith(".edf"):
+			tmp_dir = tempfile.mkdtemp(prefix="waldo_asc_")
+			with open(os.devnull, "w") as devnull:
+				subprocess.check_call(["edf2asc", "-y", "-ns", "-p", tmp_dir, path], stdout=devnull)
+			asc = os.path.join(tmp_dir, os.path.splitext(os.path.basename(path))[0] + ".asc")
+		else:
+			asc = path
+		for row in trials(asc, codes):
+			yield row
+	finally:
+		if tmp_dir:
+			shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def parse_file(path):
+	# runs in a worker; the file's rows go back to the parent in one piece
+	return path, list(file_trials(path))
+
+
+def find_files(paths):
+	for p in paths:
+		if os.path.isdir(p):
+			for root, dirs, files in os.walk(p):
+				for f in sorted(files):
+					if f.lower().endswith((".asc", ".edf")):
+						yield os.path.join(root, f)
+		else:
+			yield p
+
+
+def write(connection, rows):
+	"""Inserts rows ((trial, [locations]), any iterable) in one transaction; returns (trials, locations) written."""
+	counts = [0, 0]
+	c = connection.cursor()
+	c.execute("BEGIN")
+	t_q = "INSERT INTO trials ({0}) VALUES ({1})".format(", ".join(TRIAL_COLUMNS), ", ".join("?" * len(TRIAL_COLUMNS)))
+	l_q = "INSERT INTO trial_locations ({0}) VALUES ({1})".format(", ".join(LOCATION_COLUMNS),
+																   ", ".join("?" * len(LOCATION_COLUMNS)))
+	s_q = "INSERT INTO trial_summary ({0}) VALUES ({1})".format(", ".join(SUMMARY_COLUMNS),
+																 ", ".join("?" * len(SUMMARY_COLUMNS)))
+	for trial, locations in rows:
+		c.execute(t_q, [trial[k] for k in TRIAL_COLUMNS])
+		trial_id = c.lastrowid
+		c.executemany(l_q, [[trial_id if k == "trial_id" else l[k] for k in LOCATION_COLUMNS] for l in locations])
+		summary = pivot(locations)
+		summary.update({"trial_id": trial_id, "participant_id": trial["participant_id"],
+						"block_num": trial["block_num"], "trial_num": trial["trial_num"]})
+		c.execute(s_q, [summary[k] for k in SUMMARY_COLUMNS])
+		counts[0] += 1
+		counts[1] += len(locations)
+	c.execute("COMMIT")
+	return tuple(counts)
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Rebuild WaldoMkII trial tables from EDF/ASC files.")
+	parser.add_argument("paths", nargs="+")
+	parser.add_argument("--db", required=True, help="sqlite database to write into; created from the schema if new")
+	parser.add_argument("--processes", type=int, default=None)
+	args = parser.parse_args(argv)
+
+	new = not os.path.isfile(args.db)
+	connection = sqlite3.connect(args.db, isolation_level=None)
+	if new:
+		with open(SCHEMA_F) as f:
+			connection.executescript(f.read())
+	files = list(find_files(args.paths))
+	pool = Pool(args.processes) if len(files) > 1 and args.processes != 1 else None
+	results = pool.imap_unordered(parse_file, files) if pool else ((f, file_trials(f)) for f in files)
+	totals = [0, 0]
+	for path, rows in results:
+		n_trials, n_locations = write(connection, rows)
+		totals[0] += n_trials
+		totals[1] += n_locations
+		print("{0}: {1} trials".format(path, n_trials))
+	if pool:
+		pool.close()
+		pool.join()
+	connection.close()
+	print("{0} trials, {1} locations from {2} files".format(totals[0], totals[1], len(files)))
+
+
+if __name__ == "__main__":
+	main()
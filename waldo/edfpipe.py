@@ -0,0 +1,314 @@
+"""Gets each session's EDF off the tracker, converts it to ASC, and compresses it with a per-trial index, unattended.
+
+Usage:
+	python -m waldo.edfpipe [--submit tracker:p12.EDF | --submit file:/path/p12.EDF] [--tracker 100.1.1.1] [--report]
+
+Every EDF is a job file in ExpAssets/Data/edf/jobs. Each stage writes its output atomically, then records itself in
+the job, so an interrupted run picks up where it stopped the next time any pipeline runs. Stages:
+
+	transfer  file:<path> is copied in chunks; a job submitted by a session (WaldoMkII.submit_edf()) names that
+			  session's process, and the copy waits until it has exited, ie. until klibs has received the EDF
+			  into <path>. tracker:<name> (eg. an EDF klibs never received) is received over a pylink connection of
+			  its own, once nothing else holds the link (retried until then)
+	convert   edf2asc, samples included
+	pack      one streaming pass writing <name>.asc.gz, a gzip member per trial (from the trial_start to trial_end
+			  markup in WaldoMkII_messaging.csv, keyed by Params.trial_number), and <name>.idx.json holding each
+			  member's offset & length, tracker time span and sample count, ie. a trial is read by seeking to its
+			  member and decompressing only that
+	samples   <name>.samples, the session's gaze samples as indexed, memory-mapped columns (see waldo.samples)
+
+Throughput (MB/s per stage) is recorded in each job and printed by --report.
+"""
+from __future__ import print_function
+
+__author__ = "Jonathan Mulle"
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+import zlib
+
+from waldo.edfcodes import EventCodes
+from waldo.files import replace
+from waldo.samples import build as build_samples
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EDF_DIR = os.path.join(PROJECT_DIR, "ExpAssets", "Data", "edf")
+STAGES = ["transfer", "convert", "pack", "samples"]
+DEFAULT_TRACKER = "100.1.1.1"
+CHUNK = 2 ** 20
+
+
+def write_json(path, data):
+	tmp_f = "{0}.{1}.tmp".format(path, os.getpid())
+	with open(tmp_f, "w") as f:
+		json.dump(data, f, indent=1, sort_keys=True)
+	replace(tmp_f, path)
+
+
+def pid_alive(pid):
+	try:
+		os.kill(pid, 0)
+	except OSError:
+		return False
+	return True
+
+
+def submit(source, edf_dir=EDF_DIR, wait_pid=None):
+	"""Queues source ("tracker:<name>" or "file:<path>") and returns its job file; resubmitting is a no-op.
+
+	Given wait_pid, the job's transfer waits for that process to exit first.
+	"""
+	jobs_dir = os.path.join(edf_dir, "jobs")
+	if not os.path.isdir(jobs_dir):
+		os.makedirs(jobs_dir)
+	name = os.path.splitext(os.path.basename(source.split(":", 1)[1]))[0]
+	job_f = os.path.join(jobs_dir, name + ".json")
+	if not os.path.isfile(job_f):
+		write_json(job_f, {"name": name, "source": source, "wait_pid": wait_pid, "done": [], "stats": {},
+						   "error": None, "submitted": time.time()})
+	return job_f
+
+
+def launch(source, edf_dir=EDF_DIR, tracker=DEFAULT_TRACKER, wait_pid=None):
+	"""Submits source, then runs the pipeline in a detached process, ie. one that outlives the experiment."""
+	submit(source, edf_dir, wait_pid)
+	args = [sys.executable, "-m", "waldo.edfpipe", "--dir", edf_dir, "--tracker", tracker]
+	log = open(os.path.join(edf_dir, "pipeline.log"), "a")
+	kwargs = {"cwd": PROJECT_DIR, "stdout": log, "stderr": log}
+	if hasattr(os, "setsid"):
+		kwargs["preexec_fn"] = os.setsid
+	try:
+		return subprocess.Popen(args, **kwargs)
+	finally:
+		log.close()  # the child has its own copy
+
+
+def pack_asc(asc_f, gz_f, codes=None):
+	"""Compresses asc_f into one gzip member per trial (plus one per stretch between trials); returns the index."""
+	codes = codes if codes else EventCodes()
+	index = []
+	current = None
+	out = open(gz_f, "wb")
+
+	def member(trial_num):
+		return {"trial_num": trial_num, "offset": out.tell(), "length": 0, "start": None, "end": None, "samples": 0,
+				"z": zlib.compressobj(6, zlib.DEFLATED, 31)}  # wbits 31: a complete gzip member
+
+	def close(m):
+		out.write(m.pop("z").flush())
+		m["length"] = out.tell() - m["offset"]
+		index.append(m)
+
+	try:
+		current = member(-1)
+		with open(asc_f, "rb") as f:
+			for line in f:
+				parsed = None
+				if line.startswith(b"MSG"):
+					parts = line.decode("ascii", "replace").split(None, 2)
+					parsed = codes.parse(parts[2].rstrip()) if len(parts) == 3 else None
+					if parsed and parsed[0] == "trial_start":
+						close(current)
+						current = member(int(parsed[1]["trial"]))
+				out.write(current["z"].compress(line))
+				if line[:1].isdigit():
+					t = float(line.split(None, 1)[0])  # half-ms at 2 kHz, eg. "1234567.5"
+					current["samples"] += 1
+					current["start"] = t if current["start"] is None else current["start"]
+					current["end"] = t
+				if parsed and parsed[0] == "trial_end":
+					close(current)
+					current = member(-1)
+		close(current)
+	finally:
+		out.close()
+	return [m for m in index if m["length"] > 20 or m["trial_num"] >= 0]  # 20 bytes: an empty gzip member
+
+
+def read_trial(gz_f, entry):
+	"""The ASC lines of one indexed trial, decompressing only its member."""
+	with open(gz_f, "rb") as f:
+		f.seek(entry["offset"])
+		return zlib.decompress(f.read(entry["length"]), 31).splitlines()
+
+
+class Pipeline(object):
+
+	def __init__(self, edf_dir=EDF_DIR, tracker=DEFAULT_TRACKER, retry_interval=5.0, transfer_timeout=3600):
+		self.edf_dir = edf_dir
+		self.jobs_dir = os.path.join(edf_dir, "jobs")
+		self.tracker = tracker
+		self.retry_interval = retry_interval
+		self.transfer_timeout = transfer_timeout
+		self.codes = EventCodes()
+
+	def jobs(self):
+		if not os.path.isdir(self.jobs_dir):
+			return []
+		return sorted(os.path.join(self.jobs_dir, f) for f in os.listdir(self.jobs_dir) if f.endswith(".json"))
+
+	def run(self):
+		for job_f in self.jobs():
+			if self.__lock(job_f):
+				try:
+					self.run_job(job_f)
+				finally:
+					os.remove(job_f + ".lock")
+
+	def run_job(self, job_f):
+		with open(job_f) as f:
+			job = json.load(f)
+		for stage in STAGES:
+			if stage in job["done"]:
+				continue
+			t = time.time()
+			try:
+				size_in, size_out = getattr(self, stage)(job)
+			except Exception as e:
+				job["error"] = "{0}: {1!r}".format(stage, e)
+				write_json(job_f, job)
+				return job
+			elapsed = max(time.time() - t, 1e-6)
+			job["stats"][stage] = {"seconds": elapsed, "bytes_in": size_in, "bytes_out": size_out,
+								   "mb_per_s": size_in / elapsed / 2 ** 20}
+			job["done"].append(stage)
+			job["error"] = None
+			write_json(job_f, job)
+		return job
+
+	def path(self, job, ext):
+		return os.path.join(self.edf_dir, job["name"] + ext)
+
+	def transfer(self, job):
+		kind, source = job["source"].split(":", 1)
+		dest = self.path(job, ".edf")
+		tmp_f = dest + ".part"
+		if job.get("wait_pid"):
+			self.__wait_exit(job["wait_pid"])
+		if kind == "file":
+			if not os.path.isfile(source):
+				raise IOError("{0} not found; the session ended without receiving its EDF.".format(source))
+			with open(source, "rb") as src:
+				with open(tmp_f, "wb") as out:
+					shutil.copyfileobj(src, out, CHUNK)
+		else:
+			self.__receive(source, tmp_f)
+		replace(tmp_f, dest)
+		size = os.path.getsize(dest)
+		return size, size
+
+	def convert(self, job):
+		edf_f = self.path(job, ".edf")
+		with open(os.devnull, "w") as devnull:
+			subprocess.check_call(["edf2asc", "-y", "-p", self.edf_dir, edf_f], stdout=devnull)
+		return os.path.getsize(edf_f), os.path.getsize(self.path(job, ".asc"))
+
+	def pack(self, job):
+		asc_f = self.path(job, ".asc")
+		gz_f = self.path(job, ".asc.gz")
+		idx_f = self.path(job, ".idx.json")
+		if not os.path.isfile(asc_f) and os.path.isfile(gz_f) and os.path.isfile(idx_f):
+			# packed, then interrupted before the stage was recorded; the ASC is already gone
+			size = os.path.getsize(gz_f)
+			return size, size
+		index = pack_asc(asc_f, gz_f + ".tmp", self.codes)
+		write_json(idx_f, {"file": os.path.basename(gz_f), "trials": index})
+		replace(gz_f + ".tmp", gz_f)
+		size_in = os.path.getsize(asc_f)
+		os.remove(asc_f)  # the EDF stays; the ASC is recoverable from either
+		return size_in, os.path.getsize(gz_f)
+
+	def samples(self, job):
+		gz_f = self.path(job, ".asc.gz")
+		out_dir = self.path(job, ".samples")
+		build_samples(gz_f, out_dir, self.codes)
+		size_out = sum(os.path.getsize(os.path.join(out_dir, f)) for f in os.listdir(out_dir))
+		return os.path.getsize(gz_f), size_out
+
+	def report(self):
+		totals = dict((s, [0, 0.0]) for s in STAGES)
+		for job_f in self.jobs():
+			with open(job_f) as f:
+				job = json.load(f)
+			state = "error in " + job["error"] if job["error"] else (", ".join(job["done"]) or "queued")
+			print("{0:<16} {1}".format(job["name"], state))
+			for stage, s in job["stats"].items():
+				totals[stage][0] += s["bytes_in"]
+				totals[stage][1] += s["seconds"]
+		for stage in STAGES:
+			b, secs = totals[stage]
+			if secs:
+				print("{0:<10} {1:>10.1f} MB in {2:>8.1f}s  {3:>8.1f} MB/s".format(stage, b / 2.0 ** 20, secs,
+																				  b / secs / 2 ** 20))
+
+	def __wait_exit(self, pid):
+		# the submitting session still has to shut its tracker connection down & receive its EDF
+		deadline = time.time() + self.transfer_timeout
+		while pid_alive(pid):
+			if time.time() > deadline:
+				raise IOError("Process {0} is still running.".format(pid))
+			time.sleep(self.retry_interval)
+
+	def __receive(self, name, dest):
+		# the experiment holds the link until it exits, so keep trying until it's free
+		import pylink
+		deadline = time.time() + self.transfer_timeout
+		while True:
+			try:
+				tracker = pylink.EyeLink(self.tracker)
+				break
+			except RuntimeError:
+				if time.time() > deadline:
+					raise
+				time.sleep(self.retry_interval)
+		try:
+			if tracker.receiveDataFile(name, dest) <= 0:
+				raise IOError("Tracker couldn't send {0}.".format(name))
+		finally:
+			tracker.close()
+
+	def __lock(self, job_f):
+		# a job is run by one pipeline at a time; a lock left by a process that died is taken over
+		lock_f = job_f + ".lock"
+		try:
+			fd = os.open(lock_f, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+		except OSError:
+			try:
+				with open(lock_f) as f:
+					pid = int(f.read() or 0)
+			except (IOError, ValueError):
+				return False
+			if pid and pid_alive(pid):
+				return False
+			os.remove(lock_f)
+			return self.__lock(job_f)
+		os.write(fd, str(os.getpid()).encode("ascii"))
+		os.close(fd)
+		return True
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Transfer, convert and index WaldoMkII's EDF files.")
+	parser.add_argument("--submit", action="append", default=[], help="tracker:<name> or file:<path>; repeatable")
+	parser.add_argument("--dir", default=EDF_DIR)
+	parser.add_argument("--tracker", default=DEFAULT_TRACKER, help="tracker host address, for tracker: sources")
+	parser.add_argument("--report", action="store_true", help="print job states & throughput, and exit")
+	args = parser.parse_args(argv)
+
+	pipeline = Pipeline(args.dir, args.tracker)
+	if args.report:
+		pipeline.report()
+		return
+	for source in args.submit:
+		submit(source, args.dir)
+	pipeline.run()
+	pipeline.report()
+
+
+if __name__ == "__main__":
+	main()
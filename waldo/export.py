@@ -0,0 +1,209 @@
+"""Exports the project's tables to typed columnar files, for analysis across many sessions.
+
+Usage:
+	python -m waldo.export <database> <out dir> [--format npy|parquet] [--chunk 4096]
+
+Rows are streamed out of sqlite with fetchmany(), so memory is bounded by --chunk. Every table in
+WaldoMkII_schema.sql is exported (trials, trial_locations, events, ...), plus trial_wide: each trials row joined with
+its locations pivoted into the change instructions' reverse-ordered srt/timed_out/x/y columns (see waldo.summary).
+
+npy (the default) writes <out dir>/<table>/<column>.npy; load a column without copying it with
+np.load(path, mmap_mode="r"), or a whole table with load_table(). parquet needs pyarrow and writes <table>.parquet.
+"""
+from __future__ import print_function
+
+__author__ = "Jonathan Mulle"
+
+import argparse
+import itertools
+import os
+import sqlite3
+
+import numpy as np
+
+from waldo.summary import WIDE_TARGETS, wide_dtypes, pivot, is_true
+
+BOOL_COLUMNS = ["timed_out", "n_back", "penultimate", "final"]  # stored as text, exported as int8 (0/1)
+MISSING = {"i": -1, "f": np.nan, "U": ""}
+
+
+def column_dtype(connection, table, name, declared):
+	declared = declared.lower()
+	if "int" in declared:
+		return np.dtype("<i8")
+	if declared in ("float", "real", "numeric", "double"):
+		return np.dtype("<f8")
+	if name in BOOL_COLUMNS:
+		return np.dtype("i1")
+	# fixed-width unicode so the column can be memory mapped; one cheap aggregate sizes it
+	width = connection.execute("SELECT max(length({0})) FROM {1}".format(name, table)).fetchone()[0]
+	return np.dtype("<U{0}".format(max(1, width or 1)))
+
+
+def table_dtypes(connection, table):
+	info = connection.execute("PRAGMA table_info({0})".format(table)).fetchall()
+	return [(c[1], column_dtype(connection, table, c[1], c[2])) for c in info]
+
+
+def to_column(values, dtype):
+	missing = MISSING[dtype.kind]
+	if dtype.kind == "i" and dtype.itemsize == 1:
+		return np.array([-1 if v is None else is_true(v) for v in values], dtype=dtype)
+	if dtype.kind == "U":
+		values = [missing if v is None else str(v) for v in values]
+	return np.array([missing if v is None else v for v in values], dtype=dtype)
+
+
+class NpySink(object):
+	# one preallocated .npy per column, filled chunk by chunk; np.load(mmap_mode="r") then maps it zero-copy
+
+	def __init__(self, out_dir, table, dtypes, rows):
+		self.dir = os.path.join(out_dir, table)
+		if not os.path.isdir(self.dir):
+			os.makedirs(self.dir)
+		self.columns = [(name, np.lib.format.open_memmap(os.path.join(self.dir, name + ".npy"), "w+", dtype, (rows,)))
+						for name, dtype in dtypes]
+		self.offset = 0
+
+	def write(self, columns):
+		n = len(columns[0])
+		for (name, out), values in zip(self.columns, columns):
+			out[self.offset:self.offset + n] = values
+		self.offset += n
+
+	def close(self):
+		for name, out in self.columns:
+			out.flush()
+		del self.columns
+
+
+class ParquetSink(object):
+
+	def __init__(self, out_dir, table, dtypes, rows):
+		import pyarrow as pa
+		import pyarrow.parquet as pq
+		self.pa = pa
+		self.names = [name for name, dtype in dtypes]
+		self.schema = pa.schema([(name, pa.from_numpy_dtype(dtype)) for name, dtype in dtypes])
+		self.writer = pq.ParquetWriter(os.path.join(out_dir, table + ".parquet"), self.schema)
+
+	def write(self, columns):
+		arrays = [self.pa.array(c) for c in columns]
+		self.writer.write_table(self.pa.Table.from_arrays(arrays, schema=self.schema))
+
+	def close(self):
+		self.writer.close()
+
+
+SINKS = {"npy": NpySink, "parquet": ParquetSink}
+
+
+class Exporter(object):
+
+	def __init__(self, db_path, out_dir, fmt="npy", chunk_size=4096, wide_targets=WIDE_TARGETS):
+		self.connection = sqlite3.connect(db_path)
+		self.out_dir = out_dir
+		self.sink = SINKS[fmt]
+		self.chunk_size = chunk_size
+		self.wide_targets = wide_targets
+		self.rows = {}
+		if not os.path.isdir(out_dir):
+			os.makedirs(out_dir)
+
+	def tables(self):
+		q = "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+		return [r[0] for r in self.connection.execute(q)]
+
+	def count(self, table):
+		return self.connection.execute("SELECT count(*) FROM {0}".format(table)).fetchone()[0]
+
+	def export_table(self, table):
+		dtypes = table_dtypes(self.connection, table)
+		sink = self.sink(self.out_dir, table, dtypes, self.count(table))
+		# rowid, not id: trial_summary is keyed by trial_id (an alias of its rowid) and has no id column
+		cursor = self.connection.execute("SELECT * FROM {0} ORDER BY rowid".format(table))
+		n = 0
+		while True:
+			rows = cursor.fetchmany(self.chunk_size)
+			if not rows:
+				break
+			sink.write([to_column(values, dtype) for values, (name, dtype) in zip(zip(*rows), dtypes)])
+			n += len(rows)
+		sink.close()
+		self.rows[table] = n
+		return n
+
+	def export_wide(self, table="trial_wide"):
+		# merge-join: trials by id against trial_locations grouped by trial_id, both streamed in order
+		trial_dtypes = table_dtypes(self.connection, "trials")
+		wide = wide_dtypes(self.wide_targets)
+		dtypes = trial_dtypes + [(name, np.dtype(dtype)) for name, dtype in wide]
+		sink = self.sink(self.out_dir, table, dtypes, self.count("trials"))
+		l_cols = ["trial_id", "location_num", "x", "y", "rt", "timed_out"]
+		l_cursor = self.connection.execute("SELECT {0} FROM trial_locations ORDER BY trial_id, location_num"
+										   .format(", ".join(l_cols)))
+		locations = itertools.groupby((dict(zip(l_cols, r)) for r in self.__stream(l_cursor)),
+									  lambda l: l["trial_id"])
+		pending = next(locations, None)
+		t_cursor = self.connection.execute("SELECT * FROM trials ORDER BY id")
+		n = 0
+		while True:
+			rows = t_cursor.fetchmany(self.chunk_size)
+			if not rows:
+				break
+			wide_rows = []
+			for r in rows:
+				while pending and pending[0] < r[0]:  # locations whose trial row is gone
+					pending = next(locations, None)
+				if pending and pending[0] == r[0]:
+					wide_rows.append(pivot(list(pending[1]), self.wide_targets))
+					pending = next(locations, None)
+				else:
+					wide_rows.append(pivot([], self.wide_targets))
+			columns = [to_column(values, dtype) for values, (name, dtype) in zip(zip(*rows), trial_dtypes)]
+			columns += [np.array([w[name] for w in wide_rows], dtype=dtype) for name, dtype in wide]
+			sink.write(columns)
+			n += len(rows)
+		sink.close()
+		self.rows[table] = n
+		return n
+
+	def run(self):
+		for table in self.tables():
+			self.export_table(table)
+		if "trials" in self.rows and "trial_locations" in self.rows:
+			self.export_wide()
+		self.connection.close()
+		return self.rows
+
+	def __stream(self, cursor):
+		while True:
+			rows = cursor.fetchmany(self.chunk_size)
+			if not rows:
+				return
+			for r in rows:
+				yield r
+
+
+def load_table(out_dir, table):
+	"""Returns {column: read-only memmapped ndarray} for a table exported in npy format."""
+	d = os.path.join(out_dir, table)
+	return dict((f[:-4], np.load(os.path.join(d, f), mmap_mode="r")) for f in sorted(os.listdir(d))
+				if f.endswith(".npy"))
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Export WaldoMkII's database to typed columnar files.")
+	parser.add_argument("database")
+	parser.add_argument("out_dir")
+	parser.add_argument("--format", choices=sorted(SINKS), default="npy")
+	parser.add_argument("--chunk", type=int, default=4096, help="rows fetched from sqlite at a time")
+	args = parser.parse_args(argv)
+
+	rows = Exporter(args.database, args.out_dir, args.format, args.chunk).run()
+	for table in sorted(rows):
+		print("{0:<20} {1} rows".format(table, rows[table]))
+
+
+if __name__ == "__main__":
+	main()
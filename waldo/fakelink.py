@@ -0,0 +1,162 @@
+__author__ = "Jonathan Mulle"
+
+import heapq
+import random
+
+from waldo.timing import clock
+from waldo.gaze import SAMPLE_TYPE, STARTSACC, ENDSACC, ENDFIX
+
+
+class Observer(object):
+	"""Synthetic participant: saccades to each target it's shown after a latency, lands near it, then fixates.
+
+	Durations are (mean, sd) in ms, drawn from normal distributions floored at 1 ms; landing_sd is in px.
+	"""
+
+	def __init__(self, latency=(180, 30), saccade=(40, 5), fixation=(220, 40), landing_sd=8.0, miss_rate=0.0,
+				 seed=None):
+		self.latency = latency
+		self.saccade = saccade
+		self.fixation = fixation
+		self.landing_sd = landing_sd
+		self.miss_rate = miss_rate
+		self.rng = random.Random(seed)
+
+	def draw(self, dist):
+		return max(1.0, self.rng.gauss(*dist))
+
+	def plan(self, target, onset):
+		"""Returns (saccade start, saccade end, fixation end, landing point), or None if the target is ignored."""
+		if self.rng.random() < self.miss_rate:
+			return None
+		start = onset + self.draw(self.latency)
+		end = start + self.draw(self.saccade)
+		landing = (target[0] + self.rng.gauss(0, self.landing_sd), target[1] + self.rng.gauss(0, self.landing_sd))
+		return start, end, end + self.draw(self.fixation), landing
+
+
+class FakeItem(object):
+	# quacks like both pylink's sample and its fixation/saccade events, as far as waldo.gaze uses them
+
+	def __init__(self, el_time, gaze, start_time=None, start_gaze=None):
+		self.el_time = el_time
+		self.gaze = gaze
+		self.start_time = el_time if start_time is None else start_time
+		self.start_gaze = gaze if start_gaze is None else start_gaze
+
+	def getTime(self):
+		return self.el_time
+
+	def isRightSample(self):
+		return True
+
+	def getRightEye(self):
+		return self
+
+	def getGaze(self):
+		return self.gaze
+
+	def getStartTime(self):
+		return self.start_time
+
+	def getEndTime(self):
+		return self.el_time
+
+	def getStartGaze(self):
+		return self.start_gaze
+
+	def getEndGaze(self):
+		return self.gaze
+
+	def getAverageGaze(self):
+		return self.gaze
+
+
+class FakeEyeLink(object):
+	"""Stands in for klibs' EyeLink on the link-queue side: samples at rate Hz plus saccade & fixation events.
+
+	Gaze is driven by an Observer reacting to present(). Time is real (waldo.timing.clock) unless a clock is given,
+	which lets the simulator run faster than real time. due records when each queued item became available, so
+	detection latency can be measured against it.
+	"""
+
+	def __init__(self, observer=None, rate=1000, start_pos=(0, 0), clock_f=None):
+		self.observer = observer if observer else Observer()
+		self.interval = 1000.0 / rate
+		self.clock = clock_f if clock_f else clock
+		self.t0 = self.clock()
+		self.gaze = tuple(start_pos)
+		self.path = []  # [t_start, t_end, from, to]
+		self.events = []  # heap of (el_time, seq, data_type, item)
+		self.seq = 0
+		self.next_sample = 0.0
+		self.current = None
+		self.due = {}  # (data_type, el_time): clock() at which the item was due
+		self.messages = []
+		self.recording = False
+
+	def now(self):
+		return (self.clock() - self.t0) * 1000.0
+
+	trackerTime = now
+
+	def start(self, trial_number=None):
+		self.recording = True
+		self.next_sample = self.now()
+
+	def stop(self):
+		self.recording = False
+
+	def sendMessage(self, message):
+		self.messages.append((self.now(), message))
+
+	def present(self, target, onset=None):
+		onset = self.now() if onset is None else onset
+		plan = self.observer.plan(target, onset)
+		if not plan:
+			return None
+		start, end, fix_end, landing = plan
+		self.path.append([start, end, None, landing])  # from-position resolved when the saccade starts
+		self.__queue(start, STARTSACC, None)
+		self.__queue(end, ENDSACC, landing)
+		self.__queue(fix_end, ENDFIX, landing)
+		return plan
+
+	def gaze_at(self, t):
+		for seg in self.path:
+			if seg[0] <= t:
+				if seg[2] is None:
+					seg[2] = self.gaze
+				if t < seg[1]:
+					f = (t - seg[0]) / (seg[1] - seg[0])
+					return (seg[2][0] + f * (seg[3][0] - seg[2][0]), seg[2][1] + f * (seg[3][1] - seg[2][1]))
+				self.gaze = seg[3]
+		self.path = [seg for seg in self.path if seg[1] > t]
+		return self.gaze
+
+	def getNextData(self):
+		if not self.recording:
+			return 0
+		now = self.now()
+		if self.events and self.events[0][0] <= min(now, self.next_sample):
+			el_time, seq, data_type, item = heapq.heappop(self.events)
+			if data_type == STARTSACC:
+				item = FakeItem(el_time, self.gaze_at(el_time))
+			else:
+				item = FakeItem(el_time, item)
+			self.current = item
+			self.due[(data_type, el_time)] = self.t0 + el_time / 1000.0
+			return data_type
+		if self.next_sample <= now:
+			t = self.next_sample
+			self.next_sample += self.interval
+			self.current = FakeItem(t, self.gaze_at(t))
+			return SAMPLE_TYPE
+		return 0
+
+	def getFloatData(self):
+		return self.current
+
+	def __queue(self, el_time, data_type, item):
+		self.seq += 1
+		heapq.heappush(self.events, (el_time, self.seq, data_type, item))
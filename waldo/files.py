@@ -0,0 +1,19 @@
+__author__ = "Jonathan Mulle"
+
+import os
+import sys
+
+
+def replace(src, dst):
+	"""Renames src to dst, replacing dst if it exists, as the last step of writing a file atomically.
+
+	os.replace() does this on python 3; os.rename() only does on POSIX, so on windows (under python 2) dst is
+	removed first, ie. there's a moment without it, which readers there have to tolerate.
+	"""
+	try:
+		return os.replace(src, dst)
+	except AttributeError:  # python 2
+		pass
+	if sys.platform.startswith("win") and os.path.exists(dst):
+		os.remove(dst)
+	os.rename(src, dst)
@@ -0,0 +1,232 @@
+__author__ = "Jonathan Mulle"
+
+import math
+import threading
+import time
+from collections import namedtuple
+
+from waldo.timing import clock
+
+try:
+	from Queue import Queue, Empty
+except ImportError:
+	from queue import Queue, Empty
+
+try:
+	from pylink import SAMPLE_TYPE, STARTSACC, ENDSACC, ENDFIX
+except ImportError:  # headless tools & the fake tracker; values as defined by the EyeLink API
+	STARTSACC, ENDSACC, ENDFIX, SAMPLE_TYPE = 5, 6, 8, 200
+MISSING_DATA = -32768  # the tracker's value for an unavailable gaze coordinate
+
+ENTER = "enter"
+EXIT = "exit"
+FIXATE = "fixate"  # a fixation ended inside the boundary
+SACCADE_END = "saccade_end"  # a saccade landed inside the boundary
+SACCADE_START = "saccade_start"  # a saccade left from inside the boundary
+
+# el_time is tracker time (ms); detected_at is waldo.timing.clock() when the sample or event was tested
+GazeEvent = namedtuple("GazeEvent", ["kind", "boundary", "el_time", "detected_at", "gaze"])
+
+
+def valid_gaze(gaze):
+	return not (math.isnan(gaze[0]) or gaze[0] == MISSING_DATA)
+
+
+class CircleIndex(object):
+	"""Uniform grid over circular boundaries; a lookup tests only the circles overlapping the point's cell."""
+
+	def __init__(self, cell_size=64):
+		self.cell_size = cell_size
+		self.circles = {}  # name: (x, y, radius)
+		self.grid = {}
+
+	def add(self, name, center, radius):
+		self.circles[name] = (float(center[0]), float(center[1]), float(radius))
+		self.__rebuild()
+
+	def remove(self, name):
+		if self.circles.pop(name, None):
+			self.__rebuild()
+
+	def clear(self):
+		self.circles = {}
+		self.grid = {}
+
+	def hits(self, x, y):
+		cell = (int(x // self.cell_size), int(y // self.cell_size))
+		hits = []
+		for name in self.grid.get(cell, ()):
+			cx, cy, r = self.circles[name]
+			if (x - cx) ** 2 + (y - cy) ** 2 <= r * r:
+				hits.append(name)
+		return hits
+
+	def __rebuild(self):
+		grid = {}
+		s = self.cell_size
+		for name, (x, y, r) in self.circles.items():
+			for i in range(int((x - r) // s), int((x + r) // s) + 1):
+				for j in range(int((y - r) // s), int((y + r) // s) + 1):
+					grid.setdefault((i, j), []).append(name)
+		self.grid = grid
+
+
+class GazeMonitor(threading.Thread):
+	"""Consumes the tracker's link data on its own thread and queues boundary events for the trial loop.
+
+	While running, this thread is the only thread touching the link (pylink isn't thread-safe), so detection latency
+	is bounded by the sample rate rather than by how often the trial loop renders. The trial loop blocks in wait()
+	instead of polling, uses now() for tracker time, and hands EDF messages to send(), which this thread writes
+	between reads. pause() returns only once the thread has stopped using the link, so the caller may use it again.
+	"""
+
+	def __init__(self, tracker, idle_sleep=0.0005):
+		super(GazeMonitor, self).__init__()
+		self.daemon = True
+		self.tracker = tracker
+		self.idle_sleep = idle_sleep
+		self.index = CircleIndex()
+		self.inside = set()
+		self.queue = Queue()
+		self.lock = threading.Lock()
+		self.running = threading.Event()
+		self.idle = threading.Event()  # set while this thread is off the link, ie. paused
+		self.idle.set()
+		self.stopped = threading.Event()
+		self.outbox = Queue()  # EDF messages, sent on this thread
+		self.last_sample = (None, None)  # (el_time, clock() at receipt)
+		self.samples = 0
+		self.start()
+
+	def arm(self, name, center, radius):
+		with self.lock:
+			self.index.add(name, center, radius)
+
+	def disarm(self, name):
+		with self.lock:
+			self.index.remove(name)
+			self.inside.discard(name)
+
+	def resume(self, el_time=None):
+		# drop whatever was buffered before the trial's gaze-contingent phase began; el_time (the tracker's time, read
+		# by the caller while it still owns the link) lets now() answer before the first sample arrives
+		self.clear()
+		if el_time is not None:
+			self.last_sample = (el_time, clock())
+		self.idle.clear()
+		self.running.set()
+
+	def pause(self):
+		self.running.clear()
+		self.idle.wait()  # a getNextData() may be under way; once idle, queued messages have been sent too
+		with self.lock:
+			self.index.clear()
+			self.inside = set()
+		self.clear()
+
+	def stop(self):
+		self.stopped.set()
+		self.running.set()
+		if self.is_alive():
+			self.join(1.0)
+
+	def send(self, message):
+		self.outbox.put(message)
+
+	def clear(self):
+		while True:
+			try:
+				self.queue.get_nowait()
+			except Empty:
+				return
+
+	def wait(self, timeout):
+		try:
+			return self.queue.get(True, timeout) if timeout > 0 else self.queue.get_nowait()
+		except Empty:
+			return None
+
+	def drain(self, timeout):
+		# blocks for the first event only, then returns everything else already queued
+		events = []
+		event = self.wait(timeout)
+		while event:
+			events.append(event)
+			try:
+				event = self.queue.get_nowait()
+			except Empty:
+				event = None
+		return events
+
+	def within(self, name):
+		return name in self.inside
+
+	def now(self):
+		return self.el_time_at(clock())
+
+	def el_time_at(self, t):
+		# tracker time corresponding to clock() time t, extrapolated from the latest sample
+		el_time, received = self.last_sample
+		if el_time is None:
+			return None
+		return el_time + (t - received) * 1000.0
+
+	def el_elapsed(self, el_time, t):
+		# tracker ms from el_time to clock() time t; NaN (not an error) until the first sample or resume(el_time)
+		now = self.el_time_at(t)
+		return float("nan") if now is None else now - el_time
+
+	def run(self):
+		try:
+			while not self.stopped.is_set():
+				self.__send_messages()
+				if not self.running.is_set():
+					self.idle.set()
+					self.running.wait()
+					continue
+				data_type = self.tracker.getNextData()
+				if not data_type:
+					time.sleep(self.idle_sleep)
+					continue
+				item = self.tracker.getFloatData()
+				with self.lock:
+					if data_type == SAMPLE_TYPE:
+						self.__sample(item)
+					elif data_type in (ENDFIX, STARTSACC, ENDSACC):
+						self.__event(data_type, item)
+		finally:
+			self.idle.set()  # so a pause() after stop() doesn't wait on a thread that's gone
+
+	def __send_messages(self):
+		while True:
+			try:
+				self.tracker.sendMessage(self.outbox.get_nowait())
+			except Empty:
+				return
+
+	def __sample(self, s):
+		now = clock()
+		el_time = s.getTime()
+		self.last_sample = (el_time, now)
+		self.samples += 1
+		eye = s.getRightEye() if s.isRightSample() else s.getLeftEye()
+		gaze = eye.getGaze()
+		hits = set(self.index.hits(*gaze)) if valid_gaze(gaze) else set()
+		for name in hits - self.inside:
+			self.queue.put(GazeEvent(ENTER, name, el_time, now, gaze))
+		for name in self.inside - hits:
+			self.queue.put(GazeEvent(EXIT, name, el_time, now, gaze))
+		self.inside = hits
+
+	def __event(self, data_type, e):
+		now = clock()
+		if data_type == ENDFIX:
+			kind, el_time, gaze = FIXATE, e.getEndTime(), e.getAverageGaze()
+		elif data_type == ENDSACC:
+			kind, el_time, gaze = SACCADE_END, e.getEndTime(), e.getEndGaze()
+		else:
+			kind, el_time, gaze = SACCADE_START, e.getStartTime(), e.getStartGaze()
+		if not valid_gaze(gaze):
+			return
+		for name in self.index.hits(*gaze):
+			self.queue.put(GazeEvent(kind, name, el_time, now, gaze))
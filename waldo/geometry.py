@@ -0,0 +1,124 @@
+__author__ = "Jonathan Mulle"
+
+import numpy as np
+
+
+def rotation(a):
+	c, s = np.cos(a), np.sin(a)
+	return np.array([[c, -s], [s, c]])
+
+
+def rect_halfplanes(x0, y0, x1, y1):
+	# A p <= b for the rectangle [x0, x1] x [y0, y1]
+	return np.array([[-1.0, 0], [1, 0], [0, -1], [0, 1]]), np.array([-x0, x1, -y0, y1], dtype=np.float64)
+
+
+def clip(polygon, a, b):
+	"""Sutherland-Hodgman: the part of a convex polygon ([[x, y], ...]) where a . p <= b."""
+	out = []
+	for i in range(len(polygon)):
+		p, q = polygon[i], polygon[(i + 1) % len(polygon)]
+		dp, dq = np.dot(a, p) - b, np.dot(a, q) - b
+		if dp <= 0:
+			out.append(p)
+		if dp * dq < 0:
+			out.append(p + (q - p) * (dp / (dp - dq)))
+	return out
+
+
+class PenultimateRegion(object):
+	"""Everywhere the penultimate disc can go, given the disc before it and the n-back disc.
+
+	The final disc is the penultimate plus the penultimate->n-back vector rotated by the trial's angle, ie.
+	F = (I - R)P + RN: linear in P. So "F is on-screen for every final angle" is four half-planes per angle, and with
+	the screen's own four they bound a convex polygon. The step from the previous disc confines P to an annulus
+	around it, and min_separation excludes a disc around the n-back target. Along any ray from the previous disc
+	each constraint is an interval in closed form, so every integer (angle, amplitude) step is counted exactly and
+	sample() draws one uniformly, ie. it never rejects. slack (px) shrinks the constraints so positions truncated to
+	ints, as klibs does, stay feasible.
+	"""
+
+	def __init__(self, bounds, previous, n_back, final_angles, min_amplitude, max_amplitude, min_separation, slack=5.0):
+		self.previous = np.asarray(previous, dtype=np.float64)
+		self.n_back = np.asarray(n_back, dtype=np.float64)
+		self.bounds = bounds  # (x0, y0, x1, y1), ie. the screen less its margin
+		self.min_amplitude = int(min_amplitude)
+		self.max_amplitude = int(max_amplitude)  # exclusive, as the other steps' randint() draws are
+		self.min_separation = min_separation + slack
+		rect_a, rect_b = rect_halfplanes(*bounds)
+		a, b = [rect_a], [rect_b - slack]
+		for angle in sorted(set(np.asarray(final_angles, dtype=np.float64) % (2 * np.pi))):
+			if np.isclose(angle, 0):
+				continue  # F is the n-back disc itself, which is already on-screen
+			r = rotation(angle)
+			m = np.eye(2) - r
+			a.append(rect_a.dot(m))
+			b.append(rect_b - slack - rect_a.dot(r.dot(self.n_back)))
+		self.a = np.concatenate(a)
+		self.b = np.concatenate(b)
+		self.degrees = np.arange(360)
+		self.directions = np.column_stack([np.cos(np.radians(self.degrees)), np.sin(np.radians(self.degrees))])
+		self.__counts = None
+
+	def polygon(self):
+		"""Vertices of the convex polygon (screen & final-angle constraints only), for plotting & diagnostics."""
+		x0, y0, x1, y1 = self.bounds
+		poly = [np.array(p, dtype=np.float64) for p in [(x0, y0), (x1, y0), (x1, y1), (x0, y1)]]
+		for a, b in zip(self.a, self.b):
+			poly = clip(poly, a, b)
+			if not poly:
+				break
+		return np.array(poly)
+
+	def intervals(self):
+		"""Per direction, the [enter, exit] distances along the ray from the previous disc inside the polygon."""
+		ad = self.directions.dot(self.a.T)  # (360, k)
+		room = self.b - self.a.dot(self.previous)  # (k,) >= 0 where the previous disc satisfies the constraint
+		with np.errstate(divide="ignore", invalid="ignore"):
+			t = room / ad
+		lo = np.where(ad < 0, t, -np.inf).max(axis=1)
+		hi = np.where(ad > 0, t, np.inf).min(axis=1)
+		parallel_out = ((ad == 0) & (room < 0)).any(axis=1)
+		hi[parallel_out] = -np.inf
+		return lo, hi
+
+	def exclusion(self):
+		"""Per direction, the (enter, exit) distances inside the n-back separation disc; NaN where the ray misses it."""
+		w = self.n_back - self.previous
+		dw = self.directions.dot(w)
+		disc = dw ** 2 - w.dot(w) + self.min_separation ** 2
+		root = np.sqrt(np.where(disc > 0, disc, np.nan))
+		return dw - root, dw + root
+
+	def counts(self):
+		"""Per direction: [first amplitude, last amplitude, first excluded, last excluded, feasible count]."""
+		if self.__counts is None:
+			lo, hi = self.intervals()
+			lo = np.maximum(np.ceil(lo), self.min_amplitude)
+			hi = np.minimum(np.floor(hi), self.max_amplitude - 1)
+			e_lo, e_hi = self.exclusion()
+			# integers strictly inside the separation disc are excluded; on its edge is far enough
+			x_lo = np.where(np.isnan(e_lo), 1, np.floor(e_lo) + 1)
+			x_hi = np.where(np.isnan(e_hi), 0, np.ceil(e_hi) - 1)
+			span = np.maximum(hi - lo + 1, 0)
+			overlap = np.maximum(np.minimum(hi, x_hi) - np.maximum(lo, x_lo) + 1, 0)
+			self.__counts = np.column_stack([lo, hi, x_lo, x_hi, span - overlap])
+		return self.__counts
+
+	@property
+	def empty(self):
+		return not self.counts()[:, 4].any()
+
+	def sample(self, rng):
+		"""Returns a uniformly drawn feasible (angle in degrees, amplitude) step from the previous disc, else None."""
+		counts = self.counts()
+		total = counts[:, 4].sum()
+		if not total:
+			return None
+		k = rng.randint(int(total))
+		d = int(np.searchsorted(np.cumsum(counts[:, 4]), k, side="right"))
+		k -= int(counts[:d, 4].sum())
+		lo, hi, x_lo, x_hi, n = counts[d]
+		below = max(0, min(hi, x_lo - 1) - lo + 1)  # feasible amplitudes short of the separation disc
+		amplitude = lo + k if k < below else max(lo, x_hi + 1) + (k - below)
+		return int(self.degrees[d]), int(amplitude)
@@ -0,0 +1,74 @@
+__author__ = "Jonathan Mulle"
+
+import numpy as np
+
+# record kinds
+FRAME = 1  # a = blit-to-flip duration (ms), b = ms since the previous flip
+MISSED_VSYNC = 2  # as FRAME; written in addition when a flip took longer than 1.5 refresh periods
+DETECTION = 3  # a = tracker ms from event to boundary_check(), b = tracker ms from event to the gaze thread;
+# NaN if the gaze thread had no tracker time yet
+ONSET = 4  # a = ms from a disc being due to the flip that showed it
+ONSET_DELAY = 5  # a = ms the inter-disc interval overran by
+KINDS = {FRAME: "frame", MISSED_VSYNC: "missed_vsync", DETECTION: "detection", ONSET: "onset",
+		 ONSET_DELAY: "onset_delay"}
+
+# t is waldo.timing.clock() (s), el_time is tracker time (ms), -1 where not applicable
+RECORD = np.dtype([("trial_id", "<i4"), ("trial_num", "<i4"), ("kind", "u1"), ("disc", "i1"), ("t", "<f8"),
+				   ("el_time", "<f8"), ("a", "<f4"), ("b", "<f4")])
+
+
+class TimingRecorder(object):
+	"""Preallocated ring buffer of fixed-size timing records, appended to a raw binary file once per trial.
+
+	Recording is a single structured-array assignment, so it's cheap enough for the trial loop; if a trial
+	writes more than capacity records the oldest are overwritten and counted in dropped. Read a dump back with
+	TimingRecorder.load(path).
+	"""
+
+	def __init__(self, capacity=16384, refresh_rate=60):
+		self.buffer = np.zeros(capacity, dtype=RECORD)
+		self.capacity = capacity
+		self.frame_period = 1000.0 / refresh_rate
+		self.head = 0
+		self.dropped = 0
+		self.last_flip = None
+
+	def record(self, kind, disc, t, el_time=-1, a=0, b=0):
+		self.buffer[self.head % self.capacity] = (0, 0, kind, disc, t, el_time, a, b)
+		self.head += 1
+
+	def frame(self, blit_start, flip_end, el_time):
+		duration = (flip_end - blit_start) * 1000.0
+		interval = (flip_end - self.last_flip) * 1000.0 if self.last_flip else -1
+		self.last_flip = flip_end
+		self.record(FRAME, -1, flip_end, el_time, duration, interval)
+		if duration > 1.5 * self.frame_period:
+			self.record(MISSED_VSYNC, -1, flip_end, el_time, duration, interval)
+
+	def records(self):
+		if self.head <= self.capacity:
+			return self.buffer[:self.head].copy()
+		i = self.head % self.capacity
+		return np.concatenate([self.buffer[i:], self.buffer[:i]])
+
+	def counts(self):
+		r = self.buffer[:min(self.head, self.capacity)]
+		return dict((name, int((r["kind"] == kind).sum())) for kind, name in KINDS.items())
+
+	def dump(self, path, trial_id, trial_num):
+		records = self.records()
+		records["trial_id"] = trial_id
+		records["trial_num"] = trial_num
+		with open(path, "ab") as f:
+			records.tofile(f)
+		self.dropped += max(0, self.head - self.capacity)
+		self.reset()
+		return len(records)
+
+	def reset(self):
+		self.head = 0
+		self.last_flip = None
+
+	@staticmethod
+	def load(path):
+		return np.fromfile(path, dtype=RECORD)
@@ -0,0 +1,145 @@
+__author__ = "Jonathan Mulle"
+
+from collections import OrderedDict
+
+
+class RetainedRenderer(object):
+	"""Remembers the last scene flipped to the display so unchanged frames can be skipped.
+
+	A scene is a hashable description of everything display_refresh() would draw: the background layer, whether the
+	drift correct target is up and which discs are visible. klibs renders through double-buffered OpenGL, where the
+	back buffer's contents are undefined after a flip, so a changed scene is always redrawn in full; the damaged
+	rectangles are still counted so the statistics show how much of each redraw was actually new.
+	"""
+
+	def __init__(self):
+		self.last_scene = None
+		self.requested = 0
+		self.drawn = 0
+		self.skipped = 0
+		self.full_redraws = 0  # background or drift correct target changed, ie. the whole screen was damaged
+		self.damaged_rects = 0  # discs appearing or disappearing on an otherwise unchanged frame
+
+	def invalidate(self):
+		# call whenever something else has drawn and flipped (messages, drift correct, fills), ie. the screen is unknown
+		self.last_scene = None
+
+	def reset(self):
+		self.__init__()
+
+	def needs_redraw(self, background, drift_correct, discs):
+		self.requested += 1
+		scene = (background, drift_correct, discs)
+		if scene == self.last_scene:
+			self.skipped += 1
+			return False
+		if self.last_scene is None or self.last_scene[:2] != scene[:2]:
+			self.full_redraws += 1
+		else:
+			self.damaged_rects += len(set(discs).symmetric_difference(self.last_scene[2]))
+		self.last_scene = scene
+		self.drawn += 1
+		return True
+
+	@property
+	def stats(self):
+		return {"frames_requested": self.requested,
+				"frames_drawn": self.drawn,
+				"frames_skipped": self.skipped,
+				"full_redraws": self.full_redraws,
+				"damaged_rects": self.damaged_rects}
+
+
+class SpriteCache(object):
+	"""Renders each unique drawing once, keyed by its draw parameters, ie. ("annulus", diameter, ring, stroke, fill)."""
+
+	def __init__(self):
+		self.sprites = {}
+		self.renders = 0
+
+	def get(self, key, render):
+		try:
+			return self.sprites[key]
+		except KeyError:
+			self.renders += 1
+			self.sprites[key] = render()
+			return self.sprites[key]
+
+
+class TextureCache(object):
+	"""Keeps rendered content resident as OpenGL textures so each sprite is uploaded once per session.
+
+	klibs' blit() generates, uploads and deletes a texture on every call; blit() here draws the same textured quad
+	from a persistent handle instead. Sprites stay resident; backgrounds are evicted least-recently-used beyond
+	max_backgrounds, since at full resolution each costs the GPU several megabytes.
+	"""
+
+	def __init__(self, max_backgrounds=3, gl=None):
+		if gl is None:
+			from OpenGL import GL as gl  # klibs' own dependency; imported late so waldo stays importable headless
+		self.gl = gl
+		self.max_backgrounds = max_backgrounds
+		self.textures = {}  # key: [texture id, width, height]
+		self.backgrounds = OrderedDict()  # LRU order of background keys
+		self.uploads = 0
+		self.evictions = 0
+
+	def texture(self, key, content, background=False):
+		try:
+			tex = self.textures[key]
+		except KeyError:
+			tex = self.textures[key] = self.__upload(content)
+		if background:
+			self.backgrounds.pop(key, None)
+			self.backgrounds[key] = True
+			while len(self.backgrounds) > self.max_backgrounds:
+				self.release(next(iter(self.backgrounds)))
+		return tex
+
+	def blit(self, key, content, registration=7, location=(0, 0), background=False):
+		gl = self.gl
+		t, width, height = self.texture(key, content, background)
+		# numpad registration, as in klibs: 7 is top-left, 5 is centre, 3 is bottom-right
+		x = location[0] - ((registration - 1) % 3) * width / 2.0
+		y = location[1] - (2 - (registration - 1) // 3) * height / 2.0
+		gl.glEnable(gl.GL_TEXTURE_2D)
+		gl.glBindTexture(gl.GL_TEXTURE_2D, t)
+		gl.glEnable(gl.GL_BLEND)
+		gl.glBlendFunc(gl.GL_SRC_ALPHA, gl.GL_ONE_MINUS_SRC_ALPHA)
+		gl.glBegin(gl.GL_QUADS)
+		gl.glTexCoord2f(0, 0)
+		gl.glVertex2f(x, y)
+		gl.glTexCoord2f(1, 0)
+		gl.glVertex2f(x + width, y)
+		gl.glTexCoord2f(1, 1)
+		gl.glVertex2f(x + width, y + height)
+		gl.glTexCoord2f(0, 1)
+		gl.glVertex2f(x, y + height)
+		gl.glEnd()
+		gl.glBindTexture(gl.GL_TEXTURE_2D, 0)
+		gl.glDisable(gl.GL_TEXTURE_2D)
+
+	def release(self, key):
+		self.backgrounds.pop(key, None)
+		try:
+			self.gl.glDeleteTextures([self.textures.pop(key)[0]])
+			self.evictions += 1
+		except KeyError:
+			pass
+
+	def clear(self):
+		for key in list(self.textures):
+			self.release(key)
+
+	def __upload(self, content):
+		gl = self.gl
+		height, width = content.shape[:2]
+		t = gl.glGenTextures(1)
+		gl.glBindTexture(gl.GL_TEXTURE_2D, t)
+		gl.glTexEnvi(gl.GL_TEXTURE_ENV, gl.GL_TEXTURE_ENV_MODE, gl.GL_MODULATE)
+		gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MIN_FILTER, gl.GL_NEAREST)
+		gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MAG_FILTER, gl.GL_NEAREST)
+		gl.glTexImage2D(gl.GL_TEXTURE_2D, 0, gl.GL_RGBA, width, height, 0, gl.GL_RGBA, gl.GL_UNSIGNED_BYTE, content)
+		gl.glBindTexture(gl.GL_TEXTURE_2D, 0)
+		self.uploads += 1
+		return [t, width, height]
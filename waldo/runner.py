@@ -0,0 +1,159 @@
+"""Launches and supervises several WaldoMkII sessions, on this host or a fleet of them, from one command.
+
+Usage:
+	python -m waldo.runner --db central.db [--screen 1920x1200] [--restarts 1]
+	python -m waldo.runner --projects ~/waldo_1,~/waldo_2,~/waldo_3 --db central.db
+	python -m waldo.runner --hosts lab1,lab2,lab3 --db central.db [--advertise this-host.local]
+
+A session's klibs database, EDF and timing files live in its project dir, and participant ids (which name the EDF and
+timing files) are numbered per database, so two sessions never share one: on this host, run one station from this
+project, or one from each copy given by --projects. Before anything launches, the background asset pack is built (or
+brought up to date) for --screen in each project, so no session decodes a jpg; copies whose
+ExpAssets/Resources/image is a symlink to one directory map the same pack read-only, ie. the OS keeps one copy of its
+pages in memory however many stations share a host. Remote hosts need the project at the same path (or
+--remote-project) and their own pack build; ssh must work without a password.
+
+Results stream into --db, a central sqlite store (see waldo.store) fed by every station's TrialDataWriter over an
+authenticated connection, while each station keeps its own klibs database as well.
+"""
+from __future__ import print_function
+
+__author__ = "Jonathan Mulle"
+
+import argparse
+import binascii
+import os
+import shlex
+import socket
+import subprocess
+import time
+
+try:
+	from shlex import quote
+except ImportError:
+	from pipes import quote
+
+from waldo.assetpack import AssetPack, PACK_NAME, STOCK_RESOLUTIONS, build_pack, resolution_key
+from waldo.store import CentralStore, PROJECT_DIR, ENV_STATION, ENV_ADDRESS, ENV_AUTHKEY
+
+IMAGE_DIR = os.path.join(PROJECT_DIR, "ExpAssets", "Resources", "image")
+DEFAULT_COMMAND = "klibs run 24 {project}"
+
+
+def image_dir(project):
+	return os.path.join(project, "ExpAssets", "Resources", "image")
+
+
+def prepare_assets(screen, image_dir=IMAGE_DIR):
+	"""Builds the pack unless there's a current one covering screen; returns the pack's path."""
+	pack_f = os.path.join(image_dir, PACK_NAME)
+	pack = AssetPack.open(pack_f)
+	if pack and pack.has(screen) and not pack.stale(image_dir):
+		pack.close()
+		return pack_f
+	resolutions = set(STOCK_RESOLUTIONS + [resolution_key(screen)] + (pack.resolutions if pack else []))
+	if pack:
+		pack.close()
+	print("Building {0} for {1}...".format(pack_f, ", ".join(sorted(resolutions))))
+	build_pack(image_dir, pack_f, sorted(resolutions))
+	return pack_f
+
+
+class Station(object):
+
+	def __init__(self, name, command, env, host=None, restarts=0):
+		self.name = name
+		self.command = command
+		self.env = env
+		self.host = host
+		self.restarts = restarts
+		self.process = None
+		self.launches = 0
+		self.returncode = None
+
+	def launch(self):
+		self.launches += 1
+		if self.host:
+			exports = " ".join("{0}={1}".format(k, quote(v)) for k, v in sorted(self.env.items()))
+			args = ["ssh", self.host, "{0} {1}".format(exports, self.command)]
+			self.process = subprocess.Popen(args)
+		else:
+			env = dict(os.environ)
+			env.update(self.env)
+			self.process = subprocess.Popen(shlex.split(self.command), env=env)
+
+	def poll(self):
+		"""True while the session is running (relaunching it if it crashed and restarts remain)."""
+		if self.process is None:
+			return False
+		code = self.process.poll()
+		if code is None:
+			return True
+		self.returncode = code
+		if code != 0 and self.launches <= self.restarts:
+			print("{0} exited with {1}; relaunching.".format(self.name, code))
+			self.launch()
+			return True
+		self.process = None
+		return False
+
+	def terminate(self):
+		if self.process and self.process.poll() is None:
+			self.process.terminate()
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Run and supervise several WaldoMkII stations.")
+	parser.add_argument("--projects", help="comma-separated project copies on this host, one session each; default: "
+										   "one session from this project")
+	parser.add_argument("--hosts", help="comma-separated ssh hosts, one session each, instead of --projects")
+	parser.add_argument("--db", required=True, help="central sqlite store; created from the schema if new")
+	parser.add_argument("--screen", default="1920x1200", help="WxH, for the asset pack")
+	parser.add_argument("--command", default=DEFAULT_COMMAND, help="session command; {project} is the project dir")
+	parser.add_argument("--remote-project", default=PROJECT_DIR, help="project dir on --hosts")
+	parser.add_argument("--advertise", default=None, help="this host's name as the --hosts should reach it")
+	parser.add_argument("--port", type=int, default=0)
+	parser.add_argument("--restarts", type=int, default=0, help="times to relaunch a session that crashes")
+	args = parser.parse_args(argv)
+
+	screen = [int(i) for i in args.screen.lower().split("x")]
+	hosts = args.hosts.split(",") if args.hosts else []
+	projects = [os.path.abspath(os.path.expanduser(p)) for p in args.projects.split(",")] if args.projects else []
+	if len(set(os.path.realpath(p) for p in projects)) < len(projects):
+		parser.error("--projects lists a project dir more than once; each session needs its own.")
+	if hosts and projects:
+		parser.error("--hosts and --projects can't be combined.")
+	targets = [(h, args.remote_project) for h in hosts] if hosts else [(None, p) for p in projects or [PROJECT_DIR]]
+	for image_f in sorted(set(os.path.realpath(image_dir(p)) for h, p in targets if not h)):
+		prepare_assets(screen, image_f)
+	authkey = binascii.hexlify(os.urandom(16))
+	store = CentralStore(args.db, ("0.0.0.0" if hosts else "127.0.0.1", args.port), authkey)
+	store.start()
+	advertised = args.advertise if args.advertise else (socket.getfqdn() if hosts else "127.0.0.1")
+	address = "{0}:{1}".format(advertised, store.address[1])
+
+	stations = []
+	for i, (host, project) in enumerate(targets):
+		name = host if host else "{0}-{1}".format(socket.gethostname(), i + 1)
+		env = {ENV_STATION: name, ENV_ADDRESS: address, ENV_AUTHKEY: authkey.decode("ascii")}
+		stations.append(Station(name, args.command.format(project=project), env, host, args.restarts))
+	t = time.time()
+	for s in stations:
+		s.launch()
+		print("{0} launched: {1}".format(s.name, s.command))
+	try:
+		while any([s.poll() for s in stations]):
+			time.sleep(1.0)
+	except KeyboardInterrupt:
+		for s in stations:
+			s.terminate()
+	finally:
+		store.stop()
+	print("{0} stations in {1:.0f}s, {2} batches committed".format(len(stations), time.time() - t, store.batches))
+	for s in stations:
+		print("{0:<24} exit {1}  launches {2}  rows {3}".format(s.name, s.returncode, s.launches,
+																 store.stations.get(s.name, 0)))
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,223 @@
+"""A session's raw gaze samples as memory-mapped columns, indexed by trial and by the project's EDF markup.
+
+Usage:
+	python -m waldo.samples <file.asc | file.asc.gz> [<out dir>]
+	python -m waldo.samples <out dir> --trial 143 [--start disc_on:4] [--end fixate:4]
+
+The store is a directory of chunks (time, x, y, pupil; SAMPLE_CHUNK rows per .npy), written in one streaming pass
+over the ASC (waldo.edfpipe's per-trial gzip works as is), plus trials.npy, each trial's [first, stop) sample rows and
+tracker time span, and events.npy, every disc_on/disc_off/fixate/exit/final_saccade/onset_delay message with its
+tracker time. Nothing is read until it's asked for: a query finds its chunks by binary search on their first
+timestamps and its rows by a second one within them, eg.
+
+	store = SampleStore("p12.samples")
+	window = store.window(143, ("disc_on", 4), ("fixate", 4))  # {"time": ..., "x": ..., "y": ..., "pupil": ...}
+
+Binocular recordings keep the first eye's columns. Missing values ('.' in the ASC, ie. blinks) are NaN.
+"""
+from __future__ import print_function
+
+__author__ = "Jonathan Mulle"
+
+import argparse
+import gzip
+import json
+import os
+import shutil
+
+import numpy as np
+
+from waldo.edfcodes import EventCodes
+
+SAMPLE_CHUNK = 2 ** 20  # rows per chunk; ~4 MB per float32 column
+COLUMNS = [("time", "<f8"), ("x", "<f4"), ("y", "<f4"), ("pupil", "<f4")]  # 2 kHz ASCs have half-ms times
+TRIALS = np.dtype([("trial_num", "<i4"), ("first", "<i8"), ("stop", "<i8"), ("start", "<f8"), ("end", "<f8")])
+EVENTS = np.dtype([("trial_num", "<i4"), ("label", "<i2"), ("disc", "<i2"), ("time", "<f8")])
+EVENT_LABELS = ["disc_on", "disc_off", "fixate", "exit", "final_saccade", "onset_delay"]
+
+
+def open_asc(path):
+	return gzip.open(path, "rb") if path.endswith(".gz") else open(path, "rb")
+
+
+def sample_value(s):
+	try:
+		return float(s)
+	except ValueError:
+		return np.nan  # '.', ie. no data
+
+
+def build(asc_f, out_dir, codes=None):
+	"""Writes the store for asc_f to out_dir (replacing any there) and returns the number of samples."""
+	codes = codes if codes else EventCodes()
+	tmp_dir = out_dir.rstrip(os.sep) + ".tmp"
+	if os.path.isdir(tmp_dir):
+		shutil.rmtree(tmp_dir)
+	os.makedirs(tmp_dir)
+	buffers = [[] for c in COLUMNS]
+	chunks = []  # [rows, first time]
+	trials = []
+	events = []
+	count = 0
+	trial = None
+
+	def flush():
+		if not buffers[0]:
+			return
+		i = len(chunks)
+		for (name, dtype), values in zip(COLUMNS, buffers):
+			np.save(os.path.join(tmp_dir, "{0}.{1:05d}.npy".format(name, i)), np.array(values, dtype=dtype))
+		chunks.append([len(buffers[0]), buffers[0][0]])
+		for b in buffers:
+			del b[:]
+
+	with open_asc(asc_f) as f:
+		for line in f:
+			if line[:1].isdigit():
+				fields = line.split(None, 4)
+				if len(fields) < 4:
+					continue
+				for b, v in zip(buffers, fields[:4]):
+					b.append(sample_value(v))
+				count += 1
+				if len(buffers[0]) == SAMPLE_CHUNK:
+					flush()
+			elif line.startswith(b"MSG"):
+				parts = line.decode("ascii", "replace").split(None, 2)
+				parsed = codes.parse(parts[2].rstrip()) if len(parts) == 3 else None
+				if not parsed:
+					continue
+				label, args = parsed
+				t = float(parts[1])
+				if label == "trial_start":
+					trial = [int(args["trial"]), count, count, t, t]
+				elif label == "trial_end" and trial:
+					trial[2], trial[4] = count, t
+					trials.append(tuple(trial))
+					trial = None
+				elif label in EVENT_LABELS and trial:
+					events.append((trial[0], codes.codes[label][2], int(args.get("i", -1)), t))
+	flush()
+	np.save(os.path.join(tmp_dir, "trials.npy"), np.array(trials, dtype=TRIALS))
+	np.save(os.path.join(tmp_dir, "events.npy"), np.array(events, dtype=EVENTS))
+	with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+		json.dump({"source": os.path.basename(asc_f), "samples": count, "chunks": chunks,
+				   "columns": [c[0] for c in COLUMNS]}, f)
+	if os.path.isdir(out_dir):
+		shutil.rmtree(out_dir)
+	os.rename(tmp_dir, out_dir)
+	return count
+
+
+class SampleStore(object):
+
+	def __init__(self, path, codes=None):
+		self.path = path
+		self.codes = codes if codes else EventCodes()
+		with open(os.path.join(path, "meta.json")) as f:
+			self.meta = json.load(f)
+		rows = [c[0] for c in self.meta["chunks"]]
+		self.offsets = np.concatenate([[0], np.cumsum(rows)]).astype(np.int64)  # chunk i holds [offsets[i], offsets[i+1])
+		self.chunk_starts = np.array([c[1] for c in self.meta["chunks"]], dtype=np.float64)
+		self.trials = np.load(os.path.join(path, "trials.npy"))
+		events = np.load(os.path.join(path, "events.npy"))
+		# sorted by trial for trial_events()' binary search; stably, so each trial's events stay in time order. They're
+		# written in file order, which isn't trial order once a recycled trial is redone later
+		self.events = events[np.argsort(events["trial_num"], kind="mergesort")]
+		self.__trial_rows = dict((int(t), i) for i, t in enumerate(self.trials["trial_num"]))
+		self.__chunks = {}
+
+	def __len__(self):
+		return int(self.offsets[-1])
+
+	def chunk(self, name, i):
+		key = (name, i)
+		try:
+			return self.__chunks[key]
+		except KeyError:
+			a = self.__chunks[key] = np.load(os.path.join(self.path, "{0}.{1:05d}.npy".format(name, i)), mmap_mode="r")
+			return a
+
+	def rows(self, first, stop, columns=None):
+		"""Sample rows [first, stop) as {column: array}; a copy only when the range spans chunks."""
+		columns = columns if columns else self.meta["columns"]
+		out = {}
+		if stop <= first:
+			return dict((name, np.empty(0, dtype=dtype)) for name, dtype in COLUMNS if name in columns)
+		c0 = int(np.searchsorted(self.offsets, first, side="right")) - 1
+		c1 = int(np.searchsorted(self.offsets, stop - 1, side="right")) - 1
+		for name in columns:
+			parts = [self.chunk(name, c)[max(first - self.offsets[c], 0):stop - self.offsets[c]] for c in range(c0, c1 + 1)]
+			out[name] = parts[0] if len(parts) == 1 else np.concatenate(parts)
+		return out
+
+	def row_at(self, t, side="left"):
+		"""The sample row of tracker time t, by binary search on the chunks' first times, then within the chunk."""
+		c = max(int(np.searchsorted(self.chunk_starts, t, side="right")) - 1, 0)
+		return int(self.offsets[c] + np.searchsorted(self.chunk("time", c), t, side=side))
+
+	def trial(self, trial_num):
+		try:
+			return self.trials[self.__trial_rows[int(trial_num)]]
+		except KeyError:
+			raise KeyError("No samples for trial {0}.".format(trial_num))
+
+	def trial_events(self, trial_num):
+		trials = self.events["trial_num"]
+		return self.events[np.searchsorted(trials, trial_num):np.searchsorted(trials, trial_num, side="right")]
+
+	def event_time(self, trial_num, label, disc=-1):
+		"""Tracker time of trial_num's first <label> message (for disc, if given), else None."""
+		e = self.trial_events(trial_num)
+		e = e[(e["label"] == self.codes.codes[label][2]) & ((e["disc"] == disc) | (disc == -1))]
+		return float(e["time"][0]) if len(e) else None
+
+	def window(self, trial_num, start=None, end=None, columns=None):
+		"""trial_num's samples from start to end, each a tracker time, a (label, disc) event, or None for the trial's
+		own bounds."""
+		t = self.trial(trial_num)
+		first, stop = int(t["first"]), int(t["stop"])
+		if start is not None:
+			first = max(first, self.row_at(self.__time(trial_num, start)))
+		if end is not None:
+			stop = min(stop, self.row_at(self.__time(trial_num, end), side="right"))
+		return self.rows(first, stop, columns)
+
+	def __time(self, trial_num, bound):
+		if isinstance(bound, tuple):
+			t = self.event_time(trial_num, *bound)
+			if t is None:
+				raise KeyError("Trial {0} has no {1} event.".format(trial_num, bound))
+			return t
+		return bound
+
+
+def event_arg(s):
+	label, _, disc = s.partition(":")
+	return label, int(disc) if disc else -1
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Build or query an indexed gaze-sample store.")
+	parser.add_argument("path", help="an ASC (or .asc.gz) to build from, or a store to query")
+	parser.add_argument("out_dir", nargs="?", default=None, help="default: <asc name>.samples beside it")
+	parser.add_argument("--trial", type=int, default=None)
+	parser.add_argument("--start", type=event_arg, default=None, help="label[:disc], eg. disc_on:4")
+	parser.add_argument("--end", type=event_arg, default=None)
+	args = parser.parse_args(argv)
+
+	if os.path.isdir(args.path):
+		store = SampleStore(args.path)
+		if args.trial is None:
+			print("{0} samples, {1} trials, {2} events".format(len(store), len(store.trials), len(store.events)))
+			return
+		window = store.window(args.trial, args.start, args.end)
+		for row in zip(*[window[c] for c in store.meta["columns"]]):
+			print("\t".join("{0:g}".format(v) for v in row))
+		return
+	out_dir = args.out_dir if args.out_dir else args.path.split(".asc")[0] + ".samples"
+	print("{0} samples written to {1}".format(build(args.path, out_dir), out_dir))
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,237 @@
+"""Runs whole WaldoMkII sessions headlessly, in simulated time, to size a design before piloting it.
+
+Usage:
+	python -m waldo.simulate [--sessions 200] [--min-saccades 5] [--max-saccades 12,14] [--idi 300,False]
+							 [--disc-timeout 800,1000] [--latency 180,30] [--miss-rate 0.02] [--out sweep.json]
+
+Every design parameter (--min-saccades, --max-saccades, --min-amplitude, --max-amplitude, --disc-timeout,
+--final-timeout, --idi, --persist) takes a comma-separated list; the sweep is their product. Each design runs
+--sessions sessions of --trials trials spread evenly over the cells of WaldoMkII_config.csv, as klibs would, across
+a process pool.
+
+A trial follows trial_prep() and trial(): a saccade count drawn as randrange(min, max), a sequence from
+SequenceGenerator (a GenerationError is counted as a generation failure), the initial fixation interval, then for
+each disc the inter-disc onset delay (skipped after a timeout or when discs persist), onset on the next refresh, and
+a synthetic Observer (waldo.fakelink) whose saccade must land within the disc's boundary radius and, but for the
+final disc, end its fixation there before the disc's timeout. Nothing sleeps, so a session takes milliseconds.
+
+Reported per design & cell: generation failure rate, trial duration, per-disc and final-disc timeout rates, the
+distribution of timeouts per trial and the final disc's RT.
+"""
+from __future__ import print_function
+
+__author__ = "Jonathan Mulle"
+
+import argparse
+import itertools
+import json
+import math
+import random
+from multiprocessing import Pool
+
+import numpy as np
+
+from waldo.bench import summarize
+from waldo.compiler import FACTORS, cell_key, disc_surface, geometry_from_ppd, read_factors
+from waldo.fakelink import Observer
+from waldo.targets import SequenceGenerator, GenerationError
+
+DESIGN_KEYS = ["min_saccades", "max_saccades", "min_amplitude_deg", "max_amplitude_deg", "disc_timeout",
+			   "final_timeout", "idi", "persist"]
+# as in WaldoMkII & WaldoMkII_params.py
+DEFAULTS = {"min_saccades": 5, "max_saccades": 12, "min_amplitude_deg": 3, "max_amplitude_deg": 6,
+			"disc_timeout": 1000, "final_timeout": 2000, "idi": 300, "persist": False}
+FIXATION_INTERVAL = 1500  # ms
+DISC_DIAMETER_DEG = 1
+DISC_BOUNDARY_TOLERANCE = 0.5  # deg
+
+
+def design_value(s):
+	if s.lower() in ("false", "none"):
+		return False
+	if s.lower() == "true":
+		return True
+	return float(s) if "." in s else int(s)
+
+
+def cell_name(cell):
+	return "{0}|{1}|{2}".format(*cell)
+
+
+class SessionSimulator(object):
+
+	def __init__(self, design, screen, ppd, observer, refresh_rate=60, seed=None):
+		self.design = design
+		self.geometry = geometry_from_ppd(screen, ppd, design["min_amplitude_deg"], design["max_amplitude_deg"],
+										  DISC_DIAMETER_DEG)
+		disc_diameter = int(DISC_DIAMETER_DEG * ppd)
+		self.boundary_radius = disc_surface(disc_diameter) + int(DISC_BOUNDARY_TOLERANCE * ppd)  # as disc_boundary_radius
+		self.frame = 1000.0 / refresh_rate
+		self.observer = observer
+		self.rng = random.Random(seed)
+		self.final_angles = None
+		self.generator = None
+
+	def run(self, cells, trials):
+		"""Simulates one session; returns {cell name: [trial results]}."""
+		self.final_angles = sorted(set(c[0] for c in cells))
+		g = self.geometry
+		self.generator = SequenceGenerator((g["screen_x"], g["screen_y"]), g["margin"], g["min_amplitude"],
+										   g["max_amplitude"], g["min_separation"], self.final_angles,
+										   seed=self.rng.getrandbits(31))
+		order = (cells * int(math.ceil(trials / float(len(cells)))))[:trials]
+		self.rng.shuffle(order)
+		results = dict((cell_name(c), []) for c in cells)
+		for cell in order:
+			results[cell_name(cell)].append(self.trial(*cell))
+		return results
+
+	def trial(self, angle, bg_state, n_back):
+		d = self.design
+		count = self.rng.randrange(d["min_saccades"], d["max_saccades"])
+		try:
+			seq = self.generator.generate(count, n_back, angle)
+		except GenerationError:
+			return None
+		t = float(FIXATION_INTERVAL)
+		timeouts = []
+		detected = None
+		rt = -1.0
+		for i in range(count):
+			final = i == count - 1
+			if i and detected is not None and d["idi"] and not d["persist"]:
+				t = detected + d["idi"]  # onset_delay() waits from the previous disc's detection
+			onset = math.ceil(t / self.frame) * self.frame  # shown on the next flip
+			deadline = onset + (d["final_timeout"] if final else d["disc_timeout"])
+			target = seq.positions[i]
+			plan = self.observer.plan(target, onset)
+			detected = None
+			if plan:
+				start, end, fix_end, landing = plan
+				landed = math.hypot(landing[0] - target[0], landing[1] - target[1]) <= self.boundary_radius
+				at = end if final else fix_end  # SACCADE_END for the final disc, FIXATE otherwise
+				if landed and at <= deadline:
+					detected = at
+			timeouts.append(detected is None)
+			t = deadline if detected is None else detected
+			if final:
+				rt = -1.0 if detected is None else detected - onset
+		return {"saccades": count, "duration": t, "timeouts": timeouts, "rt": rt}
+
+
+def simulate(task):
+	design_i, design, seed, screen, ppd, observer_args, cells, trials = task
+	observer = Observer(seed=seed, **observer_args)
+	results = SessionSimulator(design, screen, ppd, observer, seed=seed).run(cells, trials)
+	return design_i, results
+
+
+class Tally(object):
+	# per-cell accumulation across sessions; plain lists, as sessions arrive in any order from the pool
+
+	def __init__(self, max_saccades):
+		self.trials = 0
+		self.failures = 0
+		self.durations = []
+		self.rts = []
+		self.final_timeouts = 0
+		self.discs = 0  # non-final discs shown, and those that timed out
+		self.timeouts = 0
+		self.disc_timeouts = np.zeros(max_saccades, dtype=np.int64)  # by disc position
+		self.disc_counts = np.zeros(max_saccades, dtype=np.int64)
+		self.per_trial = np.zeros(max_saccades + 1, dtype=np.int64)  # trials with k timeouts
+
+	def add(self, trial):
+		self.trials += 1
+		if trial is None:
+			self.failures += 1
+			return
+		n = len(trial["timeouts"])
+		self.durations.append(trial["duration"])
+		self.disc_timeouts[:n] += trial["timeouts"]
+		self.disc_counts[:n] += 1
+		self.per_trial[sum(trial["timeouts"])] += 1
+		self.discs += n - 1
+		self.timeouts += sum(trial["timeouts"][:-1])
+		if trial["timeouts"][-1]:
+			self.final_timeouts += 1
+		else:
+			self.rts.append(trial["rt"])
+
+	def report(self):
+		completed = self.trials - self.failures
+		used = self.disc_counts > 0
+		return {"trials": self.trials,
+				"generation_failure_rate": self.failures / float(self.trials) if self.trials else 0.0,
+				"duration_ms": summarize(self.durations),
+				"final_rt_ms": summarize(self.rts),
+				"final_timeout_rate": self.final_timeouts / float(completed) if completed else 0.0,
+				"disc_timeout_rate": self.timeouts / float(self.discs) if self.discs else 0.0,
+				"timeout_rate_by_disc": (self.disc_timeouts[used] / self.disc_counts[used].astype(float)).tolist(),
+				"timeouts_per_trial": self.per_trial[:int(np.nonzero(self.per_trial)[0].max()) + 1].tolist()
+				if self.per_trial.any() else []}
+
+
+def sweep(designs, sessions, trials, screen, ppd, observer_args, processes=None, seed=1, factors=None):
+	factors = factors if factors else read_factors()
+	cells = [cell_key(*c) for c in itertools.product(*[factors[f] for f in FACTORS])]
+	tallies = [dict((cell_name(c), Tally(d["max_saccades"])) for c in cells) for d in designs]
+	seeds = random.Random(seed)
+	tasks = [(i, d, seeds.getrandbits(31), screen, ppd, observer_args, cells, trials)
+			 for i, d in enumerate(designs) for s in range(sessions)]
+	pool = Pool(processes)
+	try:
+		for design_i, results in pool.imap_unordered(simulate, tasks, chunksize=max(1, len(tasks) // 64)):
+			for cell, rows in results.items():
+				tally = tallies[design_i][cell]
+				for row in rows:
+					tally.add(row)
+	finally:
+		pool.close()
+		pool.join()
+	return [{"design": d, "cells": dict((c, t.report()) for c, t in sorted(tallies[i].items()))}
+			for i, d in enumerate(designs)]
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Simulate WaldoMkII sessions across a sweep of design parameters.")
+	for key in DESIGN_KEYS:
+		flag = "--" + key.replace("_deg", "").replace("_", "-")
+		parser.add_argument(flag, dest=key, default=str(DEFAULTS[key]), help="comma-separated; default %(default)s")
+	parser.add_argument("--sessions", type=int, default=200, help="per design")
+	parser.add_argument("--trials", type=int, default=216, help="per session; trials_per_block * blocks by default")
+	parser.add_argument("--screen", default="1920x1200")
+	parser.add_argument("--ppd", type=float, default=43)
+	parser.add_argument("--latency", default="180,30", help="observer saccade latency mean,sd (ms)")
+	parser.add_argument("--saccade", default="40,5", help="observer saccade duration mean,sd (ms)")
+	parser.add_argument("--fixation", default="220,40", help="observer fixation duration mean,sd (ms)")
+	parser.add_argument("--landing-sd", type=float, default=8.0, help="observer landing error sd (px)")
+	parser.add_argument("--miss-rate", type=float, default=0.0, help="fraction of discs the observer ignores")
+	parser.add_argument("--processes", type=int, default=None)
+	parser.add_argument("--seed", type=int, default=1)
+	parser.add_argument("--out", help="write the full report here as json")
+	args = parser.parse_args(argv)
+
+	axes = [[design_value(v) for v in getattr(args, k).split(",")] for k in DESIGN_KEYS]
+	designs = [dict(zip(DESIGN_KEYS, values)) for values in itertools.product(*axes)]
+	observer_args = {"latency": tuple(float(v) for v in args.latency.split(",")),
+					 "saccade": tuple(float(v) for v in args.saccade.split(",")),
+					 "fixation": tuple(float(v) for v in args.fixation.split(",")),
+					 "landing_sd": args.landing_sd, "miss_rate": args.miss_rate}
+	screen = [int(i) for i in args.screen.lower().split("x")]
+	report = sweep(designs, args.sessions, args.trials, screen, args.ppd, observer_args, args.processes, args.seed)
+	for r in report:
+		print(" ".join("{0}={1}".format(k, r["design"][k]) for k in DESIGN_KEYS))
+		for cell, c in sorted(r["cells"].items()):
+			print("  {0:<18} gen_fail {1:>6.2%}  duration p50 {2:>7.0f} p95 {3:>7.0f}  disc_to {4:>6.2%}  "
+				  "final_to {5:>6.2%}".format(cell, c["generation_failure_rate"], c["duration_ms"].get("p50", 0),
+											  c["duration_ms"].get("p95", 0), c["disc_timeout_rate"],
+											  c["final_timeout_rate"]))
+	if args.out:
+		with open(args.out, "w") as f:
+			json.dump({"observer": observer_args, "sessions": args.sessions, "trials": args.trials, "designs": report},
+					  f, indent=1, sort_keys=True)
+
+
+if __name__ == "__main__":
+	main()
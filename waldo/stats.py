@@ -0,0 +1,198 @@
+__author__ = "Jonathan Mulle"
+
+import json
+import os
+import threading
+import time
+
+try:
+	from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+	from http.server import HTTPServer, BaseHTTPRequestHandler
+
+from waldo.files import replace
+
+QUANTILES = [0.1, 0.5, 0.9]
+
+
+class RunningStats(object):
+	"""Count, mean, variance, min & max in constant memory (Welford's update, so no catastrophic cancellation)."""
+
+	def __init__(self):
+		self.n = 0
+		self.mean = 0.0
+		self.m2 = 0.0
+		self.min = None
+		self.max = None
+
+	def add(self, x):
+		self.n += 1
+		delta = x - self.mean
+		self.mean += delta / self.n
+		self.m2 += delta * (x - self.mean)
+		self.min = x if self.min is None else min(self.min, x)
+		self.max = x if self.max is None else max(self.max, x)
+
+	@property
+	def variance(self):
+		return self.m2 / (self.n - 1) if self.n > 1 else 0.0
+
+	def as_dict(self):
+		return {"n": self.n, "mean": self.mean if self.n else None, "sd": self.variance ** 0.5 if self.n else None,
+				"min": self.min, "max": self.max}
+
+
+class P2Quantile(object):
+	"""One quantile estimated in constant memory by the P-squared algorithm (Jain & Chlamtac, 1985).
+
+	Five markers track the minimum, p/2, p, (1+p)/2 quantiles and the maximum; each observation nudges them with a
+	piecewise-parabolic fit, so nothing is stored. Exact until the fifth observation.
+	"""
+
+	def __init__(self, p):
+		self.p = p
+		self.q = []  # marker heights
+		self.n = [0, 1, 2, 3, 4]  # marker positions
+		self.desired = [0, 2 * p, 4 * p, 2 + 2 * p, 4]
+		self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+	def add(self, x):
+		q, n = self.q, self.n
+		if len(q) < 5:
+			q.append(x)
+			q.sort()
+			return
+		if x < q[0]:
+			q[0] = x
+			k = 0
+		elif x >= q[4]:
+			q[4] = x
+			k = 3
+		else:
+			k = 0
+			while x >= q[k + 1]:
+				k += 1
+		for i in range(k + 1, 5):
+			n[i] += 1
+		for i in range(5):
+			self.desired[i] += self.increments[i]
+		for i in (1, 2, 3):
+			d = self.desired[i] - n[i]
+			if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+				d = 1 if d > 0 else -1
+				h = q[i] + d / float(n[i + 1] - n[i - 1]) * ((n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+															 + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+				if not q[i - 1] < h < q[i + 1]:  # parabola overshot a neighbour; fall back to linear
+					h = q[i] + d * (q[i + d] - q[i]) / float(n[i + d] - n[i])
+				q[i] = h
+				n[i] += d
+
+	@property
+	def value(self):
+		if not self.q:
+			return None
+		if len(self.q) < 5:
+			return self.q[min(len(self.q) - 1, int(round(self.p * (len(self.q) - 1))))]
+		return self.q[2]
+
+
+class CellStats(object):
+	# everything tracked for one (angle, bg_state, n_back) cell; fixed size however long the session runs
+
+	def __init__(self, quantiles=QUANTILES):
+		self.trials = 0
+		self.final_timeouts = 0
+		self.discs = 0  # non-final discs, and how many of them timed out
+		self.disc_timeouts = 0
+		self.srt = RunningStats()  # final-disc saccadic RT (as trial_locations.rt), of trials it didn't time out
+		self.quantiles = [P2Quantile(p) for p in quantiles]
+
+	def add(self, final_timed_out, srt, discs=0, disc_timeouts=0):
+		self.trials += 1
+		self.discs += discs
+		self.disc_timeouts += disc_timeouts
+		if final_timed_out:
+			self.final_timeouts += 1
+			return
+		self.srt.add(srt)
+		for q in self.quantiles:
+			q.add(srt)
+
+	def as_dict(self):
+		d = {"trials": self.trials,
+			 "final_timeouts": self.final_timeouts,
+			 "final_timeout_rate": self.final_timeouts / float(self.trials) if self.trials else None,
+			 "disc_timeout_rate": self.disc_timeouts / float(self.discs) if self.discs else None,
+			 "srt": self.srt.as_dict()}
+		d["srt"].update(("p{0:g}".format(q.p * 100), q.value) for q in self.quantiles)
+		return d
+
+
+class OnlineStats(object):
+	"""Per-cell running statistics for a live session, published as a JSON status file and optionally over HTTP.
+
+	write() replaces status_f atomically (write, then rename), so a monitor never reads half a file; serve() answers
+	GET on 127.0.0.1:port with the same document from a daemon thread, ie. neither touches the session's database.
+	"""
+
+	def __init__(self, status_f, station=None, participant_id=None):
+		self.status_f = status_f
+		self.station = station
+		self.participant_id = participant_id
+		self.cells = {}  # "angle|bg_state|n_back": CellStats
+		self.total = CellStats()
+		self.started = time.time()
+		self.document = b"{}"
+		self.server = None
+
+	def add(self, cell, final_timed_out, srt, discs=0, disc_timeouts=0):
+		key = "{0}|{1}|{2}".format(*cell)
+		try:
+			stats = self.cells[key]
+		except KeyError:
+			stats = self.cells[key] = CellStats()
+		stats.add(final_timed_out, srt, discs, disc_timeouts)
+		self.total.add(final_timed_out, srt, discs, disc_timeouts)
+
+	def status(self):
+		return {"station": self.station, "participant_id": self.participant_id, "updated": time.time(),
+				"started": self.started, "total": self.total.as_dict(),
+				"cells": dict((k, c.as_dict()) for k, c in self.cells.items())}
+
+	def write(self):
+		self.document = json.dumps(self.status(), sort_keys=True).encode("utf-8")
+		directory = os.path.dirname(self.status_f)
+		if directory and not os.path.isdir(directory):
+			os.makedirs(directory)
+		tmp_f = self.status_f + ".tmp"
+		with open(tmp_f, "wb") as f:
+			f.write(self.document)
+		replace(tmp_f, self.status_f)
+
+	def serve(self, port, host="127.0.0.1"):
+		stats = self
+
+		class Handler(BaseHTTPRequestHandler):
+
+			def do_GET(self):
+				document = stats.document
+				self.send_response(200)
+				self.send_header("Content-Type", "application/json")
+				self.send_header("Content-Length", str(len(document)))
+				self.end_headers()
+				self.wfile.write(document)
+
+			def log_message(self, *args):
+				pass  # the session's console isn't for request logs
+
+		self.server = HTTPServer((host, port), Handler)
+		t = threading.Thread(target=self.server.serve_forever)
+		t.daemon = True
+		t.start()
+		return self.server.server_address
+
+	def close(self):
+		if self.server:
+			self.server.shutdown()
+			self.server.server_close()
+			self.server = None
@@ -0,0 +1,181 @@
+__author__ = "Jonathan Mulle"
+
+import os
+import sqlite3
+import threading
+from multiprocessing.connection import Listener, Client
+
+try:
+	from Queue import Queue
+except ImportError:
+	from queue import Queue
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCHEMA_F = os.path.join(PROJECT_DIR, "ExpAssets", "Config", "WaldoMkII_schema.sql")
+# set by waldo.runner for each session it launches
+ENV_STATION = "WALDO_STATION"
+ENV_ADDRESS = "WALDO_STORE"  # host:port
+ENV_AUTHKEY = "WALDO_STORE_KEY"
+
+
+def parse_address(address):
+	host, port = address.rsplit(":", 1)
+	return host, int(port)
+
+
+class CentralStore(object):
+	"""One sqlite (WAL) database that every station's TrialDataWriter streams its trial batches into.
+
+	Stations connect over multiprocessing.connection; a single writer thread owns the database, so commits never
+	contend. Every table gets a station column. Stations number their trials independently, so a forwarded trials
+	row (sent with its local id as trial_id) is inserted first and the trial_id of the rest of its batch is remapped
+	to the central id; station_trials records the mapping. participant_id stays station-local, ie. qualify it by
+	station.
+	"""
+
+	def __init__(self, db_path, address=("127.0.0.1", 0), authkey=b"waldo", schema_f=SCHEMA_F):
+		self.db_path = db_path
+		self.listener = Listener(address, authkey=authkey)
+		self.address = self.listener.address
+		self.queue = Queue()
+		self.stations = {}  # station: rows written
+		self.batches = 0
+		self.running = False
+		self.threads = []
+		if not os.path.isfile(db_path):
+			self.__create(schema_f)
+
+	def start(self):
+		self.running = True
+		for target in [self.__accept, self.__write_loop]:
+			t = threading.Thread(target=target)
+			t.daemon = True
+			t.start()
+			self.threads.append(t)
+
+	def stop(self):
+		# writes everything already received, then closes
+		self.running = False
+		self.queue.put(None)
+		self.threads[1].join()
+		self.listener.close()
+
+	def __create(self, schema_f):
+		c = sqlite3.connect(self.db_path)
+		with open(schema_f) as f:
+			c.executescript(f.read())
+		q = "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'"
+		tables = [r[0] for r in c.execute(q)]
+		for table in tables:
+			c.execute("ALTER TABLE {0} ADD COLUMN station text".format(table))
+		c.execute("CREATE TABLE station_trials (station text not null, local_trial_id integer not null, "
+				  "trial_id integer not null, primary key (station, local_trial_id))")
+		c.commit()
+		c.close()
+
+	def __accept(self):
+		while self.running:
+			try:
+				conn = self.listener.accept()
+			except (IOError, OSError, EOFError):
+				if not self.running:
+					return
+				continue
+			t = threading.Thread(target=self.__receive, args=(conn,))
+			t.daemon = True
+			t.start()
+
+	def __receive(self, conn):
+		station = None
+		try:
+			while True:
+				message = conn.recv()
+				if message[0] == "hello":
+					station = message[1]
+					self.stations.setdefault(station, 0)
+				elif message[0] == "batch":
+					self.queue.put((conn, station, message[1], message[2]))
+		except (EOFError, IOError, OSError):
+			conn.close()
+
+	def __write_loop(self):
+		c = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+		c.execute("PRAGMA journal_mode=WAL")
+		c.execute("PRAGMA synchronous=NORMAL")
+		while True:
+			item = self.queue.get()
+			if item is None:
+				c.close()
+				return
+			conn, station, seq, batch = item
+			try:
+				self.__write(c, station, batch)
+				reply = ("ok", seq)
+			except Exception as e:
+				reply = ("error", seq, repr(e))
+			try:
+				conn.send(reply)
+			except (IOError, OSError):
+				pass
+
+	def __write(self, c, station, batch):
+		c.execute("BEGIN IMMEDIATE")
+		try:
+			trial_ids = {}
+			for table, columns, rows in sorted(batch, key=lambda b: b[0] != "trials"):
+				if table == "trials":
+					i = columns.index("trial_id")  # the station's own id for it, as stamped by TrialDataWriter.flush()
+					columns = [col for col in columns if col != "trial_id"] + ["station"]
+					q = "INSERT INTO trials ({0}) VALUES ({1})".format(", ".join(columns), ", ".join("?" * len(columns)))
+					for row in rows:
+						cur = c.execute(q, row[:i] + row[i + 1:] + [station])
+						trial_ids[row[i]] = cur.lastrowid
+						c.execute("INSERT INTO station_trials VALUES (?, ?, ?)", [station, row[i], cur.lastrowid])
+				else:
+					if "trial_id" in columns:
+						i = columns.index("trial_id")
+						rows = [row[:i] + [trial_ids.get(row[i], row[i])] + row[i + 1:] for row in rows]
+					columns = columns + ["station"]
+					q = "INSERT INTO {0} ({1}) VALUES ({2})".format(table, ", ".join(columns), ", ".join("?" * len(columns)))
+					c.executemany(q, [row + [station] for row in rows])
+				self.stations[station] = self.stations.get(station, 0) + len(rows)
+			c.execute("COMMIT")
+		except Exception:
+			c.execute("ROLLBACK")
+			raise
+		self.batches += 1
+
+
+class StoreClient(object):
+	"""A station's connection to the CentralStore; send() a batch, then wait() until it has been committed."""
+
+	def __init__(self, address, authkey, station):
+		self.station = station
+		self.conn = Client(address, authkey=authkey)
+		self.conn.send(("hello", station))
+		self.seq = 0
+		self.unacked = 0
+
+	@classmethod
+	def from_env(cls):
+		# None unless this session was launched by waldo.runner
+		address = os.environ.get(ENV_ADDRESS)
+		if not address:
+			return None
+		return cls(parse_address(address), os.environ[ENV_AUTHKEY].encode("ascii"), os.environ[ENV_STATION])
+
+	def send(self, batch):
+		self.seq += 1
+		self.conn.send(("batch", self.seq, batch))
+		self.unacked += 1
+
+	def wait(self):
+		while self.unacked:
+			reply = self.conn.recv()
+			self.unacked -= 1
+			if reply[0] == "error":
+				raise RuntimeError("Central store rejected batch {0}: {1}".format(reply[1], reply[2]))
+
+	def close(self):
+		self.wait()
+		self.conn.close()
@@ -0,0 +1,35 @@
+__author__ = "Jonathan Mulle"
+
+# The change instructions' summary layout: per-target SRT (or timeout) and X/Y in reverse order, so target 1 is the
+# final disc, 2 the one before it, etc. Positions are fixed so analysis code can read a given column without pivoting.
+WIDE_TARGETS = 12  # WaldoMkII.max_saccades
+WIDE_FIELDS = [("srt", "<f8"), ("timed_out", "i1"), ("x", "<i4"), ("y", "<i4")]  # -1 where a trial had no such target
+
+
+def wide_columns(n=WIDE_TARGETS):
+	return ["{0}_{1}".format(field, k) for k in range(1, n + 1) for field, dtype in WIDE_FIELDS]
+
+
+def wide_dtypes(n=WIDE_TARGETS):
+	return [("{0}_{1}".format(field, k), dtype) for k in range(1, n + 1) for field, dtype in WIDE_FIELDS]
+
+
+def is_true(v):
+	# booleans arrive as python bools, 0/1, or klibs' "TRUE"/"FALSE" strings depending on who wrote the row
+	return str(v).upper() in ("1", "TRUE")
+
+
+def pivot(locations, n=WIDE_TARGETS):
+	"""Flattens one trial's locations (dicts with location_num, x, y, rt & timed_out) into a wide row.
+
+	A timed-out target's srt is -1; unused positions are -1 throughout.
+	"""
+	row = dict((c, -1) for c in wide_columns(n))
+	ordered = sorted(locations, key=lambda l: l["location_num"], reverse=True)
+	for k, l in enumerate(ordered[:n], 1):
+		timed_out = is_true(l["timed_out"])
+		row["srt_{0}".format(k)] = -1.0 if timed_out else float(l["rt"])
+		row["timed_out_{0}".format(k)] = int(timed_out)
+		row["x_{0}".format(k)] = int(l["x"])
+		row["y_{0}".format(k)] = int(l["y"])
+	return row
@@ -0,0 +1,161 @@
+__author__ = "Jonathan Mulle"
+
+import numpy as np
+
+from waldo.geometry import PenultimateRegion
+
+DEFAULT_FINAL_ANGLES = tuple(range(0, 360, 60))
+
+
+class GenerationError(RuntimeError):
+	pass
+
+# one row per disc: its geometry, then the state the trial loop fills in; times are -1 until they happen, timed_out is
+# -1 until the disc is either fixated (0) or times out (1)
+LOCATION = np.dtype([("x", "<i4"), ("y", "<i4"), ("amplitude", "<i4"), ("angle", "<i4"), ("rotation", "<f8"),
+					 ("n_back", "?"), ("penultimate", "?"), ("final", "?"), ("allow_blit", "?"), ("initial_blit", "?"),
+					 ("timed_out", "i1"), ("rt", "<f8"), ("onset_due", "<f8"), ("onset_error", "<f8"),
+					 ("on_trial_time", "<f8"), ("on_el_time", "<f8"), ("off_trial_time", "<f8"), ("off_el_time", "<f8"),
+					 ("fixate_trial_time", "<f8"), ("fixate_el_time", "<f8"), ("exit_trial_time", "<f8"),
+					 ("exit_el_time", "<f8")])
+RECORD_FIELDS = ["x", "y", "amplitude", "angle", "n_back", "penultimate", "final", "rt", "fixate_trial_time",
+				 "fixate_el_time", "onset_error"]
+
+
+def location_records(locations):
+	"""A LOCATION array as trial_locations rows of plain python values (less the trial's identifying columns)."""
+	columns = dict((f, locations[f].tolist()) for f in RECORD_FIELDS)
+	columns["timed_out"] = (locations["timed_out"] == 1).tolist()
+	columns["location_num"] = list(range(len(locations)))
+	return [dict((k, v[i]) for k, v in columns.items()) for i in range(len(locations))]
+
+
+class TargetSequence(object):
+
+	def __init__(self, positions, amplitudes, angles, rotations, n_back_index):
+		self.positions = positions  # (saccade_count, 2) int array
+		self.amplitudes = amplitudes
+		self.angles = angles
+		self.rotations = rotations  # only non-zero for the final disc
+		self.n_back_index = n_back_index
+
+	def __len__(self):
+		return len(self.positions)
+
+	def to_array(self):
+		n = len(self)
+		a = np.zeros(n, dtype=LOCATION)
+		for f, t in LOCATION.fields.items():
+			if t[0].kind in "fi":
+				a[f] = -1
+		a["x"], a["y"] = self.positions[:, 0], self.positions[:, 1]
+		a["amplitude"] = self.amplitudes
+		a["angle"] = self.angles
+		a["rotation"] = self.rotations
+		a["allow_blit"] = True
+		a["final"][n - 1] = True
+		if n > 1:
+			a["penultimate"][n - 2] = True
+		a["n_back"][self.n_back_index] = True
+		return a
+
+	def location(self, i):
+		# plain python types, as handed to the eyelink & database
+		return [tuple(int(v) for v in self.positions[i]), int(self.amplitudes[i]), int(self.angles[i]),
+				float(self.rotations[i])]
+
+
+class SequenceGenerator(object):
+	"""Samples whole disc sequences in batches and keeps the first one satisfying every placement constraint.
+
+	Each batch is a (batch_size, saccade_count - 2) draw of amplitudes and angles walked out from the screen centre
+	and masked by the display margin in one pass. The penultimate disc is then drawn from its feasible region (see
+	waldo.geometry.PenultimateRegion), so n-back separation and penultimate viability (every final angle must land
+	on-screen) hold by construction, for any set of final angles. A path is only passed over if it leaves no such
+	region at all, so generation is bounded by max_batches and never recurses. Positions are truncated to ints
+	after each step, exactly as klibs' point_pos() does.
+	"""
+
+	def __init__(self, screen_x_y, margin, min_amplitude, max_amplitude, min_separation,
+				 final_angles=DEFAULT_FINAL_ANGLES, batch_size=512, max_batches=16, seed=None):
+		self.screen_x, self.screen_y = screen_x_y
+		self.origin = (self.screen_x // 2, self.screen_y // 2)
+		self.margin = margin
+		self.min_amplitude = int(min_amplitude)
+		self.max_amplitude = int(max_amplitude)
+		self.min_separation = min_separation  # minimum penultimate to n-back distance
+		self.final_angles = np.radians(np.asarray(final_angles, dtype=np.float64))
+		self.batch_size = batch_size
+		self.max_batches = max_batches
+		self.rng = np.random.RandomState(seed)
+		self.batches = 0  # running count, for diagnostics
+
+	def generate(self, saccade_count, n_back, angle):
+		n_back_index = saccade_count - (2 + n_back)  # 1 for index, 1 b/c n_back counts from penultimate saccade
+		if n_back_index < 0:
+			raise GenerationError("Too few saccades ({0}) for an n_back of {1}.".format(saccade_count, n_back))
+		for i in range(self.max_batches):
+			self.batches += 1
+			seq = self.__sample(saccade_count, n_back_index, angle)
+			if seq is not None:
+				return seq
+		msg = "No viable {0}-saccade sequence in {1} candidates."
+		raise GenerationError(msg.format(saccade_count, self.max_batches * self.batch_size))
+
+	def in_bounds(self, x, y):
+		m = self.margin
+		return (x > m) & (x < self.screen_x - m) & (y > m) & (y < self.screen_y - m)
+
+	def __sample(self, saccade_count, n_back_index, angle):
+		n = self.batch_size
+		steps = saccade_count - 2  # the penultimate disc is drawn from its feasible region, the final one derived
+		amps = self.rng.randint(self.min_amplitude, self.max_amplitude, (n, steps))
+		angs = self.rng.randint(0, 360, (n, steps))
+		rads = np.radians(angs)
+		xs = np.empty((n, steps))
+		ys = np.empty((n, steps))
+		x = np.full(n, self.origin[0], dtype=np.float64)
+		y = np.full(n, self.origin[1], dtype=np.float64)
+		for i in range(steps):
+			x = np.trunc(x + amps[:, i] * np.cos(rads[:, i]))
+			y = np.trunc(y + amps[:, i] * np.sin(rads[:, i]))
+			xs[:, i] = x
+			ys[:, i] = y
+
+		final_angles = np.append(self.final_angles, np.radians(angle))
+		bounds = (self.margin, self.margin, self.screen_x - self.margin, self.screen_y - self.margin)
+		for r in np.flatnonzero(self.in_bounds(xs, ys).all(axis=1)):
+			region = PenultimateRegion(bounds, (xs[r, -1], ys[r, -1]), (xs[r, n_back_index], ys[r, n_back_index]),
+									   final_angles, self.min_amplitude, self.max_amplitude, self.min_separation)
+			step = region.sample(self.rng)
+			if step is None:  # this path boxed the n-back disc in; no penultimate position works for every angle
+				continue
+			p_angle, p_amp = step
+			p_x = np.trunc(xs[r, -1] + p_amp * np.cos(np.radians(p_angle)))
+			p_y = np.trunc(ys[r, -1] + p_amp * np.sin(np.radians(p_angle)))
+
+			# penultimate -> n-back geometry; the final disc is placed at the n-back's distance, rotated by angle
+			dx, dy = xs[r, n_back_index] - p_x, ys[r, n_back_index] - p_y
+			dist = np.hypot(dx, dy)
+			theta = np.arctan2(dy, dx)
+			final_amp = np.trunc(dist)
+			final_x = np.trunc(p_x + final_amp * np.cos(theta + np.radians(angle)))
+			final_y = np.trunc(p_y + final_amp * np.sin(theta + np.radians(angle)))
+			# the region's slack makes this a formality, but positions are checked exactly all the same
+			viable = dist >= self.min_separation and self.in_bounds(final_x, final_y)
+			viable = viable and self.in_bounds(np.trunc(p_x + dist * np.cos(theta + final_angles)),
+											   np.trunc(p_y + dist * np.sin(theta + final_angles))).all()
+			if not viable:
+				continue
+
+			positions = np.empty((saccade_count, 2), dtype=np.int64)
+			positions[:steps, 0] = xs[r]
+			positions[:steps, 1] = ys[r]
+			positions[steps] = (p_x, p_y)
+			positions[-1] = (final_x, final_y)
+			amplitudes = np.append(amps[r], [p_amp, final_amp])
+			angles = np.append(angs[r], [p_angle, angle])
+			rotations = np.zeros(saccade_count)
+			rotations[-1] = np.degrees(theta)
+			return TargetSequence(positions, amplitudes, angles, rotations, n_back_index)
+		return None
@@ -0,0 +1,115 @@
+__author__ = "Jonathan Mulle"
+
+import json
+import os
+import sys
+import time
+
+clock = getattr(time, "perf_counter", time.time)  # time.time() on python 2, which is sub-ms on OS X & linux
+
+
+class Scheduler(object):
+	"""Waits out trial timeline intervals without spinning the whole time.
+
+	wait_until() sleeps in slices of service_interval, calling service() between them so the tracker and
+	ui_request() are still attended to, until spin_window before the deadline; it then spins for precision. The
+	onset error (how late the wait returned, in ms) of every wait is logged against its label.
+
+	A thread waking from sleep has to win the GIL back, and a busy thread (ie. the gaze monitor) only gives it up
+	every switch interval (5 ms by default), so while sleeping the interval is lowered to switch_interval. It is
+	restored for the spin, which then keeps the GIL rather than trading it back and forth through the final window.
+	"""
+
+	def __init__(self, spin_window=0.002, service_interval=0.001, switch_interval=0.0001):
+		self.spin_window = spin_window
+		self.service_interval = service_interval
+		self.switch_interval = switch_interval  # s; None leaves the interpreter's alone (as python 2 must)
+		self.log = []  # [label, onset error (ms)]
+
+	def deadline(self, interval_ms):
+		return clock() + interval_ms / 1000.0
+
+	def wait_until(self, label, deadline, service=None):
+		restore = None
+		if self.switch_interval and hasattr(sys, "setswitchinterval"):
+			restore = sys.getswitchinterval()
+			sys.setswitchinterval(self.switch_interval)
+		try:
+			self.__sleep(deadline, service)
+		finally:
+			if restore:
+				sys.setswitchinterval(restore)  # and hold the GIL through the spin
+		while clock() < deadline:
+			pass
+		error = (clock() - deadline) * 1000.0
+		self.log.append([label, error])
+		return error
+
+	def __sleep(self, deadline, service):
+		while True:
+			remaining = deadline - clock()
+			if remaining <= self.spin_window:
+				break
+			if service:
+				service()
+				remaining = deadline - clock()
+			if remaining > self.spin_window:
+				time.sleep(min(remaining - self.spin_window, self.service_interval))
+
+	def wait(self, label, interval_ms, service=None):
+		return self.wait_until(label, self.deadline(interval_ms), service)
+
+	def reset(self):
+		self.log = []
+
+
+def process_start():
+	"""Wall time (time.time()) this process started, from /proc on linux; None where that isn't available."""
+	try:
+		with open("/proc/self/stat") as f:
+			ticks = float(f.read().rsplit(")", 1)[1].split()[19])  # starttime, in clock ticks after boot
+		with open("/proc/stat") as f:
+			boot = float([l.split()[1] for l in f if l.startswith("btime")][0])
+		return boot + ticks / os.sysconf("SC_CLK_TCK")
+	except (IOError, OSError, IndexError, ValueError, AttributeError):
+		return None
+
+
+class StartupProfile(object):
+	"""Wall-clock phases from process start (or, failing that, from this object's creation) to the first screen.
+
+	mark(phase) closes the phase ending now; report() returns [phase, seconds, seconds since start] rows, and log()
+	appends them as a JSON line, so time to first screen can be compared across sessions & versions.
+	"""
+
+	def __init__(self):
+		self.created = time.time()
+		started = process_start()
+		self.start = started if started and started <= self.created else self.created
+		self.marks = [["python & klibs", self.created]] if self.start < self.created else []
+		self.reported = False
+
+	def mark(self, phase):
+		self.marks.append([phase, time.time()])
+
+	def report(self):
+		rows = []
+		last = self.start
+		for phase, t in self.marks:
+			rows.append([phase, t - last, t - self.start])
+			last = t
+		return rows
+
+	def log(self, path, **fields):
+		rows = self.report()
+		entry = dict(fields, started=self.start, first_screen_s=rows[-1][2] if rows else None,
+					 phases=[[phase, seconds] for phase, seconds, total in rows])
+		directory = os.path.dirname(path)
+		if directory and not os.path.isdir(directory):
+			os.makedirs(directory)
+		with open(path, "a") as f:
+			f.write(json.dumps(entry, sort_keys=True) + "\n")
+		return entry
+
+	def format(self):
+		return "\n".join("{0:<24} {1:>8.3f}s  {2:>8.3f}s".format(*row) for row in self.report())